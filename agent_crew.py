@@ -4,10 +4,18 @@ CrewAI Multi-Agent System
 """
 
 from crewai import Agent, Task, Crew, Process
-from langchain_google_genai import ChatGoogleGenerativeAI
 from typing import List, Dict, Optional
+import copy
+import threading
 import streamlit as st
 
+from llm_backend import get_crewai_llm, kickoff_crew
+from generation_engine import GenerationEngine, run_sync
+from circuit_breaker import CircuitOpenError
+from memory_store import GroupMessageLog, ConversationHistory, CharacterMemoryProvider
+from deadline import Deadline, DeadlineExceeded
+from cancellation import CancellationToken, RoundCancelled
+
 
 class CharacterAgentCrew:
     """
@@ -15,7 +23,11 @@ class CharacterAgentCrew:
     封装 CrewAI 的复杂性，提供简单的 API
     """
 
-    def __init__(self, scene: str, characters: List[Dict[str, str]], api_key: str, model_id: str = "gemini-2.0-flash-exp", user_character: Optional[Dict[str, str]] = None):
+    # v3.5.0: 上下文中保留原文的最近消息数（群聊记录与降级方案的历史共用）
+    RECENT_WINDOW = 10
+
+    def __init__(self, scene: str, characters: List[Dict[str, str]], api_key: str, model_id: str = "gemini-2.0-flash-exp", user_character: Optional[Dict[str, str]] = None,
+                 crewai_memory: bool = False):
         """
         初始化 Agent 团队
 
@@ -25,34 +37,40 @@ class CharacterAgentCrew:
             api_key: Google API Key
             model_id: Gemini 模型 ID (默认: gemini-2.0-flash-exp)
             user_character: 用户角色信息 {'name': '...', 'personality': '...'} (可选)
+            crewai_memory: 是否启用 CrewAI 内置记忆（v3.5.0 起默认关闭，记忆由 Scriptforge 记忆层提供）
         """
         self.scene = scene
-        self.characters = characters
+        self.characters = list(characters)  # v3.5.0: 自有副本，由 add/remove/update_character 增量维护
         self.api_key = api_key
         self.model_id = model_id
         self.user_character = user_character or {'name': '你', 'personality': ''}
+        self.crewai_memory = crewai_memory
 
-        # 初始化 Gemini LLM
-        self.llm = ChatGoogleGenerativeAI(
-            model=model_id,
-            google_api_key=api_key,
-            temperature=0.7,
-            convert_system_message_to_human=True  # 兼容性设置
-        )
+        # 初始化 Gemini LLM（v3.5.0: 进程级共享，跨会话复用；后端可切换为本地模拟）
+        self.llm = get_crewai_llm(api_key, model_id, temperature=0.7)
+
+        # v3.5.0: 同一时刻只执行一轮 / 修改一次角色（预生成使用 speculative_crew() 的独立 Agents）
+        self._run_lock = threading.RLock()
+        # v3.5.0: 保护对话历史的写入与快照（预生成分身在主线程取快照，不等待进行中的一轮）
+        self._history_lock = threading.Lock()
+        self._speculative: Optional['CharacterAgentCrew'] = None
 
         # 创建 Agents
         self.agents = self._create_agents()
 
         # 对话历史（用于 Agent 间共享上下文）
-        self.conversation_history = []
+        # v3.5.0: 有界环形缓冲 + 滚动摘要，会话内存占用恒定；
+        # 缓冲区与上下文中的群聊原文窗口等长，摘要只覆盖窗口之前的消息，两者不重复
+        self.conversation_history = ConversationHistory(max_recent=self.RECENT_WINDOW)
 
     def _create_agents(self) -> List[Agent]:
         """创建 CrewAI Agents"""
-        agents = []
+        return [self._create_agent(char) for char in self.characters]
 
-        for char in self.characters:
-            # 构建 Agent 的系统提示
-            backstory = f"""
+    def _create_agent(self, char: Dict[str, str]) -> Agent:
+        """创建单个角色的 CrewAI Agent（复用同一个 LLM 客户端）"""
+        # 构建 Agent 的系统提示
+        backstory = f"""
 你是 {char['name']}，性格特点：{char['personality']}
 
 当前场景：{self.scene}
@@ -65,25 +83,119 @@ class CharacterAgentCrew:
 5. 让对话自然流畅
 """
 
-            agent = Agent(
-                role=char['name'],
-                goal=f"在场景中以 {char['personality']} 的性格参与对话",
-                backstory=backstory,
-                llm=self.llm,
-                verbose=False,  # 关闭详细输出（避免干扰 Streamlit）
-                allow_delegation=False,  # 不允许委托（避免复杂性）
-                memory=True  # 启用记忆
-            )
+        return Agent(
+            role=char['name'],
+            goal=f"在场景中以 {char['personality']} 的性格参与对话",
+            backstory=backstory,
+            llm=self.llm,
+            verbose=False,  # 关闭详细输出（避免干扰 Streamlit）
+            allow_delegation=False,  # 不允许委托（避免复杂性）
+            memory=self.crewai_memory  # v3.5.0: 记忆由 Scriptforge 记忆层注入任务，不再重复存储
+        )
+
+    def _character_index(self, name: str) -> int:
+        """查找角色索引（不存在时返回 -1）"""
+        for idx, char in enumerate(self.characters):
+            if char['name'] == name:
+                return idx
+        return -1
+
+    # ==================== v3.5.0: 增量维护角色 ====================
+
+    def add_character(self, character: Dict[str, str]) -> Agent:
+        """
+        新增一个角色（只创建一个 Agent，保留 LLM 客户端和对话历史）
 
-            agents.append(agent)
+        Args:
+            character: {'name': '...', 'personality': '...'}
+
+        Returns:
+            新创建的 Agent
+        """
+        with self._run_lock:
+            if self._character_index(character['name']) >= 0:
+                raise ValueError(f"角色已存在: {character['name']}")
+
+            agent = self._create_agent(character)
+            self.characters.append(character)
+            self.agents.append(agent)
+            self._speculative = None
+            return agent
+
+    def remove_character(self, name: str):
+        """
+        移除一个角色（其余 Agent 保持不变）
+
+        Args:
+            name: 角色名称
+        """
+        with self._run_lock:
+            idx = self._character_index(name)
+            if idx < 0:
+                raise ValueError(f"角色不存在: {name}")
 
-        return agents
+            self.characters.pop(idx)
+            self.agents.pop(idx)
+            self._speculative = None
+
+    def update_character(self, name: str, character: Dict[str, str]) -> Agent:
+        """
+        更新一个角色的设定（只重建该角色的 Agent，位置不变）
+
+        Args:
+            name: 原角色名称
+            character: 新的角色信息 {'name': '...', 'personality': '...'}
+
+        Returns:
+            重建后的 Agent
+        """
+        with self._run_lock:
+            idx = self._character_index(name)
+            if idx < 0:
+                raise ValueError(f"角色不存在: {name}")
+            if character['name'] != name and self._character_index(character['name']) >= 0:
+                raise ValueError(f"角色已存在: {character['name']}")
+
+            agent = self._create_agent(character)
+            self.characters[idx] = character
+            self.agents[idx] = agent
+            self._speculative = None
+            return agent
+
+    def speculative_crew(self) -> 'CharacterAgentCrew':
+        """
+        v3.5.0: 预生成专用的分身
+
+        分身共用 LLM 客户端和场景设定，但有自己的 Agents 和运行锁：预生成的一轮不占用本对象的
+        _run_lock，被丢弃时交互轮次无需等它停下。对话历史每次调用时取一份快照，分身只读不写
+        （命中后在本对象上调用 commit_round）。角色变化后下一次调用会重建分身。
+
+        Returns:
+            预生成分身（同一角色阵容下复用）
+        """
+        with self._history_lock:
+            fork = self._speculative
+            if fork is None:
+                fork = copy.copy(self)
+                fork.characters = list(self.characters)
+                fork._run_lock = threading.RLock()
+                fork._history_lock = threading.Lock()
+                fork._speculative = None
+                fork.agents = fork._create_agents()
+                self._speculative = fork
+            fork.conversation_history = copy.deepcopy(self.conversation_history)
+            return fork
 
     def run_conversation_round(self,
                                user_message: Optional[str] = None,
                                character_memories: Optional[Dict[str, List]] = None,
                                single_speaker: bool = False,
-                               next_speaker_index: int = 0) -> tuple[List[Dict[str, str]], int]:
+                               next_speaker_index: int = 0,
+                               group_log: Optional[GroupMessageLog] = None,
+                               commit: bool = True,
+                               memory_provider: Optional[CharacterMemoryProvider] = None,
+                               deadline: Optional[Deadline] = None,
+                               cancel_token: Optional[CancellationToken] = None) -> tuple[List[Dict[str, str]], int]:
         """
         运行一轮对话
 
@@ -92,15 +204,42 @@ class CharacterAgentCrew:
             character_memories: 角色的私有记忆 {角色名: [记忆列表]}
             single_speaker: 是否单次发言模式（v3.1.1 新增）
             next_speaker_index: 下一个发言的角色索引（仅在 single_speaker=True 时使用）
+            group_log: 群聊消息日志（v3.5.0 新增，提供时不再扫描 character_memories）
+            commit: 是否写入对话历史（v3.5.0 新增，预生成时为 False，命中后再调用 commit_round）
+            memory_provider: 角色记忆提供器（v3.5.0 新增，默认基于 character_memories 构建）
+            deadline: 本轮截止时间（v3.5.0 新增，到期时已完成的角色照常发言，其余角色按 PASS 处理）
+            cancel_token: 取消令牌（v3.5.0 新增，取消后整轮丢弃，不写入对话历史）
 
         Returns:
             (对话结果, 下一个发言者索引)
             - 对话结果: [{'speaker': '...', 'content': '...'}, ...]
             - 下一个发言者索引: 用于轮流发言
+
+        Raises:
+            RoundCancelled: 本轮被取消（已完成的角色发言也一并丢弃）
         """
+        if memory_provider is None:
+            memory_provider = CharacterMemoryProvider(character_memories)
+
+        with self._run_lock:
+            return self._run_round(user_message, character_memories, single_speaker,
+                                   next_speaker_index, group_log, commit, memory_provider,
+                                   deadline, cancel_token)
+
+    def _run_round(self,
+                   user_message: Optional[str],
+                   character_memories: Optional[Dict[str, List]],
+                   single_speaker: bool,
+                   next_speaker_index: int,
+                   group_log: Optional[GroupMessageLog],
+                   commit: bool,
+                   memory_provider: CharacterMemoryProvider,
+                   deadline: Optional[Deadline] = None,
+                   cancel_token: Optional[CancellationToken] = None) -> tuple[List[Dict[str, str]], int]:
+        """执行一轮对话（调用方需持有 _run_lock）"""
 
         # 构建上下文
-        context = self._build_context(user_message, character_memories)
+        context = self._build_context(user_message, character_memories, group_log)
 
         # v3.1.1: 单次发言模式 - 只为指定角色创建任务
         if single_speaker:
@@ -116,12 +255,18 @@ class CharacterAgentCrew:
         # 创建对话任务
         tasks = []
         for agent in agents_to_run:
+            # v3.5.0: 私聊记忆由 Scriptforge 记忆层提供（群聊记录已在上下文中）
+            private_text = memory_provider.format_private_memory(agent.role)
+
             # v3.1.1: 根据是否有用户输入，调整任务描述
             if user_message:
                 # 有用户输入：强调要回应用户
                 task_description = f"""
 {context}
 
+【你的私聊记忆（只有你知道）】
+{private_text}
+
 作为 {agent.role}，用户刚才说了话，请决定如何回应：
 1. 你是否想对用户的话做出回应？
 2. 如果回应，你想说什么？
@@ -138,6 +283,9 @@ class CharacterAgentCrew:
                 task_description = f"""
 {context}
 
+【你的私聊记忆（只有你知道）】
+{private_text}
+
 作为 {agent.role}，这是一轮自主对话（没有用户输入），请决定：
 1. 你是否想在这轮对话中发言？
 2. 如果发言，你想说什么？
@@ -164,14 +312,63 @@ class CharacterAgentCrew:
             verbose=False
         )
 
-        # 执行任务
+        # v3.1.1: 计算下一个发言者索引（轮流）
+        if single_speaker:
+            next_index = (next_speaker_index + 1) % len(self.agents)
+        else:
+            next_index = 0  # 多人模式下索引无意义
+
+        # 执行任务（v3.5.0: 经过全局限流器，每个任务计一次请求；受本轮截止时间约束）
+        # 超时 / 取消时 kickoff_crew 等 Crew 真正停下才返回，之后读取 task.output、释放 _run_lock 都是安全的
         try:
-            result = crew.kickoff()
+            result = kickoff_crew(crew, self.model_id, deadline, cancel_token)
 
             # 解析结果（需要传入正确的索引）
             responses = self._parse_crew_result(result, tasks, agent_indices)
 
             # 更新对话历史
+            if commit:
+                self.commit_round(user_message, responses)
+
+            return responses, next_index
+
+        except DeadlineExceeded:
+            # v3.5.0: 超时不阻塞整轮 - 已完成的角色照常发言，未完成的按 PASS 处理
+            responses = self._parse_crew_result(None, tasks, agent_indices)
+            print(f"⏱️ 本轮已超时，{len(tasks) - len(responses)} 个角色按 PASS 处理")
+            if commit:
+                self.commit_round(user_message, responses)
+            return responses, next_index
+
+        except RoundCancelled as e:
+            # v3.5.0: 取消的轮次整轮丢弃（与超时不同，用户已经不需要这一轮的结果）
+            print(f"⏹️ 本轮已取消（{e.reason}），丢弃 {len(tasks)} 个角色的结果")
+            raise
+
+        except CircuitOpenError:
+            print(f"🔌 LLM 熔断中，跳过 CrewAI 直接降级")
+            fallback_responses = self._fallback_simple_generation(user_message, deadline, cancel_token)
+            if commit:
+                self.commit_round(user_message, fallback_responses)
+            return fallback_responses, next_index
+
+        except Exception as e:
+            st.error(f"CrewAI 执行错误: {str(e)}")
+            # 降级到简单模式
+            fallback_responses = self._fallback_simple_generation(user_message, deadline, cancel_token)
+            if commit:
+                self.commit_round(user_message, fallback_responses)
+            return fallback_responses, next_index
+
+    def commit_round(self, user_message: Optional[str], responses: List[Dict[str, str]]):
+        """
+        将一轮对话结果写入对话历史
+
+        Args:
+            user_message: 本轮用户输入（可选）
+            responses: 本轮角色发言
+        """
+        with self._run_lock, self._history_lock:
             if user_message:
                 self.conversation_history.append({
                     'speaker': '用户',
@@ -182,28 +379,10 @@ class CharacterAgentCrew:
                 if resp['content'] != 'PASS':
                     self.conversation_history.append(resp)
 
-            # v3.1.1: 计算下一个发言者索引（轮流）
-            if single_speaker:
-                next_index = (next_speaker_index + 1) % len(self.agents)
-            else:
-                next_index = 0  # 多人模式下索引无意义
-
-            return responses, next_index
-
-        except Exception as e:
-            st.error(f"CrewAI 执行错误: {str(e)}")
-            # 降级到简单模式
-            fallback_responses = self._fallback_simple_generation(user_message)
-            # 计算下一个索引
-            if single_speaker:
-                next_index = (next_speaker_index + 1) % len(self.agents)
-            else:
-                next_index = 0
-            return fallback_responses, next_index
-
     def _build_context(self,
                        user_message: Optional[str],
-                       character_memories: Optional[Dict[str, List]]) -> str:
+                       character_memories: Optional[Dict[str, List]],
+                       group_log: Optional[GroupMessageLog] = None) -> str:
         """构建对话上下文"""
         context_parts = []
 
@@ -216,17 +395,14 @@ class CharacterAgentCrew:
         else:
             context_parts.append(f"\n用户：{self.user_character['name']}")
 
-        # 最近对话历史（使用 character_memories 中的群聊记录）
-        if character_memories:
-            # 从任意角色的记忆中获取群聊消息（所有角色的群聊记忆是相同的）
-            first_char = list(character_memories.keys())[0]
-            group_messages = [
-                msg for msg in character_memories[first_char]
-                if msg.get('type') == 'group'
-            ]
+        # 最近对话历史（v3.5.0: 优先使用群聊日志，避免每轮扫描完整记忆）
+        if group_log is None and character_memories:
+            # 兼容旧调用：从角色记忆中重建（所有角色的群聊记忆是相同的）
+            group_log = GroupMessageLog.from_character_memories(character_memories)
 
+        if group_log is not None:
             # 最近 10 条群聊消息
-            recent = group_messages[-10:] if len(group_messages) > 10 else group_messages
+            recent = group_log.recent(self.RECENT_WINDOW)
             if recent:
                 history_text = "\n".join([
                     f"{msg['speaker']}: {msg['content']}"
@@ -234,6 +410,11 @@ class CharacterAgentCrew:
                 ])
                 context_parts.append(f"\n群聊记录：\n{history_text}")
 
+        # v3.5.0: 群聊记录窗口之前的对话摘要（与降级方案共用同一份预渲染文本）
+        summary = self.conversation_history.summary_text()
+        if summary:
+            context_parts.append(f"\n{summary}")
+
         # 用户输入（如果有的话，这部分作为强调）
         if user_message:
             context_parts.append(f"\n【用户刚才说】：{user_message}")
@@ -259,9 +440,11 @@ class CharacterAgentCrew:
             agent_idx = agent_indices[i]
             agent_name = self.characters[agent_idx]['name']
 
-            # 尝试获取任务输出
+            # 尝试获取任务输出（v3.5.0: 超时时未完成的任务没有输出）
             try:
-                output = str(task.output) if hasattr(task, 'output') else ""
+                if getattr(task, 'output', None) is None:
+                    continue
+                output = str(task.output)
 
                 # 清理输出
                 content = output.strip()
@@ -277,32 +460,39 @@ class CharacterAgentCrew:
 
         return responses
 
-    def _fallback_simple_generation(self, user_message: Optional[str]) -> List[Dict[str, str]]:
-        """降级方案：简单生成"""
-        responses = []
+    def _fallback_simple_generation(self, user_message: Optional[str],
+                                    deadline: Optional[Deadline] = None,
+                                    cancel_token: Optional[CancellationToken] = None) -> List[Dict[str, str]]:
+        """
+        降级方案：简单生成
+
+        v3.5.0: 各角色的提示词互不依赖，交给异步引擎并发请求；
+        整轮共用一个截止时间，超时或失败的角色跳过（PASS），不影响其他角色；
+        被取消时抛出 RoundCancelled，整轮丢弃
+        """
+        # v3.5.0: 预渲染的紧凑历史（摘要 + 最近 RECENT_WINDOW 条），所有角色共用
+        history_text = self.conversation_history.render()
 
-        for char in self.characters:
+        def _render(char: Dict[str, str], _prepared, _previous) -> str:
             # 使用 LLM 直接生成
-            prompt = f"""
+            return f"""
 你是 {char['name']}（{char['personality']}）
 场景：{self.scene}
-最近对话：{self.conversation_history[-5:] if self.conversation_history else '无'}
+最近对话：
+{history_text}
 {'用户说：' + user_message if user_message else ''}
 
 请简短回应（一句话）：
 """
-            try:
-                response = self.llm.invoke(prompt)
-                content = response.content.strip()
 
-                responses.append({
-                    'speaker': char['name'],
-                    'content': content
-                })
-            except:
-                continue
-
-        return responses
+        engine = GenerationEngine(self.api_key, self.model_id)
+        return run_sync(engine.generate_round(
+            self.characters,
+            prepare=lambda char: None,
+            render=_render,
+            deadline=deadline,
+            cancel_token=cancel_token
+        ))
 
 
 def test_crew():
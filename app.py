@@ -1,6 +1,8 @@
 import streamlit as st
 import os
 import json
+import time
+import uuid
 from typing import List, Dict, Optional
 from datetime import datetime
 
@@ -26,6 +28,31 @@ try:
 except ImportError:
     TEMPLATE_AVAILABLE = False
 
+# v3.5.0: 群聊消息日志（增量索引）与角色记忆提供器
+from memory_store import GroupMessageLog, CharacterMemoryProvider
+
+# v3.5.0: 异步生成引擎（一轮内各角色的请求并发 / 流水线执行）
+from generation_engine import GenerationEngine, run_sync
+
+# v3.5.0: 单次发言模式的后台预生成
+from speculative import SpeculativeEngine
+from rate_limiter import estimate_tokens, get_rate_limiter
+
+# v3.5.0: 每轮截止时间（超时的角色按 PASS / Mock 降级）
+from deadline import Deadline, DEFAULT_ROUND_TIMEOUT
+
+# v3.5.0: 提供方故障时的熔断状态
+from circuit_breaker import all_circuit_breakers, CLOSED
+
+# v3.5.0: 用户插话 / 点击停止时取消进行中的一轮
+from cancellation import CancellationToken, RoundCancelled
+
+# v3.5.0: 多轮自主对话在后台线程中执行，界面轮询进度
+from job_runner import get_job_runner, Job, JobFn
+
+# v3.5.0: LLM 并发槽位按请求类别排队（交互 > 私聊 > 自主对话 > 评估）
+from scheduler import request_context, PRIORITIES
+
 # 初始化 session state
 def init_session_state():
     """初始化会话状态 - v2.2.0 多 Agent 架构"""
@@ -50,6 +77,15 @@ def init_session_state():
         # 每个角色的独立记忆（包含群聊+自己的私聊）
         st.session_state.character_memories = {}
 
+    if 'private_memories' not in st.session_state:
+        # v3.5.0: 私聊记忆索引（与 character_memories 中的私聊消息是同一批对象，
+        # 提示词中的私聊记忆不会被大量群聊消息挤出）
+        st.session_state.private_memories = {}
+
+    if 'group_log' not in st.session_state:
+        # v3.5.0: 只追加的群聊日志，上下文构建直接读取最近 N 条
+        st.session_state.group_log = GroupMessageLog(st.session_state.shared_events)
+
     if 'selected_character' not in st.session_state:
         st.session_state.selected_character = None
 
@@ -111,15 +147,59 @@ def init_session_state():
     if 'use_templates' not in st.session_state:
         st.session_state.use_templates = False
 
+    # v3.5.0: 预生成下一位发言者（单次发言模式，可选）
+    if 'use_speculation' not in st.session_state:
+        st.session_state.use_speculation = False
+
+    if 'speculative_engine' not in st.session_state:
+        st.session_state.speculative_engine = None
+
+    # v3.5.0: 对话代数（加载 / 重新开始时递增，区分长度相同的不同对话）
+    if 'conversation_epoch' not in st.session_state:
+        st.session_state.conversation_epoch = 0
+
+    # v3.5.0: 每轮截止时间（秒）
+    if 'round_timeout' not in st.session_state:
+        st.session_state.round_timeout = DEFAULT_ROUND_TIMEOUT
+
+    # v3.5.0: 角色并行生成（关闭时保持"后一位看到前一位发言"）
+    if 'parallel_replies' not in st.session_state:
+        st.session_state.parallel_replies = False
+
+    # v3.5.0: 会话 ID（调度器按会话公平分配并发槽位）
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex[:12]
+
+    # v3.5.0: 进行中一轮的取消令牌
+    if 'round_token' not in st.session_state:
+        st.session_state.round_token = None
+
+    # v3.5.0: 后台自主对话（非单次发言模式）
+    if 'background_rounds' not in st.session_state:
+        st.session_state.background_rounds = True
+
+    if 'background_job_id' not in st.session_state:
+        st.session_state.background_job_id = None
+
+    if 'background_job_cursor' not in st.session_state:
+        st.session_state.background_job_cursor = 0
+
 
 # ============= v3.0.0 CrewAI 辅助函数 =============
 
-def _fallback_sequential_generation(user_input, use_real_api, api_key, status_placeholder):
+def _fallback_sequential_generation(user_input, use_real_api, api_key, status_placeholder,
+                                    cancel_token: Optional[CancellationToken] = None):
     """
     降级方案：传统顺序发言模式
     当 CrewAI 不可用或失败时使用
     v3.2.0: 支持 RAG 检索
+    v3.5.0: 真实 API 模式交给异步引擎（流水线 / 并行），支持取消
     """
+    if use_real_api and api_key:
+        _generate_group_round(user_input, api_key, False, status_placeholder,
+                              cancel_token=cancel_token)
+        return
+
     for idx, char in enumerate(st.session_state.characters, 1):
         status_placeholder.info(f"🤔 {char['name']} 正在回复... ({idx}/{len(st.session_state.characters)})")
 
@@ -151,6 +231,403 @@ def _fallback_sequential_generation(user_input, use_real_api, api_key, status_pl
         add_group_message(char['name'], content, 'character')
 
 
+def _round_deadline() -> Deadline:
+    """本轮截止时间（v3.5.0: 从一轮对话向下传递到每一次 LLM 调用）"""
+    return Deadline.after(st.session_state.get('round_timeout', DEFAULT_ROUND_TIMEOUT))
+
+
+def _begin_round() -> CancellationToken:
+    """
+    开始一轮生成（v3.5.0）
+
+    取消上一轮遗留的令牌并创建本轮令牌。等待 LLM 期间令牌会定期刷新一个计时占位，
+    让 Streamlit 有机会在用户插话 / 点击停止时中断本次脚本运行（见 _handle_round_cancelled）。
+
+    Returns:
+        本轮的取消令牌
+    """
+    _cancel_round("新一轮开始")
+    token = CancellationToken()
+    st.session_state.round_token = token
+
+    timer_placeholder = st.empty()
+    started = time.monotonic()
+    shown = [-1]
+
+    def _heartbeat():
+        elapsed = int(time.monotonic() - started)
+        if elapsed != shown[0]:
+            shown[0] = elapsed
+            timer_placeholder.caption(f"⏱️ 已用 {elapsed}s")
+
+    token.add_poller(_heartbeat)
+    return token
+
+
+def _cancel_round(reason: str):
+    """取消进行中的一轮（已经写入群聊的发言保留，其余结果丢弃）"""
+    token = st.session_state.get('round_token')
+    if token is not None:
+        token.cancel(reason)
+        st.session_state.round_token = None
+
+
+def _handle_round_cancelled(error: RoundCancelled, status_placeholder):
+    """
+    处理被取消的一轮
+
+    Streamlit 的中断（用户插话 / 点击按钮引起的重新运行）不经过这里：令牌在轮询时被取消，
+    原异常直接抛给 Streamlit（见 CancellationToken.poll）。轮询函数抛出普通异常时重新抛出该异常；
+    否则提示已停止。
+    """
+    if error.__cause__ is not None:
+        raise error.__cause__
+    status_placeholder.warning(f"⏹️ 已停止：{error.reason}")
+
+
+def _generation_engine(api_key: str) -> GenerationEngine:
+    """异步生成引擎（v3.5.0）"""
+    return GenerationEngine(
+        api_key,
+        st.session_state.get('model_id', 'gemini-2.0-flash-exp'),
+        max_concurrency=4
+    )
+
+
+def _generate_group_round(user_input: Optional[str], api_key: str, is_initial: bool,
+                          status_placeholder, chat_placeholder=None,
+                          cancel_token: Optional[CancellationToken] = None) -> List[Dict[str, str]]:
+    """
+    用异步引擎生成一轮群聊发言（v3.5.0，真实 API）
+
+    - 默认流水线模式：后一位角色能看到前一位的发言，下一位的记忆检索与上一位的请求重叠
+    - 开启并行生成时：所有角色基于同一份上下文同时请求（开场对话始终使用流水线）
+
+    Args:
+        user_input: 用户输入（自主对话为 None）
+        api_key: API Key
+        is_initial: 是否是开场对话
+        status_placeholder: 状态提示占位
+        chat_placeholder: 聊天记录占位（提供时每条发言后刷新）
+        cancel_token: 取消令牌（取消时已显示的发言保留，其余丢弃）
+
+    Returns:
+        本轮发言列表
+    """
+    characters = st.session_state.characters
+    scene = st.session_state.scene
+    total = len(characters)
+    finished = [0]
+
+    def _prepare(char):
+        return get_character_memory(char['name'], current_query=user_input or "")
+
+    def _render(char, memory, previous):
+        # 流水线模式下，本轮已有的发言可能还不在准备好的记忆里
+        recent = {(m['speaker'], m['content']) for m in memory[-total:]}
+        extra = [
+            {'speaker': r['speaker'], 'content': r['content'], 'type': 'group'}
+            for r in previous if (r['speaker'], r['content']) not in recent
+        ]
+        return _build_single_reply_prompt(scene, char, characters, memory + extra, is_initial)
+
+    def _fallback(char, memory, error):
+        st.warning(f"API 调用失败: {str(error)}，使用 Mock 数据")
+        return mock_generate_single_reply(scene, char, memory, is_initial)
+
+    def _on_reply(char, content):
+        add_group_message(char['name'], content, 'character')
+        finished[0] += 1
+        status_placeholder.info(f"🤔 角色们正在回复... ({finished[0]}/{total})")
+        if chat_placeholder is not None:
+            with chat_placeholder.container():
+                for msg in st.session_state.shared_events:
+                    render_chat_message(msg)
+
+    engine = _generation_engine(api_key)
+    status_placeholder.info(f"🤔 角色们正在回复... (0/{total})")
+
+    if is_initial:
+        coro = engine.generate_initial(characters, _prepare, _render, _fallback,
+                                       deadline=_round_deadline(), on_reply=_on_reply,
+                                       cancel_token=cancel_token)
+    else:
+        coro = engine.generate_round(characters, _prepare, _render, _fallback,
+                                     pipelined=not st.session_state.parallel_replies,
+                                     deadline=_round_deadline(), on_reply=_on_reply,
+                                     cancel_token=cancel_token)
+    return run_sync(coro)
+
+
+# ============= v3.5.0 预生成辅助函数 =============
+
+def _speculation_enabled() -> bool:
+    """是否满足预生成条件（单次发言模式 + CrewAI + 用户开启）"""
+    return bool(
+        st.session_state.use_speculation and
+        st.session_state.turn_based_mode and
+        st.session_state.crew_manager and
+        CREWAI_AVAILABLE
+    )
+
+
+def _speculation_key() -> tuple:
+    """预生成键：对话代数 + 群聊历史版本 + 下一位发言者索引"""
+    return (st.session_state.conversation_epoch, st.session_state.group_log.version,
+            st.session_state.next_speaker_index)
+
+
+def _count_response_tokens(result) -> int:
+    """估算一轮结果的 token 数（用于统计被丢弃的预生成）"""
+    responses, _ = result
+    return sum(estimate_tokens(resp['content']) for resp in responses)
+
+
+def _schedule_speculation():
+    """
+    在后台预生成下一位发言者的回复
+    同一个历史版本只会提交一次；生成函数只读取快照，不访问 session_state
+    """
+    if not _speculation_enabled():
+        return
+
+    if st.session_state.speculative_engine is None:
+        st.session_state.speculative_engine = SpeculativeEngine()
+
+    # 预生成使用独立的 Agents，不占用交互轮次的运行锁
+    crew_manager = st.session_state.crew_manager.speculative_crew()
+    group_log = GroupMessageLog(st.session_state.group_log.recent(10))
+    speaker_index = st.session_state.next_speaker_index
+    # 只快照记忆尾部窗口，与历史长度无关
+    memory_provider = _snapshot_memory_provider()
+
+    deadline = _round_deadline()
+    cancel_token = CancellationToken()
+
+    session_id = st.session_state.session_id
+
+    def _generate():
+        with request_context('autonomous', session_id):
+            return crew_manager.run_conversation_round(
+                user_message=None,
+                character_memories=None,
+                single_speaker=True,
+                next_speaker_index=speaker_index,
+                group_log=group_log,
+                commit=False,
+                memory_provider=memory_provider,
+                deadline=deadline,
+                cancel_token=cancel_token
+            )
+
+    st.session_state.speculative_engine.submit(
+        _speculation_key(), _generate, token_counter=_count_response_tokens,
+        cancel_token=cancel_token
+    )
+
+
+def _take_speculation():
+    """
+    取出与当前历史版本一致的预生成结果
+
+    Returns:
+        (对话结果, 下一个发言者索引)；未命中时返回 None
+    """
+    if not _speculation_enabled() or st.session_state.speculative_engine is None:
+        return None
+    return st.session_state.speculative_engine.take(_speculation_key())
+
+
+def _invalidate_speculation():
+    """历史发生变化（用户插话等），丢弃预生成"""
+    if st.session_state.speculative_engine is not None:
+        st.session_state.speculative_engine.invalidate()
+
+
+# ============= v3.5.0 后台自主对话 =============
+
+def _background_job() -> Optional[Job]:
+    """当前会话的后台自主对话任务（没有或已被清理时返回 None）"""
+    return get_job_runner().get(st.session_state.background_job_id)
+
+
+def _build_auto_continue_job(num_rounds: int, use_real_api: bool, api_key: str) -> JobFn:
+    """
+    构造后台自主对话任务
+
+    在脚本线程中快照所需状态（场景、角色、最近群聊、角色记忆尾部窗口），任务函数只使用快照；
+    每轮结束后发布 {'round': 轮次, 'responses': [...], 'next_speaker_index': 索引}，
+    由界面轮询时写入群聊。后台任务不使用 RAG 检索（检索依赖会话状态）。
+
+    Args:
+        num_rounds: 轮数
+        use_real_api: 是否使用真实 API
+        api_key: API Key
+
+    Returns:
+        任务函数
+    """
+    scene = st.session_state.scene
+    characters = [dict(c) for c in st.session_state.characters]
+    crew_manager = st.session_state.crew_manager if CREWAI_AVAILABLE else None
+    single_speaker = st.session_state.turn_based_mode
+    speaker_index = [st.session_state.next_speaker_index]
+    pipelined = not st.session_state.parallel_replies
+    round_timeout = st.session_state.get('round_timeout', DEFAULT_ROUND_TIMEOUT)
+    model_id = st.session_state.get('model_id', 'gemini-2.0-flash-exp')
+    session_id = st.session_state.session_id
+
+    group_log = GroupMessageLog(st.session_state.group_log.recent(10))
+    memory_provider = _snapshot_memory_provider()
+    memories = memory_provider.character_memories
+
+    def _remember(speaker: str, content: str):
+        message = {
+            'timestamp': datetime.now().isoformat(),
+            'speaker': speaker,
+            'content': content,
+            'type': 'group',
+            'msg_type': 'character',
+            'visible_to': 'all'
+        }
+        group_log.append(message)
+        for char_memories in memories.values():
+            char_memories.append(message)
+
+    def _simple_round(cancel_token: CancellationToken) -> List[Dict[str, str]]:
+        if not (use_real_api and api_key):
+            responses = []
+            for char in characters:
+                content = mock_generate_single_reply(scene, char, memories.get(char['name'], []))
+                _remember(char['name'], content)
+                responses.append({'speaker': char['name'], 'content': content})
+            return responses
+
+        def _render(char, memory, previous):
+            extra = [{'speaker': r['speaker'], 'content': r['content'], 'type': 'group'} for r in previous]
+            return _build_single_reply_prompt(scene, char, characters, memory + extra, False)
+
+        engine = GenerationEngine(api_key, model_id, max_concurrency=4)
+        responses = run_sync(engine.generate_round(
+            characters,
+            prepare=lambda char: list(memories.get(char['name'], [])),
+            render=_render,
+            fallback=lambda char, memory, error: mock_generate_single_reply(scene, char, memory),
+            pipelined=pipelined,
+            deadline=Deadline.after(round_timeout),
+            cancel_token=cancel_token
+        ))
+        for resp in responses:
+            _remember(resp['speaker'], resp['content'])
+        return responses
+
+    def _run(job: Job):
+        with request_context('autonomous', session_id):
+            _run_rounds(job)
+
+    def _run_rounds(job: Job):
+        token = job.cancel_token
+        for round_num in range(num_rounds):
+            token.raise_if_cancelled()
+
+            responses = None
+            if crew_manager is not None:
+                try:
+                    responses, speaker_index[0] = crew_manager.run_conversation_round(
+                        user_message=None,
+                        single_speaker=single_speaker,
+                        next_speaker_index=speaker_index[0],
+                        group_log=group_log,
+                        memory_provider=memory_provider,
+                        deadline=Deadline.after(round_timeout),
+                        cancel_token=token
+                    )
+                    responses = [r for r in responses if r['content'] and r['content'] != 'PASS']
+                    for resp in responses:
+                        _remember(resp['speaker'], resp['content'])
+                except RoundCancelled:
+                    raise
+                except Exception as e:
+                    print(f"⚠️ 后台 CrewAI 执行错误，降级: {str(e)}")
+                    responses = None
+
+            if responses is None:
+                responses = _simple_round(token)
+
+            # 取消之后完成的一轮不再发布（与前台"取消的一轮整体丢弃"一致）
+            token.raise_if_cancelled()
+            job.publish({
+                'round': round_num + 1,
+                'responses': responses,
+                'next_speaker_index': speaker_index[0]
+            })
+            job.advance()
+
+    return _run
+
+
+def _apply_background_results(job: Job) -> int:
+    """
+    把后台任务新发布的轮次写入群聊（只在脚本线程调用）
+
+    Returns:
+        新写入的轮数
+    """
+    results, cursor = job.results_since(st.session_state.background_job_cursor)
+    st.session_state.background_job_cursor = cursor
+    for item in results:
+        for resp in item['responses']:
+            add_group_message(resp['speaker'], resp['content'], 'character')
+        st.session_state.next_speaker_index = item['next_speaker_index']
+    return len(results)
+
+
+def _stop_background_job(reason: str):
+    """停止后台自主对话（已完成的轮次写入群聊，进行中的一轮丢弃）"""
+    job = _background_job()
+    if job is None:
+        return
+    job.cancel(reason)
+    _apply_background_results(job)
+    st.session_state.background_job_id = None
+    st.session_state.background_job_cursor = 0
+
+
+@st.fragment(run_every=1.0)
+def _render_background_job():
+    """
+    后台任务进度（每秒轮询一次）
+
+    有新完成的轮次时写入群聊并刷新整个页面；任务结束后清理任务 ID。
+    """
+    job = _background_job()
+    if job is None:
+        return
+
+    applied = _apply_background_results(job)
+    info = job.snapshot()
+    total = max(info['total_steps'], 1)
+    st.progress(
+        info['completed_steps'] / total,
+        text=f"🧵 后台自主对话 {info['completed_steps']}/{info['total_steps']} 轮 · 已用 {info['elapsed']}s"
+    )
+
+    if job.finished:
+        st.session_state.background_job_id = None
+        st.session_state.background_job_cursor = 0
+        if info['status'] == 'failed':
+            st.toast(f"❌ 后台自主对话出错：{info['error']}")
+        elif info['status'] == 'cancelled':
+            st.toast(f"⏹️ 后台自主对话已停止（完成 {info['completed_steps']} 轮）")
+        else:
+            st.toast(f"✅ 完成 {info['completed_steps']} 轮自主对话！")
+        st.rerun()
+
+    st.button("⏹️ 停止", key="stop_background_job", on_click=_stop_background_job, args=("用户点击停止",))
+    if applied:
+        st.rerun()
+
+
 # ============= v2.2.0 多 Agent 记忆管理系统 =============
 
 def init_character_memories():
@@ -158,6 +635,31 @@ def init_character_memories():
     st.session_state.character_memories = {
         char['name']: [] for char in st.session_state.characters
     }
+    st.session_state.private_memories = {}
+
+
+def _rebuild_private_memories():
+    """从 character_memories 重建私聊记忆索引（加载对话时调用）"""
+    st.session_state.private_memories = {
+        name: [msg for msg in memories if msg.get('type') == 'private']
+        for name, memories in st.session_state.character_memories.items()
+    }
+
+
+def _memory_provider() -> CharacterMemoryProvider:
+    """当前会话的记忆提供器（前台调用，直接读取会话状态）"""
+    return CharacterMemoryProvider(st.session_state.character_memories,
+                                   private_memories=st.session_state.private_memories)
+
+
+def _snapshot_memory_provider() -> CharacterMemoryProvider:
+    """后台线程使用的记忆快照：只复制记忆尾部和最近的私聊，与历史长度无关"""
+    return CharacterMemoryProvider(
+        {name: list(memories[-20:]) for name, memories in st.session_state.character_memories.items()},
+        private_memories={
+            name: list(memories[-5:]) for name, memories in st.session_state.private_memories.items()
+        }
+    )
 
 
 def add_group_message(speaker: str, content: str, msg_type: str = 'character'):
@@ -182,6 +684,9 @@ def add_group_message(speaker: str, content: str, msg_type: str = 'character'):
     # 添加到共享事件流（用于显示）
     st.session_state.shared_events.append(message)
 
+    # v3.5.0: 追加到群聊日志
+    st.session_state.group_log.append(message)
+
     # 添加到所有角色的记忆
     for char_name in st.session_state.character_memories:
         st.session_state.character_memories[char_name].append(message.copy())
@@ -224,6 +729,7 @@ def add_private_message(character_name: str, speaker: str, content: str, msg_typ
     # 只添加到指定角色的记忆
     if character_name in st.session_state.character_memories:
         st.session_state.character_memories[character_name].append(message)
+        st.session_state.private_memories.setdefault(character_name, []).append(message)
 
         # v3.2.0: 同步到 RAG 系统
         if st.session_state.use_rag and st.session_state.rag_system:
@@ -388,6 +894,11 @@ def load_conversation_from_json(json_str: str) -> bool:
         data = json.loads(json_str)
         version = data.get('version', '1.0.0')
 
+        # v3.5.0: 旧对话的后台自主对话不能继续写入加载的对话，预生成也随之作废
+        _stop_background_job("加载了其他对话")
+        _invalidate_speculation()
+        st.session_state.conversation_epoch += 1
+
         st.info(f"加载的对话版本: {version}")
 
         # 恢复基本状态
@@ -401,15 +912,19 @@ def load_conversation_from_json(json_str: str) -> bool:
             # v2.2.0 格式：直接加载新架构
             st.session_state.shared_events = data.get('shared_events', [])
             st.session_state.character_memories = data.get('character_memories', {})
+            st.session_state.group_log = GroupMessageLog(st.session_state.shared_events)
+            _rebuild_private_memories()
         else:
             # v2.1.x 或更早版本：转换到新架构
             st.warning("检测到旧版本格式，正在转换到 v2.2.0 架构...")
 
             # 初始化新结构
             st.session_state.shared_events = []
+            st.session_state.group_log = GroupMessageLog()
             st.session_state.character_memories = {
                 char['name']: [] for char in st.session_state.characters
             }
+            st.session_state.private_memories = {}
 
             # 迁移群聊历史
             old_group_history = data.get('group_chat_history', [])
@@ -518,12 +1033,14 @@ def mock_generate_private_reply(scene: str, character: Dict[str, str],
 
 
 # 使用 Gemini API 生成单个角色的发言 - v2.2.0 基于完整记忆
-def generate_single_reply_with_gemini(scene: str, character: Dict[str, str],
-                                      characters: List[Dict[str, str]],
-                                      character_memory: List[Dict[str, str]],
-                                      is_initial: bool, api_key: str, is_private: bool = False) -> str:
+def _build_single_reply_prompt(scene: str, character: Dict[str, str],
+                               characters: List[Dict[str, str]],
+                               character_memory: List[Dict[str, str]],
+                               is_initial: bool, is_private: bool = False) -> str:
     """
-    使用 Gemini API 生成单个角色的发言（基于角色完整记忆）
+    构建单个角色发言的提示词（基于角色完整记忆）
+
+    v3.5.0: 从 generate_single_reply_with_gemini 中拆出，供异步引擎按角色构造提示词
 
     Args:
         scene: 场景描述
@@ -531,46 +1048,41 @@ def generate_single_reply_with_gemini(scene: str, character: Dict[str, str],
         characters: 所有角色列表
         character_memory: 角色的完整记忆（包含群聊+私聊）
         is_initial: 是否是初始对话
-        api_key: API密钥
-        is_private: 是否是私聊场景（v3.1.1 新增）
+        is_private: 是否是私聊场景
 
     Returns:
-        角色的发言内容
+        提示词
     """
-    try:
-        import google.genai as genai
-
-        client = genai.Client(api_key=api_key)
-
-        # 构建角色记忆（最近20条）
-        recent_memory = character_memory[-20:] if len(character_memory) > 20 else character_memory
-
-        # 分离群聊和私聊记忆
-        group_msgs = []
-        private_msgs = []
-        for msg in recent_memory:
-            msg_line = f"{msg['speaker']}：{msg['content']}"
-            if msg['type'] == 'group':
-                group_msgs.append(msg_line)
-            else:
-                private_msgs.append(msg_line)
+    # 构建角色记忆（最近20条）
+    recent_memory = character_memory[-20:] if len(character_memory) > 20 else character_memory
+
+    # 分离群聊和私聊记忆
+    group_msgs = []
+    private_msgs = []
+    for msg in recent_memory:
+        msg_line = f"{msg['speaker']}：{msg['content']}"
+        if msg['type'] == 'group':
+            group_msgs.append(msg_line)
+        else:
+            private_msgs.append(msg_line)
 
-        # 构建显示文本
-        group_text = "\n".join(group_msgs) if group_msgs else "（暂无群聊记录）"
-        private_text = "\n".join(private_msgs) if private_msgs else "（暂无私聊记录）"
+    # 构建显示文本
+    group_text = "\n".join(group_msgs) if group_msgs else "（暂无群聊记录）"
+    private_text = "\n".join(private_msgs) if private_msgs else "（暂无私聊记录）"
 
-        # 构建角色列表
-        characters_text = "\n".join([f"- {c['name']}: {c['personality']}" for c in characters])
+    # 构建角色列表
+    characters_text = "\n".join([f"- {c['name']}: {c['personality']}" for c in characters])
 
+    if is_initial:
         # v3.3.0: 检查是否使用模版
+        # v3.5.0: 只在开场对话读取会话状态，非开场提示词可以在后台线程中构造
         use_template = (
             st.session_state.get('use_templates', False) and
             st.session_state.get('selected_template') and
             st.session_state.get('template_manager')
         )
 
-        if is_initial:
-            base_prompt = f"""
+        base_prompt = f"""
 你正在扮演角色：{character['name']}（性格：{character['personality']}）
 场景：{scene}
 
@@ -596,22 +1108,22 @@ def generate_single_reply_with_gemini(scene: str, character: Dict[str, str],
 
 你的发言：
 """
-            # v3.3.0: 如果启用模版，生成增强版 Prompt
-            if use_template:
-                try:
-                    prompt = st.session_state.template_manager.generate_enhanced_prompt(
-                        template_id=st.session_state.selected_template,
-                        scene=scene,
-                        character=character,
-                        base_prompt=base_prompt
-                    )
-                except Exception as e:
-                    print(f"⚠️ 模版增强失败，使用默认 Prompt: {str(e)}")
-                    prompt = base_prompt
-            else:
+        # v3.3.0: 如果启用模版，生成增强版 Prompt
+        if use_template:
+            try:
+                prompt = st.session_state.template_manager.generate_enhanced_prompt(
+                    template_id=st.session_state.selected_template,
+                    scene=scene,
+                    character=character,
+                    base_prompt=base_prompt
+                )
+            except Exception as e:
+                print(f"⚠️ 模版增强失败，使用默认 Prompt: {str(e)}")
                 prompt = base_prompt
         else:
-            prompt = f"""
+            prompt = base_prompt
+    else:
+        prompt = f"""
 你正在扮演角色：{character['name']}（性格：{character['personality']}）
 场景：{scene}
 
@@ -649,17 +1161,44 @@ def generate_single_reply_with_gemini(scene: str, character: Dict[str, str],
 你的发言：
 """
 
-        response = client.models.generate_content(
-            model=st.session_state.get('model_id', 'gemini-2.0-flash-exp'),
-            contents=prompt
-        )
+    return prompt
 
-        return response.text.strip()
 
-    except Exception as e:
+def generate_single_reply_with_gemini(scene: str, character: Dict[str, str],
+                                      characters: List[Dict[str, str]],
+                                      character_memory: List[Dict[str, str]],
+                                      is_initial: bool, api_key: str, is_private: bool = False) -> str:
+    """
+    使用 Gemini API 生成单个角色的发言（基于角色完整记忆）
+
+    v3.5.0: 同步包装，实际生成由异步引擎完成
+
+    Args:
+        scene: 场景描述
+        character: 当前发言的角色
+        characters: 所有角色列表
+        character_memory: 角色的完整记忆（包含群聊+私聊）
+        is_initial: 是否是初始对话
+        api_key: API密钥
+        is_private: 是否是私聊场景（v3.1.1 新增）
+
+    Returns:
+        角色的发言内容
+    """
+    def _fallback(e: Exception) -> str:
         st.warning(f"API 调用失败: {str(e)}，使用 Mock 数据")
         return mock_generate_single_reply(scene, character, character_memory, is_initial)
 
+    try:
+        prompt = _build_single_reply_prompt(scene, character, characters, character_memory,
+                                            is_initial, is_private)
+    except Exception as e:
+        return _fallback(e)
+
+    return run_sync(_generation_engine(api_key).generate_private_reply(
+        character, prompt, fallback=_fallback, deadline=_round_deadline()
+    ))
+
 
 # 真实的 Gemini API 调用函数（旧版本，保留兼容性）
 def generate_initial_conversation_with_gemini(scene: str, characters: List[Dict[str, str]], api_key: str) -> List[Dict[str, str]]:
@@ -667,10 +1206,6 @@ def generate_initial_conversation_with_gemini(scene: str, characters: List[Dict[
     使用 Gemini API 生成初始对话
     """
     try:
-        import google.genai as genai
-
-        client = genai.Client(api_key=api_key)
-
         prompt = f"""
 你是一个剧本创作助手。请根据以下信息创作一段对话：
 
@@ -690,14 +1225,12 @@ def generate_initial_conversation_with_gemini(scene: str, characters: List[Dict[
 请直接输出对话内容，不要有其他说明。
 """
 
-        response = client.models.generate_content(
-            model=st.session_state.get('model_id', 'gemini-2.0-flash-exp'),
-            contents=prompt
-        )
+        # v3.5.0: 经由异步引擎调用（进程级共享客户端，超时降级到 Mock）
+        response_text = run_sync(_generation_engine(api_key).complete(prompt, _round_deadline()))
 
         # 解析响应为消息列表
         messages = []
-        for line in response.text.strip().split('\n'):
+        for line in response_text.strip().split('\n'):
             if '：' in line or ':' in line:
                 sep = '：' if '：' in line else ':'
                 speaker, content = line.split(sep, 1)
@@ -718,10 +1251,6 @@ def generate_group_reply_with_gemini(scene: str, characters: List[Dict[str, str]
                                      chat_history: List[Dict[str, str]], user_message: str, api_key: str) -> List[Dict[str, str]]:
     """使用 Gemini API 生成群聊回复"""
     try:
-        import google.genai as genai
-
-        client = genai.Client(api_key=api_key)
-
         # 构建对话历史
         history_text = "\n".join([f"{msg['speaker']}：{msg['content']}" for msg in chat_history[-10:]])  # 只取最近10条
 
@@ -743,13 +1272,11 @@ def generate_group_reply_with_gemini(scene: str, characters: List[Dict[str, str]
 格式：角色名：对话内容（每行一句）
 """
 
-        response = client.models.generate_content(
-            model=st.session_state.get('model_id', 'gemini-2.0-flash-exp'),
-            contents=prompt
-        )
+        # v3.5.0: 经由异步引擎调用（进程级共享客户端，超时降级到 Mock）
+        response_text = run_sync(_generation_engine(api_key).complete(prompt, _round_deadline()))
 
         messages = []
-        for line in response.text.strip().split('\n'):
+        for line in response_text.strip().split('\n'):
             if '：' in line or ':' in line:
                 sep = '：' if '：' in line else ':'
                 speaker, content = line.split(sep, 1)
@@ -770,10 +1297,6 @@ def generate_private_reply_with_gemini(scene: str, character: Dict[str, str],
                                        chat_history: List[Dict[str, str]], user_message: str, api_key: str) -> str:
     """使用 Gemini API 生成私聊回复"""
     try:
-        import google.genai as genai
-
-        client = genai.Client(api_key=api_key)
-
         history_text = "\n".join([f"{msg['speaker']}：{msg['content']}" for msg in chat_history[-10:]])
 
         prompt = f"""
@@ -789,12 +1312,10 @@ def generate_private_reply_with_gemini(scene: str, character: Dict[str, str],
 只输出对话内容，不要加角色名。
 """
 
-        response = client.models.generate_content(
-            model=st.session_state.get('model_id', 'gemini-2.0-flash-exp'),
-            contents=prompt
-        )
+        # v3.5.0: 经由异步引擎调用（进程级共享客户端，超时降级到 Mock）
+        response_text = run_sync(_generation_engine(api_key).complete(prompt, _round_deadline()))
 
-        return response.text.strip()
+        return response_text.strip()
 
     except Exception as e:
         st.warning(f"API 调用失败: {str(e)}，使用 Mock 数据")
@@ -1047,9 +1568,67 @@ def main():
                 st.info(f"🎮 单次发言模式：下一个发言者是 **{next_speaker_name}**（轮流制）")
             else:
                 st.info("🎮 单次发言：每次只有一个角色说话，角色轮流发言")
+
+            # v3.5.0: 预生成下一位发言者
+            use_speculation = st.checkbox(
+                "⚡ 预生成下一位发言（实验）",
+                value=st.session_state.use_speculation,
+                help="上一轮结束后立即在后台生成下一位角色的发言，点击时直接使用；期间如有用户插话则丢弃（需要 CrewAI）"
+            )
+            st.session_state.use_speculation = use_speculation
+
+            if use_speculation and st.session_state.speculative_engine is not None:
+                spec_stats = st.session_state.speculative_engine.stats()
+                st.caption(
+                    f"📊 命中率 {spec_stats['hit_rate'] * 100:.0f}%"
+                    f"（{spec_stats['hits']}/{spec_stats['hits'] + spec_stats['misses']}）"
+                    f" | 浪费约 {spec_stats['wasted_tokens']} tokens"
+                )
         else:
             st.info("⚡ 多人对话：每轮所有角色都可能发言，对话更热闹")
 
+        # v3.5.0: 每轮截止时间
+        st.session_state.round_timeout = st.number_input(
+            "⏱️ 每轮超时（秒）",
+            min_value=10,
+            max_value=600,
+            value=int(st.session_state.round_timeout),
+            step=10,
+            help="超过该时间仍未完成的角色本轮保持沉默（或使用 Mock 回复），不会阻塞其他角色；慢请求会自动发送对冲副本"
+        )
+
+        # v3.5.0: 角色并行生成
+        st.session_state.parallel_replies = st.checkbox(
+            "🚀 角色并行生成（实验）",
+            value=st.session_state.parallel_replies,
+            help="传统模式下所有角色同时请求，整轮耗时约等于最慢的一位；代价是同一轮内角色看不到彼此的发言"
+        )
+
+        # v3.5.0: 多轮自主对话放到后台执行
+        st.session_state.background_rounds = st.checkbox(
+            "🧵 后台运行自主对话",
+            value=st.session_state.background_rounds,
+            help="多人模式的自主对话在后台线程中执行，页面保持可操作，每完成一轮显示一轮（最多 50 轮）"
+        )
+        runner_stats = get_job_runner().stats()
+        if runner_stats['active']:
+            st.caption(f"🧵 后台任务 {runner_stats['active']} 个进行中（工作线程 {runner_stats['max_workers']}）")
+
+        # v3.5.0: 并发槽位排队情况（交互 > 私聊 > 自主对话 > 评估）
+        sched_stats = get_rate_limiter('google-genai').scheduler.stats()
+        queued = {p: sched_stats[p]['queued'] for p in PRIORITIES if sched_stats[p]['queued']}
+        rejected = sum(sched_stats[p]['rejected'] for p in PRIORITIES)
+        if queued or rejected:
+            st.caption(
+                "🚦 排队：" + ("、".join(f"{p} {n}" for p, n in queued.items()) or "无")
+                + (f" | 已拒绝 {rejected}" if rejected else "")
+            )
+
+        # v3.5.0: 熔断状态（熔断期间调用直接降级，不再逐次等待失败）
+        open_breakers = [b for b in all_circuit_breakers().values() if b.state != CLOSED]
+        if open_breakers:
+            st.warning("🔌 后端熔断中，暂时使用降级回复：" + "、".join(b.name for b in open_breakers))
+
         st.markdown("---")
 
         # 模式切换
@@ -1114,9 +1693,14 @@ def main():
 
         # 重置按钮
         if st.button("🔄 重新开始", use_container_width=True):
+            _invalidate_speculation()
+            _stop_background_job("重新开始")
+            st.session_state.conversation_epoch += 1
             st.session_state.conversation_started = False
             st.session_state.shared_events = []
+            st.session_state.group_log = GroupMessageLog()
             st.session_state.character_memories = {}
+            st.session_state.private_memories = {}
             st.session_state.scene = ''
             st.session_state.characters = []
             st.rerun()
@@ -1212,6 +1796,7 @@ def main():
 
             # v2.2.0: 初始化新的记忆系统
             st.session_state.shared_events = []
+            st.session_state.group_log = GroupMessageLog()
             init_character_memories()
 
             # v3.0.0: 初始化 CrewAI（如果启用且有 API Key）
@@ -1248,23 +1833,22 @@ def main():
                 chat_placeholder = st.empty()
                 status_placeholder = st.empty()
 
-                for idx, char in enumerate(st.session_state.characters, 1):
-                    status_placeholder.info(f"🤔 {char['name']} 正在思考... ({idx}/{len(st.session_state.characters)})")
+                # v3.5.0: 真实 API 模式交给异步引擎（流水线：后一位仍能看到前一位的开场白）
+                if use_real_api and api_key:
+                    try:
+                        with request_context('interactive', st.session_state.session_id):
+                            _generate_group_round(None, api_key, True, status_placeholder, chat_placeholder,
+                                                  cancel_token=_begin_round())
+                    except RoundCancelled as e:
+                        _handle_round_cancelled(e, status_placeholder)
+                else:
+                    for idx, char in enumerate(st.session_state.characters, 1):
+                        status_placeholder.info(f"🤔 {char['name']} 正在思考... ({idx}/{len(st.session_state.characters)})")
 
-                    # 获取角色的当前记忆
-                    char_memory = get_character_memory(char['name'])
+                        # 获取角色的当前记忆
+                        char_memory = get_character_memory(char['name'])
 
-                    # 生成发言
-                    if use_real_api and api_key:
-                        content = generate_single_reply_with_gemini(
-                            st.session_state.scene,
-                            char,
-                            st.session_state.characters,
-                            char_memory,
-                            is_initial=True,
-                            api_key=api_key
-                        )
-                    else:
+                        # 生成发言
                         content = mock_generate_single_reply(
                             st.session_state.scene,
                             char,
@@ -1272,13 +1856,13 @@ def main():
                             is_initial=True
                         )
 
-                    # 添加到记忆系统
-                    add_group_message(char['name'], content, 'character')
+                        # 添加到记忆系统
+                        add_group_message(char['name'], content, 'character')
 
-                    # 实时显示更新后的对话
-                    with chat_placeholder.container():
-                        for msg in st.session_state.shared_events:
-                            render_chat_message(msg)
+                        # 实时显示更新后的对话
+                        with chat_placeholder.container():
+                            for msg in st.session_state.shared_events:
+                                render_chat_message(msg)
 
                 status_placeholder.success("✅ 初始对话生成完成！")
                 st.rerun()
@@ -1289,6 +1873,12 @@ def main():
                 for msg in st.session_state.shared_events:
                     render_chat_message(msg)
 
+            # v3.5.0: 后台自主对话的进度（完成的轮次增量写入群聊）
+            _render_background_job()
+
+            # v3.5.0: 单次发言模式下，在用户点击前预生成下一位发言
+            _schedule_speculation()
+
             # 用户交互区域
             st.markdown("---")
 
@@ -1305,7 +1895,7 @@ def main():
                     num_rounds = st.number_input(
                         "轮数",
                         min_value=1,
-                        max_value=5,
+                        max_value=50 if st.session_state.background_rounds else 5,
                         value=1,
                         key="auto_rounds",
                         help="角色们自主对话的轮数"
@@ -1314,7 +1904,8 @@ def main():
                 # v3.1.1: 单次发言模式下按钮文字不同
                 button_text = "▶️ 让一个角色说话" if st.session_state.turn_based_mode else "🎭 开始对话"
                 button_help = "让一个角色发言（单次发言模式）" if st.session_state.turn_based_mode else "让角色们自主继续对话（可能多人发言）"
-                auto_continue = st.button(button_text, use_container_width=True, help=button_help)
+                auto_continue = st.button(button_text, use_container_width=True, help=button_help,
+                                          disabled=_background_job() is not None)
             with control_cols[3]:
                 # v3.1.0: 添加新角色按钮
                 add_char_btn = st.button("➕ 新角色", use_container_width=True, help="中途加入新角色")
@@ -1345,18 +1936,12 @@ def main():
                                 if new_char_name not in st.session_state.character_memories:
                                     st.session_state.character_memories[new_char_name] = []
 
-                                # 如果使用 CrewAI，需要重新初始化
+                                # v3.5.0: 如果使用 CrewAI，只为新角色创建 Agent（保留已有 Agents 和 LLM 客户端）
                                 if st.session_state.crew_manager and CREWAI_AVAILABLE:
                                     try:
-                                        st.session_state.crew_manager = CharacterAgentCrew(
-                                            scene=st.session_state.scene,
-                                            characters=st.session_state.characters,
-                                            api_key=api_key,
-                                            model_id=st.session_state.model_id,
-                                            user_character=st.session_state.user_character
-                                        )
+                                        st.session_state.crew_manager.add_character(new_char)
                                     except Exception as e:
-                                        st.error(f"CrewAI 重新初始化失败: {str(e)}")
+                                        st.error(f"CrewAI 添加角色失败: {str(e)}")
 
                                 # 添加系统消息
                                 system_msg = f"📢 新角色 **{new_char_name}** 加入了对话！"
@@ -1376,91 +1961,145 @@ def main():
             user_input = st.chat_input("💬 输入你的消息，参与群聊...")
 
             if user_input:
+                # v3.5.0: 用户插话，之前的预生成已失效，进行中的一轮（包括后台自主对话）取消
+                _invalidate_speculation()
+                _cancel_round("用户发送了新消息")
+                _stop_background_job("用户发送了新消息")
+
                 # 添加用户消息到所有角色的记忆（使用用户设置的角色名）
                 user_name = st.session_state.user_character['name']
                 add_group_message(user_name, user_input, 'user')
 
                 status_placeholder = st.empty()
+                round_token = _begin_round()
 
-                # v3.0.0: 使用 CrewAI 或降级模式
-                if st.session_state.crew_manager and CREWAI_AVAILABLE:
-                    # v3.1.1: 显示不同的状态提示
-                    if st.session_state.turn_based_mode:
-                        current_speaker = st.session_state.characters[
-                            st.session_state.next_speaker_index % len(st.session_state.characters)
-                        ]['name']
-                        status_placeholder.info(f"🎭 {current_speaker} 正在思考回应...")
-                    else:
-                        status_placeholder.info("🤖 多 Agent 系统正在协作...")
-
+                with request_context('interactive', st.session_state.session_id):
                     try:
-                        # v3.1.1: 运行 CrewAI，支持单次发言模式（轮流）
-                        responses, next_idx = st.session_state.crew_manager.run_conversation_round(
-                            user_message=user_input,
-                            character_memories=st.session_state.character_memories,
-                            single_speaker=st.session_state.turn_based_mode,
-                            next_speaker_index=st.session_state.next_speaker_index
-                        )
-
-                        # 更新下一个发言者索引
-                        st.session_state.next_speaker_index = next_idx
-
-                        # 将结果添加到记忆
-                        for resp in responses:
-                            if resp['content'] and resp['content'] != 'PASS':
-                                add_group_message(resp['speaker'], resp['content'], 'character')
+                        # v3.0.0: 使用 CrewAI 或降级模式
+                        if st.session_state.crew_manager and CREWAI_AVAILABLE:
+                            # v3.1.1: 显示不同的状态提示
+                            if st.session_state.turn_based_mode:
+                                current_speaker = st.session_state.characters[
+                                    st.session_state.next_speaker_index % len(st.session_state.characters)
+                                ]['name']
+                                status_placeholder.info(f"🎭 {current_speaker} 正在思考回应...")
+                            else:
+                                status_placeholder.info("🤖 多 Agent 系统正在协作...")
+
+                            try:
+                                # v3.1.1: 运行 CrewAI，支持单次发言模式（轮流）
+                                responses, next_idx = st.session_state.crew_manager.run_conversation_round(
+                                    user_message=user_input,
+                                    character_memories=st.session_state.character_memories,
+                                    single_speaker=st.session_state.turn_based_mode,
+                                    next_speaker_index=st.session_state.next_speaker_index,
+                                    group_log=st.session_state.group_log,
+                                    memory_provider=_memory_provider(),
+                                    deadline=_round_deadline(),
+                                    cancel_token=round_token
+                                )
 
-                    except Exception as e:
-                        st.error(f"CrewAI 执行错误: {str(e)}, 降级到传统模式")
-                        # 降级到传统模式
-                        _fallback_sequential_generation(user_input, use_real_api, api_key, status_placeholder)
-                else:
-                    # 传统模式：顺序发言
-                    _fallback_sequential_generation(user_input, use_real_api, api_key, status_placeholder)
+                                # 更新下一个发言者索引
+                                st.session_state.next_speaker_index = next_idx
+
+                                # 将结果添加到记忆
+                                for resp in responses:
+                                    if resp['content'] and resp['content'] != 'PASS':
+                                        add_group_message(resp['speaker'], resp['content'], 'character')
+
+                            except RoundCancelled:
+                                raise
+                            except Exception as e:
+                                st.error(f"CrewAI 执行错误: {str(e)}, 降级到传统模式")
+                                # 降级到传统模式
+                                _fallback_sequential_generation(user_input, use_real_api, api_key,
+                                                                status_placeholder, round_token)
+                        else:
+                            # 传统模式：顺序发言
+                            _fallback_sequential_generation(user_input, use_real_api, api_key,
+                                                            status_placeholder, round_token)
+                    except RoundCancelled as e:
+                        # v3.5.0: 取消的一轮不写入群聊（已显示的发言除外）
+                        _handle_round_cancelled(e, status_placeholder)
+                    else:
+                        status_placeholder.empty()
+                st.rerun()
 
-                status_placeholder.empty()
+            # v3.5.0: 多人模式的自主对话提交到后台执行，页面立即返回
+            if auto_continue and st.session_state.background_rounds and not st.session_state.turn_based_mode:
+                job = get_job_runner().submit(
+                    _build_auto_continue_job(int(num_rounds), use_real_api, api_key),
+                    kind='auto_continue',
+                    total_steps=int(num_rounds)
+                )
+                st.session_state.background_job_id = job.id
+                st.session_state.background_job_cursor = 0
                 st.rerun()
 
             # 自主对话功能
             if auto_continue:
                 status_placeholder = st.empty()
+                # v3.5.0: 停止按钮 / 用户插话会中断本次运行，剩余轮次不再请求
+                st.button("⏹️ 停止", key="stop_auto_continue", on_click=_cancel_round, args=("用户点击停止",))
+                round_token = _begin_round()
 
-                for round_num in range(int(num_rounds)):
-                    # v3.1.1: 显示不同的状态提示
-                    if st.session_state.turn_based_mode:
-                        current_speaker = st.session_state.characters[
-                            st.session_state.next_speaker_index % len(st.session_state.characters)
-                        ]['name']
-                        status_placeholder.info(f"🎭 {current_speaker} 正在思考发言...")
-                    else:
-                        status_placeholder.info(f"🎭 第 {round_num + 1}/{int(num_rounds)} 轮自主对话...")
-
-                    # v3.0.0: 使用 CrewAI 或降级模式
-                    if st.session_state.crew_manager and CREWAI_AVAILABLE:
-                        # v3.1.1: CrewAI 模式，支持单次发言（轮流）
-                        try:
-                            responses, next_idx = st.session_state.crew_manager.run_conversation_round(
-                                user_message=None,  # 自主对话，无用户输入
-                                character_memories=st.session_state.character_memories,
-                                single_speaker=st.session_state.turn_based_mode,
-                                next_speaker_index=st.session_state.next_speaker_index
-                            )
-
-                            # 更新下一个发言者索引
-                            st.session_state.next_speaker_index = next_idx
-
-                            # 将结果添加到记忆
-                            for resp in responses:
-                                if resp['content'] and resp['content'] != 'PASS':
-                                    add_group_message(resp['speaker'], resp['content'], 'character')
+                with request_context('autonomous', st.session_state.session_id):
+                    try:
+                        for round_num in range(int(num_rounds)):
+                            round_token.poll()
+                            # v3.1.1: 显示不同的状态提示
+                            if st.session_state.turn_based_mode:
+                                current_speaker = st.session_state.characters[
+                                    st.session_state.next_speaker_index % len(st.session_state.characters)
+                                ]['name']
+                                status_placeholder.info(f"🎭 {current_speaker} 正在思考发言...")
+                            else:
+                                status_placeholder.info(f"🎭 第 {round_num + 1}/{int(num_rounds)} 轮自主对话...")
+
+                            # v3.0.0: 使用 CrewAI 或降级模式
+                            if st.session_state.crew_manager and CREWAI_AVAILABLE:
+                                # v3.1.1: CrewAI 模式，支持单次发言（轮流）
+                                try:
+                                    # v3.5.0: 优先使用与当前历史版本一致的预生成结果
+                                    speculated = _take_speculation()
+                                    if speculated is not None:
+                                        responses, next_idx = speculated
+                                        st.session_state.crew_manager.commit_round(None, responses)
+                                    else:
+                                        responses, next_idx = st.session_state.crew_manager.run_conversation_round(
+                                            user_message=None,  # 自主对话，无用户输入
+                                            character_memories=st.session_state.character_memories,
+                                            single_speaker=st.session_state.turn_based_mode,
+                                            next_speaker_index=st.session_state.next_speaker_index,
+                                            group_log=st.session_state.group_log,
+                                            memory_provider=_memory_provider(),
+                                            deadline=_round_deadline(),
+                                            cancel_token=round_token
+                                        )
 
-                        except Exception as e:
-                            st.error(f"CrewAI 执行错误: {str(e)}")
-                            # 降级
-                            _fallback_sequential_generation(None, use_real_api, api_key, status_placeholder)
-                    else:
-                        # 传统模式
-                        _fallback_sequential_generation(None, use_real_api, api_key, status_placeholder)
+                                    # 更新下一个发言者索引
+                                    st.session_state.next_speaker_index = next_idx
+
+                                    # 将结果添加到记忆
+                                    for resp in responses:
+                                        if resp['content'] and resp['content'] != 'PASS':
+                                            add_group_message(resp['speaker'], resp['content'], 'character')
+
+                                except RoundCancelled:
+                                    raise
+                                except Exception as e:
+                                    st.error(f"CrewAI 执行错误: {str(e)}")
+                                    # 降级
+                                    _fallback_sequential_generation(None, use_real_api, api_key,
+                                                                    status_placeholder, round_token)
+                            else:
+                                # 传统模式
+                                _fallback_sequential_generation(None, use_real_api, api_key,
+                                                                status_placeholder, round_token)
+                    except RoundCancelled as e:
+                        # v3.5.0: 已写入群聊的轮次保留，被取消的一轮丢弃
+                        _handle_round_cancelled(e, status_placeholder)
+                        st.rerun()
 
                 # v3.1.1: 单次发言模式下显示不同的提示
                 if st.session_state.turn_based_mode:
@@ -1504,7 +2143,8 @@ def main():
                 add_private_message(selected_char_name, '你', user_input, 'user')
 
                 # 生成角色回复（基于角色的完整记忆）
-                with st.spinner(f"{selected_char_name} 正在回复..."):
+                with st.spinner(f"{selected_char_name} 正在回复..."), \
+                        request_context('private', st.session_state.session_id):
                     # v3.2.0: 获取角色的完整记忆（群聊+私聊，支持 RAG）
                     char_memory = get_character_memory(
                         selected_char_name,
@@ -0,0 +1,145 @@
+"""
+Cancellation - 协作式取消令牌
+用户中途发送新消息或点击停止时取消进行中的一轮：尚未发出的请求不再发出，等待中的调用立即返回
+
+v3.5.0 新增功能
+"""
+
+from typing import Callable, List, Optional
+import threading
+
+
+# 等待 LLM 调用时检查取消状态的间隔（秒）
+POLL_INTERVAL = 0.25
+
+
+class RoundCancelled(Exception):
+    """本轮已被取消"""
+
+    def __init__(self, reason: str = "已取消"):
+        super().__init__(f"本轮已取消: {reason}")
+        self.reason = reason
+
+
+class CancellationToken:
+    """
+    协作式取消令牌
+
+    - cancel() 可以在任意线程调用，只生效一次
+    - 持有令牌的代码在等待点调用 raise_if_cancelled() / poll()，发现取消后抛出 RoundCancelled
+    - 轮询函数（add_poller）只在注册它的线程中执行，用于让 Streamlit 在等待期间也能响应
+      新的用户操作（Streamlit 在 st.* 调用处中断旧的脚本运行）
+    - 子令牌随父令牌一起取消，也可以单独取消
+    """
+
+    def __init__(self, parent: Optional['CancellationToken'] = None):
+        """
+        Args:
+            parent: 父令牌（父令牌取消时本令牌也取消）
+        """
+        self.parent = parent
+        self.reason: Optional[str] = None
+
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self._pollers: List[tuple] = []
+
+        if parent is not None:
+            parent.on_cancel(lambda: self.cancel(parent.reason or "上级已取消"))
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已取消"""
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "已取消"):
+        """
+        取消（重复调用无效果）
+
+        Args:
+            reason: 取消原因（用于日志和异常信息）
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ 取消回调出错: {e}")
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """
+        注册取消回调（已取消时立即执行）
+
+        Args:
+            callback: 无参函数，在调用 cancel() 的线程中执行
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def add_poller(self, poller: Callable[[], None]):
+        """
+        注册轮询函数（只在当前线程调用 poll() 时执行，可以抛出异常中断等待）
+
+        Args:
+            poller: 无参函数
+        """
+        with self._lock:
+            self._pollers.append((threading.get_ident(), poller))
+
+    def raise_if_cancelled(self):
+        """已取消时抛出 RoundCancelled"""
+        if self._event.is_set():
+            raise RoundCancelled(self.reason or "已取消")
+
+    def poll(self):
+        """
+        等待期间的检查点：执行属于当前线程的轮询函数，然后检查取消状态
+
+        Raises:
+            RoundCancelled: 已取消，或轮询函数抛出普通异常
+            BaseException: 轮询函数抛出的 BaseException（如 Streamlit 的重新运行 / 停止请求）原样抛出，
+                           抛出前令牌已取消
+        """
+        if self.parent is not None:
+            self.parent.poll()
+
+        thread_id = threading.get_ident()
+        with self._lock:
+            pollers = [poller for owner, poller in self._pollers if owner == thread_id]
+        for poller in pollers:
+            try:
+                poller()
+            except Exception as e:
+                # 轮询函数抛出的普通异常转为取消，原异常保留在 __cause__
+                self.cancel(f"等待期间被中断: {type(e).__name__}")
+                raise RoundCancelled(self.reason) from e
+            except BaseException as e:
+                # Streamlit 的 RerunException / StopException（以及 KeyboardInterrupt 等）继承自 BaseException：
+                # 先取消令牌，其他线程中的排队、等待和 Crew 随即停止，再原样抛出交给 Streamlit 处理
+                self.cancel(f"等待期间被中断: {type(e).__name__}")
+                raise
+
+        self.raise_if_cancelled()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待取消（可用作可中断的 sleep）
+
+        Returns:
+            是否已取消
+        """
+        return self._event.wait(timeout)
+
+    def child(self) -> 'CancellationToken':
+        """派生子令牌"""
+        return CancellationToken(parent=self)
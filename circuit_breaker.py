@@ -0,0 +1,241 @@
+"""
+Circuit Breaker - LLM / Embedding 后端的熔断器
+提供方持续失败时熔断（open），调用直接走降级路径；冷却后通过健康探测（half-open）恢复
+
+v3.5.0 新增功能
+"""
+
+from typing import Any, Callable, Dict, Optional
+import os
+import threading
+import time
+
+from cancellation import RoundCancelled
+from deadline import DeadlineExceeded
+from scheduler import AdmissionRejected
+
+
+# 主动取消 / 本地截止时间到期 / 本地排队拒绝：不代表后端故障，不计入失败
+_LOCAL_ERRORS = (RoundCancelled, DeadlineExceeded, AdmissionRejected)
+
+
+# 熔断器状态
+CLOSED = 'closed'        # 正常：调用直达后端
+OPEN = 'open'            # 熔断：调用直接走降级路径，不访问后端
+HALF_OPEN = 'half_open'  # 探测：放行一次试探调用，成功则恢复，失败则重新熔断
+
+
+class CircuitOpenError(Exception):
+    """熔断中且没有可用的降级路径"""
+
+    def __init__(self, name: str):
+        super().__init__(f"熔断器 {name} 已打开，后端暂不可用")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    - closed：连续失败达到 failure_threshold 次后打开
+    - open：冷却 recovery_timeout 秒内所有调用直接降级（毫秒级返回）
+    - 冷却结束：有探测函数时在后台执行健康探测，没有时放行下一次真实调用作为试探（half-open）
+    - 探测 / 试探成功则关闭，失败则重新打开并重新计时
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        Args:
+            name: 熔断器名称（如 'llm:gemini-2.0-flash-exp'）
+            failure_threshold: 连续失败多少次后熔断
+            recovery_timeout: 熔断后多少秒开始探测
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'failures': 0, 'short_circuited': 0, 'opened': 0, 'probes': 0}
+
+    @property
+    def state(self) -> str:
+        """当前状态"""
+        with self._lock:
+            return self._state
+
+    # ---------- 状态转换（调用方需持有 _lock）----------
+
+    def _open_locked(self):
+        if self._state != OPEN:
+            self._stats['opened'] += 1
+            print(f"🔌 熔断器 {self.name} 打开，{self.recovery_timeout:.0f} 秒后探测")
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+
+    def _close_locked(self):
+        if self._state != CLOSED:
+            print(f"✅ 熔断器 {self.name} 恢复")
+        self._state = CLOSED
+        self._failures = 0
+        self._probing = False
+
+    # ---------- 结果记录 ----------
+
+    def record_success(self):
+        """记录一次成功调用"""
+        with self._lock:
+            self._close_locked()
+
+    def record_failure(self):
+        """记录一次失败调用"""
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._open_locked()
+
+    # ---------- 调用 ----------
+
+    def _admit(self, probe: Optional[Callable[[], Any]]) -> Optional[str]:
+        """
+        判断本次调用是否放行到后端
+
+        Returns:
+            CLOSED 正常放行；HALF_OPEN 作为试探调用放行；None 走降级路径
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+
+            if self._state == CLOSED:
+                return CLOSED
+
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                if probe is not None:
+                    # 后台健康探测，本次调用仍然降级
+                    if not self._probing:
+                        self._probing = True
+                        self._stats['probes'] += 1
+                        threading.Thread(target=self._run_probe, args=(probe,), daemon=True).start()
+                else:
+                    # 没有探测函数：放行本次调用作为试探
+                    self._state = HALF_OPEN
+                    self._stats['probes'] += 1
+                    return HALF_OPEN
+
+            self._stats['short_circuited'] += 1
+            return None
+
+    def check(self):
+        """
+        只检查不放行（用于无法逐次记录结果的调用）
+
+        Raises:
+            CircuitOpenError: 熔断中且仍在冷却期
+        """
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at < self.recovery_timeout:
+                self._stats['short_circuited'] += 1
+                raise CircuitOpenError(self.name)
+
+    def _run_probe(self, probe: Callable[[], Any]):
+        """执行健康探测并据此关闭或重新打开熔断器"""
+        try:
+            probe()
+        except Exception:
+            with self._lock:
+                self._stats['failures'] += 1
+                self._open_locked()
+            return
+        self.record_success()
+
+    def call(self, fn: Callable[[], Any], fallback: Optional[Callable[[], Any]] = None,
+             probe: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        在熔断保护下执行调用
+
+        Args:
+            fn: 实际的调用
+            fallback: 熔断时的降级调用（None 表示直接抛出 CircuitOpenError）
+            probe: 健康探测（冷却结束后在后台执行；None 表示用下一次真实调用试探）
+
+        Returns:
+            fn 或 fallback 的返回值
+
+        Raises:
+            CircuitOpenError: 熔断中且没有降级调用
+        """
+        admitted = self._admit(probe)
+        if admitted is None:
+            if fallback is None:
+                raise CircuitOpenError(self.name)
+            return fallback()
+
+        try:
+            result = fn()
+        except _LOCAL_ERRORS:
+            # 不代表后端故障；试探调用没有得到结论时回到 open（冷却已过，下一次调用重新试探）
+            if admitted == HALF_OPEN:
+                with self._lock:
+                    if self._state == HALF_OPEN:
+                        self._state = OPEN
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+
+        self.record_success()
+        return result
+
+    def stats(self) -> Dict:
+        """熔断统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'name': self.name, 'state': self._state})
+        return stats
+
+
+# ==================== 进程级注册表 ====================
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def _settings_from_env() -> Dict:
+    """
+    读取熔断参数（可通过环境变量覆盖，见 .env.example）
+    - SCRIPTFORGE_CB_FAILURES: 连续失败阈值（默认 5）
+    - SCRIPTFORGE_CB_RECOVERY: 冷却秒数（默认 30）
+    """
+    return {
+        'failure_threshold': int(os.getenv('SCRIPTFORGE_CB_FAILURES', '5')),
+        'recovery_timeout': float(os.getenv('SCRIPTFORGE_CB_RECOVERY', '30'))
+    }
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """
+    获取进程级共享的熔断器
+
+    Args:
+        name: 熔断器名称（生成调用按模型区分，如 'llm:<model>'；向量化为 'embedding:<model>'）
+
+    Returns:
+        CircuitBreaker
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **_settings_from_env())
+            _breakers[name] = breaker
+        return breaker
+
+
+def all_circuit_breakers() -> Dict[str, CircuitBreaker]:
+    """所有已创建的熔断器（用于展示状态）"""
+    with _breakers_lock:
+        return dict(_breakers)
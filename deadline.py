@@ -0,0 +1,278 @@
+"""
+Deadline - 轮次截止时间、单次调用超时与对冲请求
+截止时间从一轮对话向下传递到每一次 LLM 调用；慢请求在达到历史延迟分位数后发送一份对冲副本，先返回者胜出
+
+v3.5.0 新增功能
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional
+import contextvars
+import os
+import threading
+import time
+
+from cancellation import CancellationToken, POLL_INTERVAL
+
+
+# 单次请求的默认超时（秒），作用于底层 HTTP 客户端
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv('SCRIPTFORGE_LLM_REQUEST_TIMEOUT', '60'))
+
+# 一轮对话的默认截止时间（秒）
+DEFAULT_ROUND_TIMEOUT = float(os.getenv('SCRIPTFORGE_ROUND_TIMEOUT', '90'))
+
+
+class DeadlineExceeded(TimeoutError):
+    """截止时间已到，调用被放弃"""
+
+
+class Deadline:
+    """
+    截止时间（基于 time.monotonic）
+
+    seconds 为 None 表示不限时；子截止时间不会晚于父截止时间。
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    @classmethod
+    def after(cls, seconds: Optional[float]) -> 'Deadline':
+        """从现在起 seconds 秒后到期"""
+        return cls(seconds)
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数（不限时返回 None，已到期返回 0）"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """是否已到期"""
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self):
+        """已到期时抛出 DeadlineExceeded"""
+        if self.expired():
+            raise DeadlineExceeded("截止时间已到")
+
+    def child(self, seconds: Optional[float]) -> 'Deadline':
+        """
+        派生子截止时间
+
+        Args:
+            seconds: 子任务自身的时限（None 表示只受父截止时间约束）
+
+        Returns:
+            取两者中较早的一个
+        """
+        child = Deadline(seconds)
+        if self.expires_at is not None and (child.expires_at is None or self.expires_at < child.expires_at):
+            child.expires_at = self.expires_at
+        return child
+
+
+class LatencyTracker:
+    """
+    延迟统计（滑动窗口）
+
+    记录最近的调用耗时，用于计算对冲阈值；同时统计对冲与超时次数。
+    """
+
+    def __init__(self, window: int = 200):
+        """
+        Args:
+            window: 参与分位数计算的最近样本数
+        """
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._stats = {'hedges': 0, 'hedge_wins': 0, 'deadline_exceeded': 0,
+                       'cancelled': 0, 'discarded_tokens': 0}
+
+    def record(self, latency: float):
+        """记录一次成功调用的耗时（秒）"""
+        with self._lock:
+            self._samples.append(latency)
+
+    def count(self, key: str, value: int = 1):
+        """累加一个计数（'hedges' / 'hedge_wins' / 'deadline_exceeded' / 'cancelled' / 'discarded_tokens'）"""
+        with self._lock:
+            self._stats[key] += value
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        延迟分位数
+
+        Args:
+            p: 0-100
+
+        Returns:
+            分位数（秒）；没有样本时返回 None
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round((len(samples) - 1) * p / 100)))
+        return samples[index]
+
+    def hedge_delay(self, percentile: float, min_samples: int = 20) -> Optional[float]:
+        """
+        对冲阈值：请求耗时超过该值仍未返回时发送副本
+
+        Args:
+            percentile: 分位数（<= 0 表示关闭对冲）
+            min_samples: 样本不足时不对冲
+
+        Returns:
+            阈值秒数；不对冲时返回 None
+        """
+        if percentile <= 0:
+            return None
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+        return self.percentile(percentile)
+
+    def stats(self) -> Dict:
+        """统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['samples'] = len(self._samples)
+        for p in (50, 95, 99):
+            value = self.percentile(p)
+            stats[f'p{p}'] = round(value, 3) if value is not None else None
+        return stats
+
+
+# ==================== 带截止时间的调用 ====================
+
+# 对冲配置（可通过环境变量覆盖，见 .env.example）
+HEDGE_PERCENTILE = float(os.getenv('SCRIPTFORGE_HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_SAMPLES = int(os.getenv('SCRIPTFORGE_HEDGE_MIN_SAMPLES', '20'))
+
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="deadline")
+
+_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(name: str) -> LatencyTracker:
+    """获取进程级共享的延迟统计（通常按模型 ID 区分）"""
+    with _trackers_lock:
+        tracker = _trackers.get(name)
+        if tracker is None:
+            tracker = LatencyTracker()
+            _trackers[name] = tracker
+        return tracker
+
+
+def call_with_deadline(fn: Callable[[], Any], deadline: Optional[Deadline],
+                       hedge_after: Optional[float] = None, max_hedges: int = 1,
+                       tracker: Optional[LatencyTracker] = None,
+                       hedge_fn: Optional[Callable[[], Any]] = None,
+                       cancel_token: Optional[CancellationToken] = None) -> Any:
+    """
+    在截止时间内执行调用，必要时发送对冲副本
+
+    超时、被取消或对冲落败的调用无法强行中断，会在后台线程中自然结束，结果被丢弃；
+    尚未开始执行的调用会被撤销。
+
+    Args:
+        fn: 实际的调用（可能被执行多次，必须是幂等的）
+        deadline: 截止时间（None 或不限时则直接调用）
+        hedge_after: 首个请求超过该秒数未返回时发送副本（None 表示不对冲）
+        max_hedges: 最多发送的副本数
+        tracker: 用于统计对冲 / 超时次数
+        hedge_fn: 对冲副本使用的调用（默认与 fn 相同）
+        cancel_token: 取消令牌（等待期间每 POLL_INTERVAL 秒检查一次）
+
+    Returns:
+        最先成功返回的结果
+
+    Raises:
+        DeadlineExceeded: 截止时间内没有任何请求成功
+        RoundCancelled: 等待期间被取消
+    """
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    elif (deadline is None or deadline.remaining() is None) and hedge_after is None:
+        return fn()
+
+    deadline = deadline or Deadline()
+    if deadline.expired():
+        if tracker:
+            tracker.count('deadline_exceeded')
+        raise DeadlineExceeded("截止时间已到，未发起调用")
+
+    # 工作线程继承调用方的上下文（请求类别等，见 scheduler.request_context）
+    context = contextvars.copy_context()
+    pending: List[Future] = [_executor.submit(context.copy().run, fn)]
+    hedge_futures: List[Future] = []
+
+    try:
+        return _wait_first(pending, hedge_futures, deadline, hedge_after, max_hedges,
+                           tracker, lambda: context.copy().run(hedge_fn or fn), cancel_token)
+    except BaseException:
+        # 取消 / 超时 / 调用方被中断：撤销尚未开始的请求，已发出的请求结果丢弃
+        for future in pending:
+            future.cancel()
+        raise
+
+
+def _wait_first(pending: List[Future], hedge_futures: List[Future], deadline: Deadline,
+                hedge_after: Optional[float], max_hedges: int,
+                tracker: Optional[LatencyTracker], hedge_fn: Callable[[], Any],
+                cancel_token: Optional[CancellationToken]) -> Any:
+    """call_with_deadline 的等待循环"""
+    last_error: Optional[BaseException] = None
+    last_launch = time.monotonic()
+
+    while pending:
+        remaining = deadline.remaining()
+        timeout = remaining
+        can_hedge = hedge_after is not None and len(hedge_futures) < max_hedges
+        if can_hedge:
+            until_hedge = max(0.0, last_launch + hedge_after - time.monotonic())
+            timeout = until_hedge if remaining is None else min(until_hedge, remaining)
+        if cancel_token is not None:
+            timeout = POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL)
+
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            pending.remove(future)
+            error = future.exception()
+            if error is None:
+                for other in pending:
+                    other.cancel()
+                if tracker and future in hedge_futures:
+                    tracker.count('hedge_wins')
+                return future.result()
+            last_error = error
+
+        if done:
+            if not pending and last_error is not None:
+                raise last_error
+            continue
+
+        if cancel_token is not None:
+            cancel_token.poll()
+
+        if deadline.expired():
+            break
+        if not can_hedge or time.monotonic() - last_launch < hedge_after:
+            continue
+
+        # 首个请求过慢：发送对冲副本
+        hedge = _executor.submit(hedge_fn)
+        pending.append(hedge)
+        hedge_futures.append(hedge)
+        last_launch = time.monotonic()
+        if tracker:
+            tracker.count('hedges')
+
+    if tracker:
+        tracker.count('deadline_exceeded')
+    raise DeadlineExceeded("截止时间内没有请求返回")
@@ -0,0 +1,191 @@
+"""
+Director Pipeline - 导演系统的跨轮流水线执行
+自主对话（无用户输入）时，第 N 轮审核进行的同时提前规划第 N+1 轮，规划阶段不再占用关键路径
+
+v3.5.0 新增功能
+"""
+
+from typing import Dict, Hashable, List, Optional, Tuple
+import contextvars
+import hashlib
+import json
+import threading
+import time
+
+from director_system import DirectorSystem, RoundPlan
+from memory_store import GroupMessageLog
+from speculative import SpeculativeEngine
+from deadline import Deadline
+from cancellation import CancellationToken
+from rate_limiter import estimate_tokens
+from tracing import RoundTrace
+
+
+def _context_key(version: int, lines: List[Dict]) -> Hashable:
+    """
+    预规划所依据的历史：追加后的日志版本号 + 新追加发言的内容哈希
+
+    日志只追加，版本号确定了之前的历史；内容哈希确认新追加的正是预规划所用的那版对话
+    （数量相同的其他消息，例如用户发言或局部重做后的另一版对话，不会命中）
+    """
+    payload = json.dumps([(m['speaker'], m['content']) for m in lines], ensure_ascii=False)
+    return version, hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class PipelinedDirectorRunner:
+    """
+    导演系统流水线执行器
+
+    流程（第 N 轮）：
+        规划 N（通常已提前完成）→ 表演 N → ┬ 审核 N
+                                          └ 后台规划 N+1（基于表演 N 的对话）
+
+    - 命中：第 N+1 轮开始时历史与预规划所依据的对话一致，直接使用预规划结果
+    - 失效重规划：审核不通过重做发言（依据的对话变了）、用户发言、调用方写入了其他消息时，
+      预规划被丢弃（进行中的请求一并取消），本轮同步重新规划
+    - 调用方负责把每轮结果写入 group_log / character_memories（与直接使用 DirectorSystem 相同）
+    """
+
+    def __init__(self, director: DirectorSystem, group_log: GroupMessageLog,
+                 character_memories: Optional[Dict[str, List]] = None,
+                 max_retries: int = 2):
+        """
+        Args:
+            director: 导演系统
+            group_log: 群聊消息日志（调用方每轮追加）
+            character_memories: 角色记忆（调用方每轮追加）
+            max_retries: 审核不通过时的最大重试次数
+        """
+        self.director = director
+        self.group_log = group_log
+        self.character_memories = character_memories
+        self.max_retries = max_retries
+
+        self._speculative = SpeculativeEngine()
+        self._round_token: Optional[CancellationToken] = None
+        self._base_version: Optional[int] = None  # 本轮开始时的日志版本（预规划键的基准）
+        self._lock = threading.Lock()
+
+        # 统计
+        self.rounds = 0
+        self.replans = 0
+        self._first_start: Optional[float] = None
+        self._last_end: Optional[float] = None
+
+    def run_round(self, user_message: Optional[str] = None,
+                  deadline: Optional[Deadline] = None,
+                  cancel_token: Optional[CancellationToken] = None) -> Dict:
+        """
+        运行一轮（返回值与 DirectorSystem.run_conversation_round 相同）
+
+        Args:
+            user_message: 用户输入（提供时丢弃预规划，按用户输入重新规划）
+            deadline: 本轮截止时间
+            cancel_token: 取消令牌（取消时本轮发起的预规划一并取消）
+
+        Raises:
+            RoundCancelled: 本轮被取消
+        """
+        start = time.perf_counter()
+        if self._first_start is None:
+            self._first_start = start
+
+        plan = None
+        trace = RoundTrace()
+        if user_message:
+            # 用户插话：预规划所依据的上下文已过时
+            self._speculative.invalidate()
+        elif self._base_version is not None and self.group_log.version > self._base_version:
+            # 上一轮之后追加的消息应当正是预规划所用的那版对话
+            appended = self.group_log.recent(self.group_log.version - self._base_version)
+            speculated = self._speculative.take(_context_key(self.group_log.version, appended))
+            if speculated is not None:
+                plan, plan_trace = speculated
+                # 提前完成的规划阶段记入本轮追踪（不在本轮关键路径上）
+                trace.merge(plan_trace, speculative=True)
+        if plan is None and self.rounds > 0:
+            self.replans += 1
+
+        with self._lock:
+            self._round_token = cancel_token
+            self._base_version = self.group_log.version
+
+        result = self.director.run_conversation_round(
+            user_message=user_message,
+            character_memories=self.character_memories,
+            max_retries=self.max_retries,
+            group_log=self.group_log,
+            deadline=deadline,
+            cancel_token=cancel_token,
+            plan=plan,
+            on_draft=self._plan_ahead,
+            trace=trace
+        )
+
+        self.rounds += 1
+        self._last_end = time.perf_counter()
+        return result
+
+    def _plan_ahead(self, draft: List[Dict]):
+        """表演完成后立即在后台规划下一轮（同一轮的新版对话会替换旧的预规划）"""
+        with self._lock:
+            round_token = self._round_token
+            base_version = self._base_version
+        token = round_token.child() if round_token is not None else CancellationToken()
+
+        lines = [{'speaker': d['speaker'], 'content': d['content']} for d in draft]
+        recent = self.group_log.recent(10) + lines
+        key = _context_key(base_version + len(lines), lines)
+        draft_log = GroupMessageLog(recent[-10:])
+
+        # 在后台线程中沿用当前的请求类别 / 会话（scheduler.request_context）
+        context = contextvars.copy_context()
+        self._speculative.submit(
+            key,
+            lambda: context.run(self._plan_traced, draft_log, token),
+            token_counter=self._count_plan_tokens,
+            cancel_token=token
+        )
+
+    def _plan_traced(self, draft_log: GroupMessageLog,
+                     cancel_token: CancellationToken) -> Tuple[RoundPlan, RoundTrace]:
+        """预规划（单独记录追踪，命中时并入下一轮的追踪；plan() 不修改导演状态，采用时才提交）"""
+        plan_trace = RoundTrace()
+        with plan_trace.activate():
+            # 本轮结束时剧情目标才计一次使用：按计入之后的状态规划，跨过有效期时直接重新规划
+            plan = self.director.plan(None, None, draft_log, None, cancel_token, rounds_ahead=1)
+        return plan, plan_trace
+
+    @staticmethod
+    def _count_plan_tokens(speculated: Tuple[RoundPlan, RoundTrace]) -> int:
+        return sum(estimate_tokens(part) for part in speculated[0])
+
+    def invalidate(self):
+        """丢弃预规划（例如调用方修改了历史）"""
+        self._speculative.invalidate()
+
+    def stats(self) -> Dict:
+        """
+        流水线统计
+
+        Returns:
+            {
+                'rounds': 已完成轮数,
+                'replans': 预规划未命中、同步重新规划的轮数（不含第一轮）,
+                'elapsed': 第一轮开始到最后一轮结束的秒数,
+                'rounds_per_minute': 吞吐量,
+                'speculation': SpeculativeEngine 统计（命中 / 丢弃 / 浪费 token）
+            }
+        """
+        elapsed = (self._last_end - self._first_start) if self._last_end and self._first_start else 0.0
+        return {
+            'rounds': self.rounds,
+            'replans': self.replans,
+            'elapsed': round(elapsed, 3),
+            'rounds_per_minute': round(self.rounds * 60.0 / elapsed, 2) if elapsed > 0 else 0.0,
+            'speculation': self._speculative.stats()
+        }
+
+    def shutdown(self):
+        """丢弃预规划并关闭后台线程"""
+        self._speculative.shutdown()
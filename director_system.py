@@ -5,9 +5,122 @@ v3.4.0 - 分层架构实验
 """
 
 from crewai import Agent, Task, Crew, Process
-from langchain_google_genai import ChatGoogleGenerativeAI
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import ExitStack
+from typing import Callable, List, Dict, Optional, Tuple
+import contextvars
+import itertools
 import json
+import os
+import re
+import threading
+import time
+
+from llm_backend import get_crewai_llm, generate_text, kickoff_crew
+from memory_store import GroupMessageLog, CharacterMemoryProvider
+from deadline import Deadline, DeadlineExceeded
+from cancellation import CancellationToken, RoundCancelled, POLL_INTERVAL
+from evaluation_system import ReviewPrescreen
+from tracing import RoundTrace, stage, record_llm_usage, current_llm_calls, current_trace, trace_file
+from structured_output import PLAN_SCHEMA, FUSED_PLAN_SCHEMA, REVIEW_SCHEMA, parse_structured
+
+
+# v3.5.0: 规划模式
+#   fused     : 编剧目标和导演分配由一次结构化调用同时给出（少一次串行 LLM 往返）
+#   two_stage : 编剧规划 → 导演分配，两次调用
+PLANNING_MODES = ('fused', 'two_stage')
+
+DEFAULT_PLOT_GOAL = "剧情目标: 延续当前话题"
+
+# v3.5.0: 角色表演模式
+#   concurrent : 各角色同时生成（受全局限流器约束），本轮耗时取决于最慢的角色
+#   sequential : 一个顺序执行的 Crew，后面的角色能看到前面的发言
+PERFORM_MODES = ('concurrent', 'sequential')
+
+
+class RetryBudget:
+    """
+    审核重试预算（v3.5.0 新增）
+
+    除次数上限外，再按截止时间和 token 预算决定是否还值得重试：
+    预计下一次尝试（表演 + 审核）的耗时 / token 按最近一次尝试估算，
+    超出剩余时间或剩余 token 时不再重试。
+    """
+
+    def __init__(self, max_retries: int, deadline: Optional[Deadline] = None,
+                 token_budget: Optional[int] = None):
+        """
+        Args:
+            max_retries: 最大重试次数
+            deadline: 本轮截止时间
+            token_budget: 本轮 token 预算（None / 0 表示不限）
+        """
+        self.max_retries = max_retries
+        self.deadline = deadline or Deadline()
+        self.token_budget = token_budget or None
+
+    def stop_reason(self, retries_done: int, last_seconds: float, last_tokens: int,
+                    spent_tokens: int) -> Optional[str]:
+        """
+        判断是否停止重试
+
+        Args:
+            retries_done: 已重试次数
+            last_seconds: 最近一次尝试的耗时
+            last_tokens: 最近一次尝试消耗的 token
+            spent_tokens: 本轮已消耗的 token
+
+        Returns:
+            停止原因（None 表示可以继续重试）
+        """
+        if retries_done >= self.max_retries:
+            return "已达最大重试次数"
+
+        remaining = self.deadline.remaining()
+        if remaining is not None and last_seconds > remaining:
+            return f"剩余 {remaining:.1f}s 不足以再尝试一次（预计 {last_seconds:.1f}s）"
+
+        if self.token_budget is not None and spent_tokens + last_tokens > self.token_budget:
+            return f"token 预算不足（已用 {spent_tokens}，预计再用 {last_tokens}，预算 {self.token_budget}）"
+
+        return None
+
+
+class RoundPlan:
+    """
+    一轮的规划结果（v3.5.0 新增）
+
+    可以按 (plot_goal, director_plan) 解包；plot_update 记录这次规划对剧情目标状态的改动
+    （沿用 / 失效 / 新目标），只有本轮实际采用该规划时才提交（见 DirectorSystem._commit_plot_plan），
+    因此提前执行、后来被丢弃的规划不会改动导演系统的状态和统计
+    """
+
+    def __init__(self, plot_goal: str, director_plan: str, plot_update: Optional[Dict] = None):
+        self.plot_goal = plot_goal
+        self.director_plan = director_plan
+        self.plot_update = plot_update
+
+    def __iter__(self):
+        return iter((self.plot_goal, self.director_plan))
+
+
+def _topic_terms(text: str) -> set:
+    """话题特征：相邻字符二元组（中文没有空格分词，按字切分更稳定）"""
+    chars = re.findall(r'\w', text.lower())
+    return {a + b for a, b in zip(chars, chars[1:])}
+
+
+def _attempt_score(review_result: Dict) -> float:
+    """一次尝试的得分（审核分数的平均值；没有分数时按逐角色判定的通过比例折算到 0-10）"""
+    scores = [v for v in (review_result.get('scores') or {}).values() if isinstance(v, (int, float))]
+    if scores:
+        return sum(scores) / len(scores)
+    verdicts = review_result.get('verdicts')
+    if isinstance(verdicts, dict) and verdicts:
+        passed = sum(1 for v in verdicts.values()
+                     if (v.get('pass', True) if isinstance(v, dict) else v) is not False)
+        return 10.0 * passed / len(verdicts)
+    return 0.0
 
 
 class DirectorSystem:
@@ -19,10 +132,19 @@ class DirectorSystem:
     2. 导演 Agent：分配角色任务
     3. 角色 Agents：执行对话生成
     4. 审核 Agent：质量检查
+
+    v3.5.0: 默认使用融合规划（编剧 + 导演一次调用完成），planning_mode='two_stage' 保留原两阶段流程
+    v3.5.0: 默认各角色同时表演（perform_mode='sequential' 保留原顺序执行）
+    v3.5.0: 导演计划和审核结果按 JSON Schema 解析（见 structured_output），
+            解析失败时先修复一次，不再让所有角色发言或默认通过
     """
 
     def __init__(self, scene: str, characters: List[Dict[str, str]],
-                 api_key: str, model_id: str = "gemini-2.0-flash-exp"):
+                 api_key: str, model_id: str = "gemini-2.0-flash-exp",
+                 crewai_memory: bool = False, planning_mode: str = 'fused',
+                 prescreen: Optional[ReviewPrescreen] = None, perform_mode: str = 'concurrent',
+                 retry_token_budget: Optional[int] = None, plot_horizon: Optional[int] = None,
+                 topic_shift_threshold: float = 0.1):
         """
         初始化导演系统
 
@@ -31,28 +153,65 @@ class DirectorSystem:
             characters: 角色列表
             api_key: API Key
             model_id: 模型 ID
+            crewai_memory: 是否启用 CrewAI 内置记忆（v3.5.0 起默认关闭，记忆由 Scriptforge 记忆层提供）
+            planning_mode: 规划模式（v3.5.0 新增，'fused' / 'two_stage'）
+            prescreen: 审核预筛（v3.5.0 新增，默认按环境变量 SCRIPTFORGE_PRESCREEN_* 构建）
+            perform_mode: 角色表演模式（v3.5.0 新增，'concurrent' / 'sequential'）
+            retry_token_budget: 每轮 token 预算（v3.5.0 新增，超出时不再重试；
+                                默认读取 SCRIPTFORGE_DIRECTOR_TOKEN_BUDGET，0 表示不限）
+            plot_horizon: 剧情目标最多沿用的轮数（v3.5.0 新增，自主轮次在有效期内跳过编剧；
+                          默认读取 SCRIPTFORGE_PLOT_HORIZON，<= 1 表示每轮重新规划）
+            topic_shift_threshold: 最近发言与规划时话题的重合度低于该值视为话题转移（v3.5.0 新增）
         """
+        if planning_mode not in PLANNING_MODES:
+            raise ValueError(f"未知的规划模式: {planning_mode}（可选: {', '.join(PLANNING_MODES)}）")
+        if perform_mode not in PERFORM_MODES:
+            raise ValueError(f"未知的表演模式: {perform_mode}（可选: {', '.join(PERFORM_MODES)}）")
+
         self.scene = scene
         self.characters = characters
         self.api_key = api_key
         self.model_id = model_id
-
-        # 初始化 LLM
-        self.llm = ChatGoogleGenerativeAI(
-            model=model_id,
-            google_api_key=api_key,
-            temperature=0.7,
-            convert_system_message_to_human=True
-        )
+        self.crewai_memory = crewai_memory
+        self.planning_mode = planning_mode
+        self.perform_mode = perform_mode
+        if retry_token_budget is None:
+            retry_token_budget = int(os.getenv('SCRIPTFORGE_DIRECTOR_TOKEN_BUDGET', '0'))
+        self.retry_token_budget = retry_token_budget
+        if plot_horizon is None:
+            plot_horizon = int(os.getenv('SCRIPTFORGE_PLOT_HORIZON', '3'))
+        self.plot_horizon = plot_horizon
+        self.topic_shift_threshold = topic_shift_threshold
+        self._plot_plan: Optional[Dict] = None
+        self._plot_lock = threading.Lock()
+        self._plot_stats = {'planned': 0, 'reused': 0, 'invalidated': {}}
+        # v3.5.0: 导演计划不可用时轮流由一位角色发言（不再让所有角色都发言）
+        self._fallback_turn = itertools.count()
+        # v3.5.0: 明显的好 / 坏对话由本地指标直接判定，只有边界情况才调用 LLM 审核
+        self.prescreen = prescreen or ReviewPrescreen.from_env()
+
+        # 初始化 LLM（v3.5.0: 进程级共享，跨会话复用；后端可切换为本地模拟）
+        self.llm = get_crewai_llm(api_key, model_id, temperature=0.7)
+        # v3.5.0: 审核是确定性的评判调用（温度为 0），允许使用响应缓存
+        self.judge_llm = get_crewai_llm(api_key, model_id, temperature=0.0, cacheable=True)
 
         # 创建管理层 Agents
         self.writer_agent = self._create_writer_agent()
         self.director_agent = self._create_director_agent()
+        self.planner_agent = self._create_planner_agent()
         self.reviewer_agent = self._create_reviewer_agent()
 
         # 创建角色 Agents
         self.character_agents = self._create_character_agents()
 
+        # v3.5.0: CrewAI 执行时会修改 Agent 的状态，同一个 Agent 同一时刻只参与一个 Crew
+        #         （例如流水线被丢弃的预规划尚未停下时，本轮同步重新规划也要用到编导 Agent）
+        self._agent_locks = {
+            agent.role: threading.Lock()
+            for agent in [self.writer_agent, self.director_agent, self.planner_agent,
+                          self.reviewer_agent] + self.character_agents
+        }
+
         # 对话历史
         self.conversation_history = []
 
@@ -94,6 +253,28 @@ class DirectorSystem:
 角色：{', '.join([f"{c['name']}({c['personality']})" for c in self.characters])}
 
 你的任务是：根据编剧的剧情目标，为每个需要发言的角色提供明确的发言指示。
+""",
+            llm=self.llm,
+            verbose=False,
+            allow_delegation=False
+        )
+
+    def _create_planner_agent(self) -> Agent:
+        """创建编导 Agent（v3.5.0: 融合规划模式下同时承担编剧和导演的职责）"""
+        return Agent(
+            role="编导（Writer-Director）",
+            goal="设计本轮剧情目标，并据此分配角色发言",
+            backstory=f"""
+你同时是这部话剧的编剧和导演：
+1. 剧情设计：根据当前对话状态，规划下一步剧情发展，制造冲突和悬念
+2. 节奏把控：决定本轮对话的快慢、紧张度
+3. 发言分配：根据剧情目标，决定哪些角色发言
+4. 发言指示：为每个发言的角色提供明确的方向和语气
+
+当前场景：{self.scene}
+角色：{', '.join([f"{c['name']}({c['personality']})" for c in self.characters])}
+
+你的任务是：一次性给出本轮的剧情目标和角色发言分配。
 """,
             llm=self.llm,
             verbose=False,
@@ -118,7 +299,7 @@ class DirectorSystem:
 
 你的任务是：审查生成的对话，给出"通过/重做"的判断和具体建议。
 """,
-            llm=self.llm,
+            llm=self.judge_llm,
             verbose=False,
             allow_delegation=False
         )
@@ -143,72 +324,374 @@ class DirectorSystem:
                 llm=self.llm,
                 verbose=False,
                 allow_delegation=False,
-                memory=True
+                memory=self.crewai_memory  # v3.5.0: 记忆由 Scriptforge 记忆层注入任务
             )
             agents.append(agent)
         return agents
 
     def run_conversation_round(self, user_message: Optional[str] = None,
                               character_memories: Optional[Dict[str, List]] = None,
-                              max_retries: int = 2) -> Dict:
+                              max_retries: int = 2,
+                              group_log: Optional[GroupMessageLog] = None,
+                              memory_provider: Optional[CharacterMemoryProvider] = None,
+                              deadline: Optional[Deadline] = None,
+                              cancel_token: Optional[CancellationToken] = None,
+                              planning_mode: Optional[str] = None,
+                              plan: Optional[Tuple[str, str]] = None,
+                              on_draft: Optional[Callable[[List[Dict]], None]] = None,
+                              trace: Optional[RoundTrace] = None,
+                              token_budget: Optional[int] = None) -> Dict:
         """
         运行一轮完整的对话（含管理层）
 
         Args:
             user_message: 用户输入
             character_memories: 角色记忆
-            max_retries: 最大重试次数（审核不通过时）
+            max_retries: 最大重试次数（审核不通过时；v3.5.0 起预计超出截止时间或 token 预算时提前停止）
+            group_log: 群聊消息日志（v3.5.0 新增，提供时不再扫描 character_memories）
+            memory_provider: 角色记忆提供器（v3.5.0 新增，默认基于 character_memories 构建）
+            deadline: 本轮截止时间（v3.5.0 新增，各阶段共用；到期的阶段降级而不是阻塞整轮）
+            cancel_token: 取消令牌（v3.5.0 新增，取消后不再进入下一阶段，整轮结果丢弃）
+            planning_mode: 本轮的规划模式（v3.5.0 新增，默认使用初始化时的设置）
+            plan: 已完成的规划（v3.5.0 新增，plan() 的返回值；提供时跳过规划阶段，
+                  沿用的剧情目标在此期间已失效时重新规划）
+            on_draft: 每版对话生成后、审核之前的回调（v3.5.0 新增，参数为对话副本）
+            trace: 记录本轮的追踪（v3.5.0 新增，默认新建；设置 SCRIPTFORGE_TRACE_FILE 时自动追加导出）
+            token_budget: 本轮 token 预算（v3.5.0 新增，默认使用初始化时的 retry_token_budget）
 
         Returns:
             {
                 'plot_goal': '本轮剧情目标',
                 'director_plan': '导演分配计划',
                 'dialogues': [{'speaker': '...', 'content': '...'}],
-                'review_result': {'pass': True/False, 'feedback': '...'},
-                'retry_count': 重试次数
+                'review_result': {'pass': True/False, 'feedback': '...', 'verdicts': {...},
+                                  'source': 'prescreen' / 'llm' / 'timeout' / 'parse_error',
+                                  'parse_error': 审核输出修复后仍无法解析（v3.5.0 新增；本地指标能定位问题发言时
+                                                 按未通过处理，否则只重做审核，仍无法解析时采用当前对话，
+                                                 source 为 'parse_error'）,
+                                  'forced': 强制通过的原因（仅放弃重试时）},
+                'retry_count': 实际重试次数,
+                'calls_saved': 局部重做节省的角色调用次数（v3.5.0 新增）,
+                'trace': 分阶段耗时追踪（v3.5.0 新增，见 RoundTrace.to_dict）
             }
-        """
 
-        # ========== 阶段1：编剧规划 ==========
-        plot_goal = self._writer_plan(user_message, character_memories)
-
-        # ========== 阶段2：导演分配 ==========
-        director_plan = self._director_assign(plot_goal, user_message, character_memories)
+        Raises:
+            RoundCancelled: 本轮被取消
+        """
+        trace = trace or RoundTrace()
+        with trace.activate():
+            result = self._run_round(user_message, character_memories, max_retries, group_log,
+                                     memory_provider, deadline, cancel_token, planning_mode, plan,
+                                     on_draft, token_budget)
+        result['trace'] = trace.to_dict()
+
+        path = trace_file()
+        if path:
+            try:
+                trace.append_to(path)
+            except OSError as e:
+                print(f"⚠️ 追踪导出失败: {e}")
+
+        return result
+
+    def _run_round(self, user_message: Optional[str],
+                   character_memories: Optional[Dict[str, List]],
+                   max_retries: int,
+                   group_log: Optional[GroupMessageLog],
+                   memory_provider: Optional[CharacterMemoryProvider],
+                   deadline: Optional[Deadline],
+                   cancel_token: Optional[CancellationToken],
+                   planning_mode: Optional[str],
+                   plan: Optional[Tuple[str, str]],
+                   on_draft: Optional[Callable[[List[Dict]], None]],
+                   token_budget: Optional[int] = None) -> Dict:
+        """一轮的各个阶段（参数见 run_conversation_round）"""
+
+        # v3.5.0: 兼容旧调用，本轮只重建一次群聊日志
+        if group_log is None:
+            group_log = GroupMessageLog.from_character_memories(character_memories)
+        if memory_provider is None:
+            memory_provider = CharacterMemoryProvider(character_memories)
+        deadline = deadline or Deadline()
+
+        # ========== 阶段1+2：规划（v3.5.0: 流水线执行时可能已提前完成）==========
+        # 预先完成的规划在本轮采用时才提交剧情目标状态；沿用的目标已失效（如被审核反馈作废）时重新规划
+        if plan is not None and not self._commit_plot_plan(getattr(plan, 'plot_update', None)):
+            print(f"\n📝 预先完成的规划沿用的剧情目标已失效，重新规划")
+            plan = None
+        if plan is not None:
+            plot_goal, director_plan = plan
+            print(f"\n📝 使用预先完成的规划: {plot_goal}")
+        else:
+            plan = self.plan(user_message, character_memories, group_log,
+                             deadline, cancel_token, planning_mode)
+            self._commit_plot_plan(plan.plot_update)
+            plot_goal, director_plan = plan
 
         # ========== 阶段3：角色生成（支持重试）==========
+        # v3.5.0: 重试受次数、截止时间和 token 预算共同约束；放弃重试时采用得分最高的一次
+        budget = RetryBudget(max_retries, deadline, token_budget or self.retry_token_budget)
         retry_count = 0
-        while retry_count <= max_retries:
-            dialogues = self._characters_perform(director_plan, character_memories)
+        calls_saved = 0
+        dialogues = None
+        attempts = []
+        while True:
+            attempt_start = time.perf_counter()
+            with stage('perform', attempt=retry_count) as perform_span:
+                if dialogues is None:
+                    dialogues = self._characters_perform(director_plan, memory_provider, deadline,
+                                                         cancel_token)
+                else:
+                    # v3.5.0: 重试时只重新生成审核标记的发言，已通过的保留
+                    dialogues, saved = self._regenerate_flagged(director_plan, dialogues, review_result,
+                                                                memory_provider, deadline, cancel_token)
+                    calls_saved += saved
+
+            if on_draft is not None:
+                # v3.5.0: 审核进行的同时，调用方可以基于这版对话开始下一轮的规划
+                on_draft(list(dialogues))
 
             # ========== 阶段4：审核检查 ==========
-            review_result = self._reviewer_check(plot_goal, director_plan, dialogues)
+            review_start = time.perf_counter()
+            with stage('review', attempt=retry_count) as review_span:
+                review_result = self._reviewer_check(plot_goal, director_plan, dialogues, deadline,
+                                                     cancel_token)
+                if review_span is not None:
+                    review_span.attrs['source'] = review_result.get('source')
+
+            if review_result.get('parse_error') and not review_result.get('verdicts'):
+                # v3.5.0: 审核输出无法解析、本地指标也定位不到问题发言时，重做表演没有依据：
+                # 只重做一次审核（受 RetryBudget 约束），仍无法解析则采用这版对话
+                trace = current_trace()
+                review_tokens = (review_span.prompt_tokens + review_span.completion_tokens
+                                 if review_span is not None else 0)
+                stop = budget.stop_reason(retry_count, time.perf_counter() - review_start, review_tokens,
+                                          trace.total_tokens() if trace is not None else 0)
+                if stop is None:
+                    retry_count += 1
+                    print(f"⚠️  审核结果无法解析，第 {retry_count} 次重试（只重做审核）...")
+                    with stage('review', attempt=retry_count) as review_span:
+                        review_result = self._reviewer_check(plot_goal, director_plan, dialogues, deadline,
+                                                             cancel_token, reparse=True)
+                        if review_span is not None:
+                            review_span.attrs['source'] = review_result.get('source')
+
+                if review_result.get('parse_error') and not review_result.get('verdicts'):
+                    print(f"⚠️  审核结果仍无法解析，采用当前对话")
+                    review_result['pass'] = True
+                    review_result['source'] = 'parse_error'
+                    if stop:
+                        review_result['forced'] = stop
+                    if review_span is not None:
+                        review_span.attrs['source'] = 'parse_error'
 
             if review_result['pass']:
                 # 通过，跳出循环
                 break
-            else:
-                # 不通过，重试
-                retry_count += 1
-                if retry_count <= max_retries:
-                    print(f"⚠️  审核不通过，第 {retry_count} 次重试...")
-                else:
-                    print(f"⚠️  已达最大重试次数，强制通过")
-                    review_result['pass'] = True  # 强制通过
+
+            attempts.append((_attempt_score(review_result), retry_count, dialogues, review_result))
+            attempt_tokens = sum(span.prompt_tokens + span.completion_tokens
+                                 for span in (perform_span, review_span) if span is not None)
+            trace = current_trace()
+            stop = budget.stop_reason(retry_count, time.perf_counter() - attempt_start, attempt_tokens,
+                                      trace.total_tokens() if trace is not None else 0)
+            if stop:
+                # 不再重试：采用得分最高的一次（同分取较新的）
+                _, best, dialogues, review_result = max(attempts, key=lambda a: (a[0], a[1]))
+                print(f"⚠️  {stop}，强制通过（采用第 {best + 1} 次尝试）")
+                review_result['pass'] = True  # 强制通过
+                review_result['forced'] = stop
+                break
+
+            # 不通过，重试
+            retry_count += 1
+            print(f"⚠️  审核不通过，第 {retry_count} 次重试...")
+
+        # v3.5.0: 剧情目标计一次使用；有过审核修改意见时下一轮重新规划
+        self._advance_plot_plan(plot_goal, rejected=bool(attempts))
 
         return {
             'plot_goal': plot_goal,
             'director_plan': director_plan,
             'dialogues': dialogues,
             'review_result': review_result,
-            'retry_count': retry_count
+            'retry_count': retry_count,
+            'calls_saved': calls_saved
         }
 
+    def plan(self, user_message: Optional[str],
+             character_memories: Optional[Dict[str, List]] = None,
+             group_log: Optional[GroupMessageLog] = None,
+             deadline: Optional[Deadline] = None,
+             cancel_token: Optional[CancellationToken] = None,
+             planning_mode: Optional[str] = None,
+             rounds_ahead: int = 0) -> RoundPlan:
+        """
+        规划一轮：剧情目标 + 角色分配（v3.5.0: 从 run_conversation_round 中拆出，可单独提前执行）
+
+        只读取剧情目标状态，不做修改：对状态的改动记在返回值的 plot_update 中，
+        由 run_conversation_round 在实际采用该规划时提交
+
+        Args:
+            user_message: 用户输入
+            character_memories: 角色记忆
+            group_log: 群聊消息日志
+            deadline: 截止时间（到期的阶段使用默认值）
+            cancel_token: 取消令牌
+            planning_mode: 规划模式（默认使用初始化时的设置）
+            rounds_ahead: 当前剧情目标在采用本规划之前还会再使用的轮数（在进行中的一轮里提前规划下一轮时传 1，
+                          按该轮计入使用次数之后的状态判断能否沿用，避免跨过有效期的预规划在采用时失效）
+
+        Returns:
+            RoundPlan（可按 (plot_goal, director_plan) 解包）
+
+        Raises:
+            RoundCancelled: 已被取消
+        """
+        deadline = deadline or Deadline()
+
+        # v3.5.0: 自主轮次沿用仍在有效期内的剧情目标，跳过编剧（用户发言时总是重新规划）
+        plot_goal, anchor, dropped = ((None, None, None) if user_message
+                                      else self._reusable_plot_goal(group_log, rounds_ahead))
+        update = {'anchor': anchor, 'reused': plot_goal is not None, 'dropped': dropped, 'new': None}
+
+        if plot_goal is None:
+            if (planning_mode or self.planning_mode) == 'fused':
+                # ========== 阶段1+2：编导融合规划 ==========
+                plot_goal, director_plan = self._plan_round(user_message, character_memories, group_log,
+                                                            deadline, cancel_token)
+                update['new'] = self._plot_entry(plot_goal, group_log)
+                return RoundPlan(plot_goal, director_plan, update)
+
+            # ========== 阶段1：编剧规划 ==========
+            try:
+                with stage('writer'):
+                    plot_goal = self._writer_plan(user_message, character_memories, group_log, deadline,
+                                                 cancel_token)
+            except DeadlineExceeded:
+                plot_goal = DEFAULT_PLOT_GOAL
+                print(f"\n⏱️ 编剧规划超时，使用默认目标")
+            update['new'] = self._plot_entry(plot_goal, group_log)
+
+        # ========== 阶段2：导演分配 ==========
+        try:
+            with stage('director'):
+                director_plan = self._director_assign(plot_goal, user_message, character_memories,
+                                                      group_log, deadline, cancel_token)
+        except DeadlineExceeded:
+            director_plan = self._fallback_plan("导演分配超时")
+
+        return RoundPlan(plot_goal, director_plan, update)
+
+    # ==================== 剧情目标复用（v3.5.0）====================
+
+    def _reusable_plot_goal(self, group_log: Optional[GroupMessageLog],
+                            rounds_ahead: int = 0) -> Tuple[Optional[str], Optional[Dict], Optional[str]]:
+        """
+        查看当前剧情目标是否仍然有效（只读，不修改状态）
+
+        失效条件：已使用满 plot_horizon 轮（含 rounds_ahead 轮尚未计入的使用）、
+        上一轮审核提出了修改意见（见 _advance_plot_plan）、或最近的对话与规划时的话题几乎没有重合（话题转移）
+
+        Returns:
+            (可沿用的目标（None 表示需要重新规划）, 当前的剧情目标记录, 失效原因)
+        """
+        with self._plot_lock:
+            plot = self._plot_plan
+            if plot is None:
+                return None, None, None
+            if plot['rounds_used'] + rounds_ahead >= self.plot_horizon:
+                return None, plot, "有效期已满"
+            if group_log is not None and self._topic_shifted(plot['terms'], group_log):
+                return None, plot, "话题转移"
+            return plot['goal'], plot, None
+
+    def _plot_entry(self, plot_goal: str, group_log: Optional[GroupMessageLog]) -> Optional[Dict]:
+        """新规划的剧情目标记录（默认目标、或不复用时为 None）"""
+        if self.plot_horizon <= 1 or plot_goal == DEFAULT_PLOT_GOAL:
+            return None
+        recent = group_log.recent(6) if group_log is not None else []
+        return {
+            'goal': plot_goal,
+            'terms': _topic_terms(" ".join([plot_goal] + [m['content'] for m in recent])),
+            'rounds_used': 0
+        }
+
+    def _commit_plot_plan(self, update: Optional[Dict]) -> bool:
+        """
+        本轮采用某个规划时，提交它对剧情目标状态的改动和统计
+
+        Args:
+            update: RoundPlan.plot_update（None 表示调用方直接传入的 (plot_goal, director_plan)，不涉及状态）
+
+        Returns:
+            False 表示规划沿用的剧情目标在规划之后已失效（例如被审核反馈作废、有效期已满），需要重新规划
+        """
+        if update is None:
+            return True
+        with self._plot_lock:
+            current = self._plot_plan
+            anchor = update['anchor']
+            if update['reused']:
+                if current is not anchor or anchor['rounds_used'] >= self.plot_horizon:
+                    return False
+                self._plot_stats['reused'] += 1
+                print(f"\n♻️ 沿用剧情目标（第 {anchor['rounds_used'] + 1}/{self.plot_horizon} 轮）: {anchor['goal']}")
+                return True
+
+            if update['dropped'] and current is not None and current is anchor:
+                self._drop_plot_plan_locked(update['dropped'])
+            self._plot_stats['planned'] += 1
+            self._plot_plan = update['new']
+            return True
+
+    def _advance_plot_plan(self, plot_goal: str, rejected: bool):
+        """一轮结束：剧情目标计一次使用；审核提出过修改意见时让目标失效"""
+        with self._plot_lock:
+            plot = self._plot_plan
+            if plot is None or plot['goal'] != plot_goal:
+                return
+            plot['rounds_used'] += 1
+            if rejected:
+                self._drop_plot_plan_locked("审核反馈")
+
+    def _drop_plot_plan_locked(self, reason: str):
+        self._plot_plan = None
+        invalidated = self._plot_stats['invalidated']
+        invalidated[reason] = invalidated.get(reason, 0) + 1
+        print(f"\n📝 剧情目标失效（{reason}），重新规划")
+
+    def _topic_shifted(self, anchor_terms: set, group_log: GroupMessageLog) -> bool:
+        """最近几条发言与规划时的话题重合度低于阈值"""
+        recent_terms = _topic_terms(" ".join(m['content'] for m in group_log.recent(4)))
+        if len(recent_terms) < 10:
+            return False  # 内容太少，不做判断
+        overlap = len(recent_terms & anchor_terms) / len(recent_terms)
+        return overlap < self.topic_shift_threshold
+
+    def plot_plan_stats(self) -> Dict:
+        """
+        剧情目标复用统计
+
+        Returns:
+            {'planned': 重新规划次数, 'reused': 复用次数（每次省一次编剧调用）, 'invalidated': {原因: 次数}}
+        """
+        with self._plot_lock:
+            return {
+                'planned': self._plot_stats['planned'],
+                'reused': self._plot_stats['reused'],
+                'invalidated': dict(self._plot_stats['invalidated'])
+            }
+
     def _writer_plan(self, user_message: Optional[str],
-                    character_memories: Optional[Dict[str, List]]) -> str:
+                    character_memories: Optional[Dict[str, List]],
+                    group_log: Optional[GroupMessageLog] = None,
+                    deadline: Optional[Deadline] = None,
+                    cancel_token: Optional[CancellationToken] = None) -> str:
         """编剧规划剧情目标"""
 
         # 构建上下文
-        context = self._build_context(user_message, character_memories)
+        context = self._build_context(user_message, character_memories, group_log)
 
         task = Task(
             description=f"""
@@ -238,17 +721,20 @@ class DirectorSystem:
             verbose=False
         )
 
-        result = crew.kickoff()
+        result = self._kickoff(crew, deadline, cancel_token)
         plot_goal = str(result).strip()
 
         print(f"\n📝 编剧规划: {plot_goal}")
         return plot_goal
 
     def _director_assign(self, plot_goal: str, user_message: Optional[str],
-                        character_memories: Optional[Dict[str, List]]) -> str:
+                        character_memories: Optional[Dict[str, List]],
+                        group_log: Optional[GroupMessageLog] = None,
+                        deadline: Optional[Deadline] = None,
+                        cancel_token: Optional[CancellationToken] = None) -> str:
         """导演分配任务"""
 
-        context = self._build_context(user_message, character_memories)
+        context = self._build_context(user_message, character_memories, group_log)
 
         task = Task(
             description=f"""
@@ -285,46 +771,148 @@ class DirectorSystem:
             verbose=False
         )
 
-        result = crew.kickoff()
-        director_plan = str(result).strip()
+        result = self._kickoff(crew, deadline, cancel_token)
+
+        # v3.5.0: 按 Schema 解析（必要时修复一次），解析失败不再让所有角色发言
+        plan = self._parse_output(str(result), PLAN_SCHEMA, 'plan', deadline, cancel_token)
+        director_plan = self._plan_json(plan, "导演计划解析失败")
 
         print(f"\n🎬 导演分配: {director_plan[:100]}...")
         return director_plan
 
-    def _characters_perform(self, director_plan: str,
-                           character_memories: Optional[Dict[str, List]]) -> List[Dict]:
-        """角色们执行表演"""
+    def _plan_round(self, user_message: Optional[str],
+                    character_memories: Optional[Dict[str, List]],
+                    group_log: Optional[GroupMessageLog] = None,
+                    deadline: Optional[Deadline] = None,
+                    cancel_token: Optional[CancellationToken] = None) -> Tuple[str, str]:
+        """
+        编导融合规划：一次调用同时给出剧情目标和角色分配（v3.5.0 新增）
+
+        Returns:
+            (plot_goal, director_plan)：格式与两阶段模式相同，
+            director_plan 为 {"selected_characters", "instructions"} 的 JSON 文本
+
+        Raises:
+            RoundCancelled: 已被取消
+        """
+
+        context = self._build_context(user_message, character_memories, group_log)
+
+        task = Task(
+            description=f"""
+{context}
+
+作为编导，你需要先设计本轮剧情目标，再据此分配角色发言：
+1. 剧情目标：用1-2句话描述本轮对话要推进的冲突、悬念或情感基调
+2. 决定本轮哪些角色需要发言（可以是全部，也可以只选几个）
+3. 为每个发言的角色提供明确的指示：发言方向、态度/语气、与其他角色的关系
+
+输出格式（JSON）：
+{{
+  "plot_goal": "本轮剧情目标",
+  "selected_characters": ["角色1", "角色2"],
+  "instructions": {{
+    "角色1": "发言指示...",
+    "角色2": "发言指示..."
+  }}
+}}
+
+只输出 JSON，不要有其他说明。
+""",
+            agent=self.planner_agent,
+            expected_output="剧情目标和角色发言分配（JSON格式）"
+        )
+
+        crew = Crew(
+            agents=[self.planner_agent],
+            tasks=[task],
+            process=Process.sequential,
+            verbose=False
+        )
 
-        # 解析导演计划
+        try:
+            with stage('plan'):
+                result = self._kickoff(crew, deadline, cancel_token)
+            # 解析结果（拆回两阶段模式的格式，后续阶段无需区分模式）
+            plan = self._parse_output(str(result), FUSED_PLAN_SCHEMA, 'plan', deadline, cancel_token)
+        except DeadlineExceeded:
+            print(f"\n⏱️ 编导规划超时，使用默认目标")
+            return DEFAULT_PLOT_GOAL, self._fallback_plan("编导规划超时")
+
+        goal = plan['plot_goal'].strip() if plan is not None else ''
+        plot_goal = f"剧情目标: {goal}" if goal else DEFAULT_PLOT_GOAL
+        # 修复后仍解析失败时单个角色发言
+        director_plan = self._plan_json(plan, "编导规划解析失败")
+
+        print(f"\n📝 编导规划: {plot_goal}")
+        print(f"\n🎬 导演分配: {director_plan[:100]}...")
+        return plot_goal, director_plan
+
+    def _parse_director_plan(self, director_plan: str) -> Tuple[List[Agent], Dict[str, str]]:
+        """
+        解析导演计划
+
+        Returns:
+            (按导演安排的发言顺序排列的 Agents, {角色名: 发言指示})
+        """
         try:
             plan = json.loads(director_plan)
             selected_chars = plan.get('selected_characters', [])
             instructions = plan.get('instructions', {})
-        except:
-            # 解析失败，让所有角色发言
-            selected_chars = [c['name'] for c in self.characters]
-            instructions = {c['name']: "按你的性格自然发言" for c in self.characters}
-
-        # 只让选中的角色执行
-        selected_agents = [
-            agent for agent in self.character_agents
-            if agent.role in selected_chars
-        ]
+        except (ValueError, TypeError, AttributeError):
+            selected_chars, instructions = [], {}
+
+        # 只让选中的角色执行（v3.5.0: 按导演列出的顺序发言）
+        agents_by_name = {agent.role: agent for agent in self.character_agents}
+        selected_agents = [agents_by_name[name] for name in self._known_characters(selected_chars)]
 
         if not selected_agents:
-            # 没有选中任何角色，默认让第一个发言
-            selected_agents = [self.character_agents[0]]
+            # v3.5.0: plan() 生成的计划已规范化，这里只处理外部传入的不可用计划：轮流由一位角色发言
+            return self._parse_director_plan(self._fallback_plan("导演计划没有可用的角色"))
+
+        return selected_agents, instructions
+
+    def _known_characters(self, names) -> List[str]:
+        """计划中有效的角色名（去掉未知角色和重复，保持导演列出的顺序）"""
+        known = {c['name'] for c in self.characters}
+        result = []
+        for name in names if isinstance(names, list) else []:
+            if isinstance(name, str) and name in known and name not in result:
+                result.append(name)
+        return result
+
+    def _characters_perform(self, director_plan: str,
+                           memory_provider: CharacterMemoryProvider,
+                           deadline: Optional[Deadline] = None,
+                           cancel_token: Optional[CancellationToken] = None,
+                           only: Optional[List[str]] = None,
+                           feedback: Optional[Dict[str, str]] = None) -> List[Dict]:
+        """
+        角色们执行表演（v3.5.0: 超时时已完成的角色照常发言，其余按 PASS 处理；取消时整体放弃）
+
+        Args:
+            director_plan: 导演分配计划
+            memory_provider: 角色记忆提供器
+            deadline: 截止时间
+            cancel_token: 取消令牌
+            only: 只让这些角色发言（v3.5.0 新增，用于局部重做；None 表示计划中的全部角色）
+            feedback: 各角色的审核意见（v3.5.0 新增，附加到导演指示之后）
+        """
+
+        selected_agents, instructions = self._parse_director_plan(director_plan)
+        if only is not None:
+            selected_agents = [agent for agent in selected_agents if agent.role in only]
 
         # 创建任务
         tasks = []
         for agent in selected_agents:
             char_name = agent.role
             instruction = instructions.get(char_name, "按你的性格自然发言")
+            if feedback and feedback.get(char_name):
+                instruction += f"\n\n【审核意见】上一版发言未通过：{feedback[char_name]}"
 
-            # 获取角色记忆
-            memory_text = self._format_character_memory(
-                char_name, character_memories
-            )
+            # 获取角色记忆（v3.5.0: 由 Scriptforge 记忆层提供）
+            memory_text = memory_provider.format_memory(char_name, limit=10)
 
             task = Task(
                 description=f"""
@@ -347,19 +935,27 @@ class DirectorSystem:
             tasks.append(task)
 
         # 执行
-        crew = Crew(
-            agents=selected_agents,
-            tasks=tasks,
-            process=Process.sequential,
-            verbose=False
-        )
+        if self.perform_mode == 'concurrent' and len(tasks) > 1:
+            self._perform_concurrently(selected_agents, tasks, deadline, cancel_token)
+        else:
+            crew = Crew(
+                agents=selected_agents,
+                tasks=tasks,
+                process=Process.sequential,
+                verbose=False
+            )
 
-        result = crew.kickoff()
+            try:
+                self._kickoff(crew, deadline, cancel_token)
+            except DeadlineExceeded:
+                print(f"\n⏱️ 角色表演超时，未完成的角色按 PASS 处理")
 
-        # 解析结果
+        # 解析结果（按导演安排的发言顺序）
         dialogues = []
         for i, task in enumerate(tasks):
             try:
+                if task.output is None:
+                    continue
                 content = str(task.output).strip()
                 if content and content != "PASS":
                     dialogues.append({
@@ -372,14 +968,139 @@ class DirectorSystem:
         print(f"\n🎭 角色表演: {len(dialogues)}个角色发言")
         return dialogues
 
+    def _perform_concurrently(self, agents: List[Agent], tasks: List[Task],
+                              deadline: Optional[Deadline] = None,
+                              cancel_token: Optional[CancellationToken] = None):
+        """
+        各角色的任务同时执行（v3.5.0 新增）
+
+        每个角色一个单任务 Crew，分别经过全局限流器（并发数由共享的调度器限制）；
+        结果写回各自的 task.output，调用方按发言顺序读取。
+        超时或出错的角色按 PASS 处理；全部出错时抛出第一个错误，与顺序执行一致。
+
+        Raises:
+            RoundCancelled: 已被取消（尚未开始的角色不再执行）
+        """
+        crews = [
+            Crew(agents=[agent], tasks=[task], process=Process.sequential, verbose=False)
+            for agent, task in zip(agents, tasks)
+        ]
+
+        executor = ThreadPoolExecutor(max_workers=len(crews), thread_name_prefix="perform")
+        try:
+            # 每个工作线程沿用当前的请求类别 / 会话（scheduler.request_context）
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._kickoff_character,
+                                agent.role, crew, deadline, cancel_token)
+                for agent, crew in zip(agents, crews)
+            ]
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=POLL_INTERVAL if cancel_token is not None else None,
+                                  return_when=FIRST_COMPLETED)
+                if cancel_token is not None:
+                    cancel_token.poll()
+
+            timed_out = 0
+            errors = []
+            for agent, future in zip(agents, futures):
+                try:
+                    future.result()
+                except DeadlineExceeded:
+                    timed_out += 1
+                except RoundCancelled:
+                    raise
+                except Exception as e:
+                    print(f"⚠️ {agent.role} 表演失败，按 PASS 处理: {str(e)}")
+                    errors.append(e)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if errors and len(errors) == len(futures):
+            raise errors[0]
+        if timed_out:
+            print(f"\n⏱️ 角色表演超时，{timed_out} 个未完成的角色按 PASS 处理")
+
+    def _kickoff_character(self, name: str, crew: Crew, deadline: Optional[Deadline] = None,
+                           cancel_token: Optional[CancellationToken] = None):
+        """执行单个角色的 Crew（v3.5.0: 单独记为一个追踪阶段）"""
+        with stage(f"character:{name}"):
+            return self._kickoff(crew, deadline, cancel_token)
+
+    @staticmethod
+    def _flagged_characters(review_result: Dict, dialogues: List[Dict]) -> Optional[Dict[str, str]]:
+        """
+        从审核结果中找出被标记为不通过的发言（v3.5.0 新增）
+
+        Returns:
+            {角色名: 审核意见}；审核没有给出可用的逐角色判定时返回 None（需要整轮重做）
+        """
+        verdicts = review_result.get('verdicts')
+        if not isinstance(verdicts, dict) or not verdicts:
+            return None
+
+        flagged = {}
+        for dialogue in dialogues:
+            verdict = verdicts.get(dialogue['speaker'])
+            if isinstance(verdict, dict):
+                passed, reason = verdict.get('pass', True), verdict.get('feedback', '')
+            else:
+                passed, reason = verdict, ''
+            if passed is False:
+                flagged[dialogue['speaker']] = reason or review_result.get('feedback', '')
+
+        return flagged or None
+
+    def _regenerate_flagged(self, director_plan: str, dialogues: List[Dict], review_result: Dict,
+                            memory_provider: CharacterMemoryProvider,
+                            deadline: Optional[Deadline] = None,
+                            cancel_token: Optional[CancellationToken] = None) -> Tuple[List[Dict], int]:
+        """
+        审核不通过后的重做（v3.5.0 新增）：只重新生成被标记的发言，已通过的发言原样保留
+
+        Returns:
+            (重做后的对话（保持原发言顺序）, 相比整轮重做节省的角色调用次数)
+        """
+        flagged = self._flagged_characters(review_result, dialogues)
+        if flagged is None:
+            # 没有逐角色判定，整轮重做
+            return self._characters_perform(director_plan, memory_provider, deadline, cancel_token), 0
+
+        full_calls = len(self._parse_director_plan(director_plan)[0])
+        regenerated = self._characters_perform(director_plan, memory_provider, deadline, cancel_token,
+                                               only=list(flagged), feedback=flagged)
+        replacements = {d['speaker']: d for d in regenerated}
+
+        # 重做失败（超时 / PASS）的角色保留原发言，交给下一次审核判断
+        merged = [replacements.get(d['speaker'], d) for d in dialogues]
+        saved = max(0, full_calls - len(flagged))
+        print(f"♻️  保留 {len(dialogues) - len(flagged)} 条已通过发言，重做 {len(flagged)} 条，节省 {saved} 次角色调用")
+        return merged, saved
+
     def _reviewer_check(self, plot_goal: str, director_plan: str,
-                       dialogues: List[Dict]) -> Dict:
-        """审核检查质量"""
+                       dialogues: List[Dict], deadline: Optional[Deadline] = None,
+                       cancel_token: Optional[CancellationToken] = None,
+                       reparse: bool = False) -> Dict:
+        """
+        审核检查质量（v3.5.0: 先经本地预筛，只有边界情况才调用 LLM 审核）
+
+        Args:
+            reparse: 上一次审核输出无法解析，本次只重做审核（跳过预筛，提示词中强调输出格式）
+        """
+
+        if not reparse:
+            screened = self.prescreen.screen(dialogues)
+            if screened is not None:
+                status = "✅ 通过" if screened['pass'] else "❌ 不通过"
+                print(f"\n📋 预筛结果: {status}（{screened['feedback']}）")
+                return screened
 
         # 格式化对话
         dialogue_text = "\n".join([
             f"{d['speaker']}: {d['content']}" for d in dialogues
         ])
+        # v3.5.0: 重做审核时提示词随之变化，不会命中上一次无法解析的缓存结果
+        format_hint = "\n上一次的审核输出无法解析为 JSON，请严格按上面的格式输出。" if reparse else ""
 
         task = Task(
             description=f"""
@@ -396,10 +1117,15 @@ class DirectorSystem:
 3. ✅ 对话是否有实质内容（不是空话套话）
 4. ✅ 角色间的互动是否自然
 
+除整体判断外，请对每位发言的角色单独给出判定（verdicts），不通过时只标记有问题的角色。
+
 输出格式（JSON）：
 {{
   "pass": true/false,
   "feedback": "具体反馈...",
+  "verdicts": {{
+    "角色名": {{"pass": true/false, "feedback": "该角色发言的问题（通过时留空）"}}
+  }},
   "scores": {{
     "character_consistency": 0-10,
     "plot_advancement": 0-10,
@@ -408,7 +1134,7 @@ class DirectorSystem:
   }}
 }}
 
-只输出 JSON，不要有其他说明。
+只输出 JSON，不要有其他说明。{format_hint}
 """,
             agent=self.reviewer_agent,
             expected_output="审核结果（JSON格式）"
@@ -421,18 +1147,25 @@ class DirectorSystem:
             verbose=False
         )
 
-        result = crew.kickoff()
-
-        # 解析结果
         try:
-            review_result = json.loads(str(result).strip())
-        except:
-            # 解析失败，默认通过
+            result = self._kickoff(crew, deadline, cancel_token)
+            # 解析结果（v3.5.0: 按 Schema 解析，必要时修复一次）
+            review_result = self._parse_output(str(result), REVIEW_SCHEMA, 'review', deadline, cancel_token)
+        except DeadlineExceeded:
+            # 已没有时间重做，超时默认通过
+            return {'pass': True, 'feedback': '审核超时，默认通过', 'scores': {}, 'source': 'timeout'}
+
+        if review_result is None:
+            # v3.5.0: 修复后仍无法解析时不再默认通过：按未通过处理（重试受 RetryBudget 约束）。
+            # 本地指标能定位到问题发言时只重做这些发言，否则只重做审核（见 _run_round）
             review_result = {
-                'pass': True,
-                'feedback': '审核解析失败，默认通过',
-                'scores': {}
+                'pass': False,
+                'feedback': '审核结果无法解析',
+                'verdicts': self.prescreen.verdicts(dialogues) or {},
+                'scores': {},
+                'parse_error': True
             }
+        review_result['source'] = 'llm'
 
         status = "✅ 通过" if review_result['pass'] else "❌ 不通过"
         print(f"\n📋 审核结果: {status}")
@@ -441,8 +1174,91 @@ class DirectorSystem:
 
         return review_result
 
+    def _parse_output(self, text: str, schema: Dict, kind: str,
+                      deadline: Optional[Deadline] = None,
+                      cancel_token: Optional[CancellationToken] = None) -> Optional[Dict]:
+        """
+        按 Schema 解析结构化输出（v3.5.0 新增）：不合格时发起一次针对性的修复调用
+
+        Returns:
+            符合 Schema 的 dict；修复后仍不合格时返回 None
+
+        Raises:
+            RoundCancelled: 已被取消
+            DeadlineExceeded: 修复调用未在截止时间内完成
+        """
+        def _repair(prompt: str) -> str:
+            with stage(f"repair:{kind}"):
+                return generate_text(self.api_key, self.model_id, prompt, cacheable=True,
+                                     deadline=deadline, cancel_token=cancel_token, temperature=0.0)
+
+        return parse_structured(text, schema, kind, repair=_repair)
+
+    def _plan_json(self, plan: Optional[Dict], reason: str) -> str:
+        """
+        把解析出的计划规范化为 director_plan 文本（v3.5.0 新增）
+
+        只保留已知角色；计划不可用或没有选中任何已知角色时使用降级计划，
+        这样重试时 _parse_director_plan 得到的始终是同一组角色
+        """
+        selected = self._known_characters(plan['selected_characters']) if plan is not None else []
+        if not selected:
+            return self._fallback_plan(reason if plan is None else "导演没有选中任何已知角色")
+        instructions = plan.get('instructions', {})
+        return json.dumps({
+            'selected_characters': selected,
+            'instructions': {name: instructions[name] for name in selected if name in instructions}
+        }, ensure_ascii=False)
+
+    def _fallback_plan(self, reason: str) -> str:
+        """
+        导演计划不可用时的降级计划（v3.5.0 新增）：轮流由一位角色按性格发言，
+        避免解析失败让所有角色发言、成倍增加本轮的调用次数
+        """
+        name = self.characters[next(self._fallback_turn) % len(self.characters)]['name']
+        print(f"\n⚠️ {reason}，本轮由 {name} 按性格自然发言")
+        return json.dumps({
+            'selected_characters': [name],
+            'instructions': {name: "按你的性格自然发言"}
+        }, ensure_ascii=False)
+
+    def _kickoff(self, crew: Crew, deadline: Optional[Deadline] = None,
+                 cancel_token: Optional[CancellationToken] = None):
+        """
+        执行 Crew（v3.5.0: 经过全局限流器，每个任务计一次请求）
+
+        先取得 Crew 中各 Agent 的锁；超时 / 取消时等 Crew 在当前 LLM 调用返回后真正停下再抛出
+        （见 llm_backend.kickoff_crew），之后读取 task.output 或让其他 Crew 使用这些 Agent 都是安全的
+
+        Raises:
+            DeadlineExceeded: 截止时间内未完成
+            CircuitOpenError: LLM 熔断中（不再等待 Crew 失败）
+            RoundCancelled: 已被取消（排队中的不再执行，执行中的 Crew 在当前 LLM 调用返回后停止）
+        """
+        with ExitStack() as held:
+            for role in sorted({agent.role for agent in crew.agents}):
+                lock = self._agent_locks[role]
+                while not lock.acquire(timeout=POLL_INTERVAL):
+                    if cancel_token is not None:
+                        cancel_token.poll()
+                held.callback(lock.release)
+
+            calls_before = current_llm_calls()
+            start = time.perf_counter()
+            result = kickoff_crew(crew, self.model_id, deadline, cancel_token)
+
+        # v3.5.0: CrewAI 原生 LLM 不经过 llm_backend，用 Crew 汇报的用量补记到当前追踪阶段
+        usage = getattr(result, 'token_usage', None)
+        if usage is not None and current_llm_calls() == calls_before:
+            record_llm_usage(getattr(usage, 'prompt_tokens', 0) or 0,
+                             getattr(usage, 'completion_tokens', 0) or 0,
+                             time.perf_counter() - start,
+                             calls=getattr(usage, 'successful_requests', 0) or len(crew.tasks))
+        return result
+
     def _build_context(self, user_message: Optional[str],
-                      character_memories: Optional[Dict[str, List]]) -> str:
+                      character_memories: Optional[Dict[str, List]],
+                      group_log: Optional[GroupMessageLog] = None) -> str:
         """构建上下文"""
         context_parts = [f"场景：{self.scene}"]
 
@@ -451,14 +1267,12 @@ class DirectorSystem:
         for char in self.characters:
             context_parts.append(f"- {char['name']}: {char['personality']}")
 
-        # 对话历史
-        if character_memories:
-            first_char = list(character_memories.keys())[0]
-            group_messages = [
-                msg for msg in character_memories[first_char]
-                if msg.get('type') == 'group'
-            ]
-            recent = group_messages[-10:] if len(group_messages) > 10 else group_messages
+        # 对话历史（v3.5.0: 优先使用群聊日志）
+        if group_log is None and character_memories:
+            group_log = GroupMessageLog.from_character_memories(character_memories)
+
+        if group_log is not None:
+            recent = group_log.recent(10)
 
             if recent:
                 context_parts.append("\n最近对话：")
@@ -471,19 +1285,6 @@ class DirectorSystem:
 
         return "\n".join(context_parts)
 
-    def _format_character_memory(self, char_name: str,
-                                 character_memories: Optional[Dict[str, List]]) -> str:
-        """格式化角色记忆"""
-        if not character_memories or char_name not in character_memories:
-            return "（暂无记忆）"
-
-        memories = character_memories[char_name][-10:]
-        memory_lines = []
-        for msg in memories:
-            memory_lines.append(f"{msg['speaker']}: {msg['content']}")
-
-        return "\n".join(memory_lines) if memory_lines else "（暂无记忆）"
-
 
 def demo():
     """演示导演系统"""
@@ -14,6 +14,7 @@ from typing import List, Dict, Tuple, Optional
 from datetime import datetime
 from collections import Counter, defaultdict
 import math
+import threading
 
 
 class EvaluationMetrics:
@@ -31,8 +32,9 @@ class EvaluationMetrics:
 
         if api_key:
             try:
-                import google.genai as genai
-                self.llm = genai.Client(api_key=api_key)
+                # v3.5.0: 使用进程级共享的 LLM 后端
+                from llm_backend import get_backend
+                self.llm = get_backend(api_key)
             except ImportError:
                 print("⚠️ google-genai 未安装，将使用基础指标")
 
@@ -408,12 +410,12 @@ class EvaluationMetrics:
 请回答：这条发言是否符合该角色的性格？（只需回答"符合"或"不符合"，不要解释）
 """
 
-            response = self.llm.models.generate_content(
-                model='gemini-2.0-flash-exp',
-                contents=prompt
-            )
-
-            result = response.text.strip()
+            from llm_backend import generate_text
+            from scheduler import request_context
+            # v3.5.0: 评估调用优先级最低，并发紧张时让位于对话生成
+            with request_context('evaluation'):
+                result = generate_text(self.api_key, 'gemini-2.0-flash-exp', prompt, cacheable=True,
+                                       temperature=0.0).strip()
             return '不符合' in result
 
         except Exception as e:
@@ -469,6 +471,153 @@ class EvaluationMetrics:
         }
 
 
+# ==================== 审核预筛（v3.5.0）====================
+
+class ReviewPrescreen:
+    """
+    审核预筛：在调用 LLM 审核之前，用本地指标（无需 API）判断明显的情况
+
+    - 自动打回：无意义发言率或重复率超过上限，逐条标记有问题的发言（配合局部重做）
+    - 自动通过：没有无意义发言、没有重复，且多人发言时人设离散度（CPD）足够高
+    - 其余情况升级到 LLM 审核
+
+    阈值可通过构造参数或环境变量（SCRIPTFORGE_PRESCREEN_*）配置
+    """
+
+    def __init__(self, reject_meaningless: float = 0.5, reject_repetition: float = 0.5,
+                 pass_cpd: float = 60.0, pass_repetition: float = 0.0, enabled: bool = True):
+        """
+        Args:
+            reject_meaningless: 无意义发言率达到该值时自动打回（0-1）
+            reject_repetition: 重复率达到该值时自动打回（0-1）
+            pass_cpd: 多人发言时自动通过所需的最低 CPD（0-100）
+            pass_repetition: 自动通过允许的最高重复率（0-1）
+            enabled: 是否启用（关闭时全部升级到 LLM 审核）
+        """
+        self.reject_meaningless = reject_meaningless
+        self.reject_repetition = reject_repetition
+        self.pass_cpd = pass_cpd
+        self.pass_repetition = pass_repetition
+        self.enabled = enabled
+
+        self.metrics = EvaluationMetrics()
+        self._stats = {'screened': 0, 'auto_pass': 0, 'auto_reject': 0, 'escalated': 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'ReviewPrescreen':
+        """按环境变量构建（未设置的使用默认值）"""
+        import os
+        return cls(
+            reject_meaningless=float(os.getenv('SCRIPTFORGE_PRESCREEN_REJECT_MEANINGLESS', '0.5')),
+            reject_repetition=float(os.getenv('SCRIPTFORGE_PRESCREEN_REJECT_REPETITION', '0.5')),
+            pass_cpd=float(os.getenv('SCRIPTFORGE_PRESCREEN_PASS_CPD', '60')),
+            pass_repetition=float(os.getenv('SCRIPTFORGE_PRESCREEN_PASS_REPETITION', '0')),
+            enabled=os.getenv('SCRIPTFORGE_PRESCREEN', '1') != '0'
+        )
+
+    def screen(self, dialogues: List[Dict]) -> Optional[Dict]:
+        """
+        预筛一轮对话
+
+        Args:
+            dialogues: [{'speaker': '...', 'content': '...'}, ...]
+
+        Returns:
+            明确时返回审核结果（格式与 LLM 审核相同，另带 'source': 'prescreen' 和 'metrics'）；
+            需要升级到 LLM 审核时返回 None
+        """
+        if not self.enabled:
+            return None
+
+        self._count('screened')
+
+        if not dialogues:
+            # 没有任何发言：整轮重做（不给逐角色判定）
+            self._count('auto_reject')
+            return {'pass': False, 'feedback': '本轮没有角色发言', 'scores': {},
+                    'source': 'prescreen', 'metrics': {}}
+
+        meaningless_rate = self.metrics._calculate_meaningless_rate(dialogues)
+        repetition_rate = self.metrics._calculate_repetition_rate(dialogues)
+        speakers = {d['speaker'] for d in dialogues}
+        cpd_score = self.metrics.calculate_cpd(dialogues)['cpd_score'] if len(speakers) > 1 else None
+        metrics = {
+            'meaningless_rate': round(meaningless_rate, 2),
+            'repetition_rate': round(repetition_rate, 2),
+            'cpd_score': cpd_score
+        }
+
+        if meaningless_rate >= self.reject_meaningless or repetition_rate >= self.reject_repetition:
+            self._count('auto_reject')
+            return {
+                'pass': False,
+                'feedback': f"本地预筛未通过：无意义发言率 {meaningless_rate:.0%}，重复率 {repetition_rate:.0%}",
+                'verdicts': self.verdicts(dialogues) or {},
+                'scores': {},
+                'source': 'prescreen',
+                'metrics': metrics
+            }
+
+        if (meaningless_rate == 0 and repetition_rate <= self.pass_repetition
+                and cpd_score is not None and cpd_score >= self.pass_cpd):
+            self._count('auto_pass')
+            return {
+                'pass': True,
+                'feedback': f"本地预筛通过：CPD {cpd_score}",
+                'scores': {},
+                'source': 'prescreen',
+                'metrics': metrics
+            }
+
+        self._count('escalated')
+        return None
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def verdicts(self, dialogues: List[Dict]) -> Optional[Dict[str, Dict]]:
+        """
+        按本地指标给出逐角色判定（格式与 LLM 审核的 verdicts 相同）
+
+        Returns:
+            {角色名: {'pass', 'feedback'}}；没有发现问题发言时返回 None
+        """
+        flagged = self._flag_lines(dialogues)
+        if not flagged:
+            return None
+        return {
+            d['speaker']: {'pass': d['speaker'] not in flagged, 'feedback': flagged.get(d['speaker'], '')}
+            for d in dialogues
+        }
+
+    def _flag_lines(self, dialogues: List[Dict]) -> Dict[str, str]:
+        """逐条找出无意义发言和与前面发言重复的发言 {角色名: 原因}"""
+        flagged = {}
+        for i, dialogue in enumerate(dialogues):
+            if self.metrics._calculate_meaningless_rate([dialogue]) > 0:
+                flagged[dialogue['speaker']] = "发言过短或没有实质内容"
+                continue
+            for earlier in dialogues[:i]:
+                if self.metrics._simple_text_similarity(earlier['content'], dialogue['content']) > 0.7:
+                    flagged[dialogue['speaker']] = f"与{earlier['speaker']}的发言重复"
+                    break
+        return flagged
+
+    def stats(self) -> Dict:
+        """
+        预筛统计
+
+        Returns:
+            {'screened', 'auto_pass', 'auto_reject', 'escalated', 'escalation_rate'}
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['escalation_rate'] = round(stats['escalated'] / stats['screened'], 3) if stats['screened'] else 0.0
+        return stats
+
+
 # ==================== 工具函数 ====================
 
 def save_evaluation_report(report: Dict, output_path: str):
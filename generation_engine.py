@@ -0,0 +1,238 @@
+"""
+Generation Engine - 基于 asyncio 的角色发言生成引擎
+一轮中多个角色的请求并发发出（有并发上限），app.py 通过 run_sync 同步调用
+
+v3.5.0 新增功能
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import contextvars
+
+from llm_backend import generate_text
+from deadline import Deadline
+from cancellation import CancellationToken, RoundCancelled, POLL_INTERVAL
+
+
+# 回调签名
+PrepareFn = Callable[[Dict[str, str]], Any]                               # (角色) -> 预处理结果（如角色记忆）
+RenderFn = Callable[[Dict[str, str], Any, List[Dict[str, str]]], str]     # (角色, 预处理结果, 本轮已有发言) -> 提示词
+FallbackFn = Callable[[Dict[str, str], Any, Exception], Optional[str]]    # (角色, 预处理结果, 异常) -> 降级发言（None 表示跳过）
+ReplyFn = Callable[[Dict[str, str], str], None]                           # (角色, 发言) -> None
+
+
+def run_sync(coro: Awaitable) -> Any:
+    """
+    在同步代码中运行协程
+
+    当前线程没有运行中的事件循环时直接 asyncio.run；
+    已在事件循环中（例如 notebook）时放到独立线程中运行，避免嵌套循环。
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coro).result()
+
+
+class GenerationEngine:
+    """
+    角色发言生成引擎
+
+    特性：
+    - 并发：一轮中各角色的 LLM 请求作为 asyncio 任务同时发出，由信号量限制并发数
+    - 流水线：需要"后一位看到前一位发言"时，网络请求按顺序等待，
+      但下一位的准备工作（记忆检索等）在上一位请求进行中完成
+    - 取消：外层任务被取消或取消令牌触发时，尚未返回的请求结果直接丢弃，
+      已通过 on_reply 交付的发言保留（由调用方决定是否已经写入）
+    - 回调在事件循环线程（即调用 run_sync 的线程）中执行，可以安全访问 UI 状态
+    """
+
+    def __init__(self, api_key: str, model_id: str = "gemini-2.0-flash-exp",
+                 max_concurrency: int = 4):
+        """
+        Args:
+            api_key: API Key
+            model_id: 模型 ID
+            max_concurrency: 同一轮内同时进行的请求数上限
+        """
+        self.api_key = api_key
+        self.model_id = model_id
+        self.max_concurrency = max_concurrency
+
+    async def complete(self, prompt: str, deadline: Optional[Deadline] = None,
+                       semaphore: Optional[asyncio.Semaphore] = None,
+                       cancel_token: Optional[CancellationToken] = None) -> str:
+        """
+        单次生成（阻塞的后端调用放到线程中执行）
+
+        Args:
+            prompt: 提示词
+            deadline: 截止时间
+            semaphore: 并发信号量（None 表示不限制）
+            cancel_token: 取消令牌
+
+        Returns:
+            生成的文本（已 strip）
+        """
+        if semaphore is None:
+            text = await asyncio.to_thread(generate_text, self.api_key, self.model_id, prompt,
+                                           deadline=deadline, cancel_token=cancel_token)
+        else:
+            async with semaphore:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                text = await asyncio.to_thread(generate_text, self.api_key, self.model_id, prompt,
+                                               deadline=deadline, cancel_token=cancel_token)
+        return text.strip()
+
+    @staticmethod
+    async def _await(task: asyncio.Task, cancel_token: Optional[CancellationToken]) -> Any:
+        """等待任务完成；有取消令牌时每 POLL_INTERVAL 秒在事件循环线程中轮询一次"""
+        if cancel_token is None:
+            return await task
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=POLL_INTERVAL)
+            if done:
+                return task.result()
+            cancel_token.poll()
+
+    async def _reply(self, character: Dict[str, str], prepared: Any, prompt: str,
+                     fallback: Optional[FallbackFn], deadline: Optional[Deadline],
+                     semaphore: asyncio.Semaphore,
+                     cancel_token: Optional[CancellationToken] = None) -> Optional[str]:
+        """生成一个角色的发言，失败时走降级（取消不走降级）"""
+        try:
+            return await self.complete(prompt, deadline, semaphore, cancel_token)
+        except RoundCancelled:
+            raise
+        except Exception as e:
+            if fallback is None:
+                print(f"⚠️ {character['name']} 生成失败，跳过: {str(e)}")
+                return None
+            return fallback(character, prepared, e)
+
+    async def generate_round(self, characters: List[Dict[str, str]],
+                             prepare: PrepareFn, render: RenderFn,
+                             fallback: Optional[FallbackFn] = None,
+                             pipelined: bool = False,
+                             deadline: Optional[Deadline] = None,
+                             on_reply: Optional[ReplyFn] = None,
+                             cancel_token: Optional[CancellationToken] = None) -> List[Dict[str, str]]:
+        """
+        生成一轮群聊发言
+
+        Args:
+            characters: 本轮发言的角色（按发言顺序）
+            prepare: 准备角色上下文（如检索记忆）
+            render: 根据准备结果和本轮已有发言构造提示词
+            fallback: 生成失败（超时 / 熔断 / 错误）时的降级
+            pipelined: True 时后一位能看到前一位的发言（请求按顺序等待，准备工作提前进行）；
+                       False 时所有角色基于同一份上下文并发生成
+            deadline: 本轮截止时间
+            on_reply: 每个角色的发言确定后按发言顺序回调（用于增量显示）
+            cancel_token: 取消令牌
+
+        Returns:
+            [{'speaker': '...', 'content': '...'}, ...]（按发言顺序，跳过的角色不在其中）
+
+        Raises:
+            RoundCancelled: 本轮被取消（尚未交付的发言全部丢弃，进行中的请求被放弃）
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        replies: List[Dict[str, str]] = []
+
+        def _accept(character: Dict[str, str], content: Optional[str]):
+            if not content:
+                return
+            replies.append({'speaker': character['name'], 'content': content})
+            if on_reply:
+                on_reply(character, content)
+
+        if not pipelined:
+            prepared = [prepare(char) for char in characters]
+            tasks = [
+                asyncio.create_task(self._reply(
+                    char, prep, render(char, prep, []), fallback, deadline, semaphore, cancel_token
+                ))
+                for char, prep in zip(characters, prepared)
+            ]
+            try:
+                # 按发言顺序收集（请求本身是并发的）
+                for char, task in zip(characters, tasks):
+                    _accept(char, await self._await(task, cancel_token))
+            finally:
+                for task in tasks:
+                    task.cancel()
+            return replies
+
+        # 流水线：当前角色的请求进行中时，准备下一位角色的上下文
+        next_prepared = prepare(characters[0]) if characters else None
+        for i, char in enumerate(characters):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            prep = next_prepared
+            task = asyncio.create_task(self._reply(
+                char, prep, render(char, prep, list(replies)), fallback, deadline, semaphore,
+                cancel_token
+            ))
+            try:
+                await asyncio.sleep(0)  # 让请求先发出
+                if i + 1 < len(characters):
+                    next_prepared = prepare(characters[i + 1])
+                _accept(char, await self._await(task, cancel_token))
+            finally:
+                task.cancel()
+        return replies
+
+    async def generate_initial(self, characters: List[Dict[str, str]],
+                               prepare: PrepareFn, render: RenderFn,
+                               fallback: Optional[FallbackFn] = None,
+                               deadline: Optional[Deadline] = None,
+                               on_reply: Optional[ReplyFn] = None,
+                               cancel_token: Optional[CancellationToken] = None) -> List[Dict[str, str]]:
+        """
+        生成开场对话（每位角色都能看到之前角色的开场白，因此使用流水线模式）
+
+        参数与 generate_round 相同。
+        """
+        return await self.generate_round(characters, prepare, render, fallback,
+                                         pipelined=True, deadline=deadline, on_reply=on_reply,
+                                         cancel_token=cancel_token)
+
+    async def generate_private_reply(self, character: Dict[str, str], prompt: str,
+                                     fallback: Optional[Callable[[Exception], str]] = None,
+                                     deadline: Optional[Deadline] = None,
+                                     cancel_token: Optional[CancellationToken] = None) -> Optional[str]:
+        """
+        单个角色的回复（私聊，或单个角色的一次发言）
+
+        Args:
+            character: 角色
+            prompt: 提示词
+            fallback: 生成失败时的降级（参数为异常）
+            deadline: 截止时间
+            cancel_token: 取消令牌
+
+        Returns:
+            回复内容；失败且没有降级时返回 None
+
+        Raises:
+            RoundCancelled: 已被取消
+        """
+        try:
+            task = asyncio.create_task(self.complete(prompt, deadline, cancel_token=cancel_token))
+            try:
+                return await self._await(task, cancel_token)
+            finally:
+                task.cancel()
+        except RoundCancelled:
+            raise
+        except Exception as e:
+            if fallback is None:
+                print(f"⚠️ {character['name']} 回复失败: {str(e)}")
+                return None
+            return fallback(e)
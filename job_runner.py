@@ -0,0 +1,255 @@
+"""
+Job Runner - 长时间生成任务的后台执行器
+多轮自主对话等任务交给后台线程池执行，界面轮询进度并增量取回已完成的结果
+
+v3.5.0 新增功能
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import itertools
+import os
+import threading
+import time
+
+from cancellation import CancellationToken, RoundCancelled
+
+
+# 任务状态
+QUEUED = 'queued'        # 排队中
+RUNNING = 'running'      # 执行中
+DONE = 'done'            # 正常完成
+FAILED = 'failed'        # 出错终止
+CANCELLED = 'cancelled'  # 被取消（已发布的结果保留）
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class Job:
+    """
+    一个后台任务
+
+    任务函数在工作线程中执行，通过 publish() 发布阶段性结果（例如每轮的发言），
+    通过 advance() 推进进度；界面线程用 results_since() 增量取回结果。
+    任务函数不得访问 UI 状态（如 st.session_state）。
+    """
+
+    def __init__(self, job_id: str, kind: str, total_steps: int):
+        """
+        Args:
+            job_id: 任务 ID
+            kind: 任务类型（如 'auto_continue'）
+            total_steps: 总步数（用于显示进度）
+        """
+        self.id = job_id
+        self.kind = kind
+        self.total_steps = total_steps
+        self.completed_steps = 0
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_token = CancellationToken()
+
+        self._results: List[Any] = []
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        """是否已结束（完成 / 失败 / 取消）"""
+        return self.status in FINISHED_STATES
+
+    def publish(self, result: Any):
+        """发布一条结果（工作线程调用）"""
+        with self._lock:
+            self._results.append(result)
+
+    def advance(self, steps: int = 1):
+        """推进进度（工作线程调用）"""
+        with self._lock:
+            self.completed_steps = min(self.total_steps, self.completed_steps + steps)
+
+    def results_since(self, cursor: int) -> Tuple[List[Any], int]:
+        """
+        增量取回结果
+
+        Args:
+            cursor: 上次取回后的位置（首次为 0）
+
+        Returns:
+            (新结果列表, 新位置)
+        """
+        with self._lock:
+            return list(self._results[cursor:]), len(self._results)
+
+    def cancel(self, reason: str = "已取消"):
+        """请求取消（任务函数在下一个检查点停止）"""
+        self.cancel_token.cancel(reason)
+
+    def snapshot(self) -> Dict:
+        """
+        任务状态快照
+
+        Returns:
+            {
+                'id': 任务 ID,
+                'kind': 任务类型,
+                'status': 状态,
+                'completed_steps': 已完成步数,
+                'total_steps': 总步数,
+                'results': 已发布的结果数,
+                'error': 错误信息,
+                'elapsed': 已运行秒数
+            }
+        """
+        with self._lock:
+            end = self.finished_at or time.time()
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'completed_steps': self.completed_steps,
+                'total_steps': self.total_steps,
+                'results': len(self._results),
+                'error': self.error,
+                'elapsed': round(end - self.started_at, 1) if self.started_at else 0.0
+            }
+
+
+JobFn = Callable[[Job], None]  # 任务函数：在工作线程中执行，通过 job 发布结果 / 检查取消
+
+
+class JobRunner:
+    """
+    后台任务执行器（线程池 + 任务表）
+
+    - 提交后立即返回 Job，调用方保存 job.id，之后按 ID 轮询
+    - 任务函数抛出 RoundCancelled 或取消后返回都记为 cancelled，其他异常记为 failed
+    - 只保留最近 history 个已结束的任务
+    """
+
+    def __init__(self, max_workers: int = 2, history: int = 50):
+        """
+        Args:
+            max_workers: 同时执行的任务数（排队的任务等待空闲线程）
+            history: 保留的已结束任务数
+        """
+        self.max_workers = max_workers
+        self.history = history
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+
+    def submit(self, fn: JobFn, kind: str, total_steps: int) -> Job:
+        """
+        提交任务
+
+        Args:
+            fn: 任务函数
+            kind: 任务类型
+            total_steps: 总步数
+
+        Returns:
+            Job
+        """
+        with self._lock:
+            job = Job(f"{kind}-{next(self._ids)}", kind, total_steps)
+            self._jobs[job.id] = job
+            self._stats['submitted'] += 1
+            self._prune_locked()
+
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn: JobFn):
+        """在工作线程中执行任务并记录结束状态"""
+        if job.cancel_token.cancelled:
+            self._finish(job, CANCELLED)
+            return
+
+        job.started_at = time.time()
+        job.status = RUNNING
+        try:
+            fn(job)
+        except RoundCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            print(f"❌ 后台任务 {job.id} 失败: {str(e)}")
+            job.error = str(e)
+            self._finish(job, FAILED)
+        else:
+            self._finish(job, CANCELLED if job.cancel_token.cancelled else DONE)
+
+    def _finish(self, job: Job, status: str):
+        job.finished_at = time.time()
+        job.status = status
+        with self._lock:
+            self._stats[status] += 1
+
+    def _prune_locked(self):
+        """丢弃最早的已结束任务（调用方需持有 _lock）"""
+        finished = [job for job in self._jobs.values() if job.finished]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        """按 ID 获取任务（不存在时返回 None）"""
+        if job_id is None:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: Optional[str], reason: str = "已取消") -> bool:
+        """
+        取消任务
+
+        Returns:
+            任务是否存在且尚未结束
+        """
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel(reason)
+        return True
+
+    def active_jobs(self) -> List[Job]:
+        """排队中和执行中的任务"""
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.finished]
+
+    def stats(self) -> Dict:
+        """任务统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['active'] = sum(1 for job in self._jobs.values() if not job.finished)
+        stats['max_workers'] = self.max_workers
+        return stats
+
+    def shutdown(self):
+        """取消所有任务并关闭线程池"""
+        for job in self.active_jobs():
+            job.cancel("执行器关闭")
+        self._executor.shutdown(wait=False)
+
+
+# ==================== 进程级执行器 ====================
+
+_runner: Optional[JobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner() -> JobRunner:
+    """
+    获取进程级共享的后台任务执行器（所有会话共用）
+
+    工作线程数来自环境变量 SCRIPTFORGE_JOB_WORKERS（默认 2）
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(max_workers=int(os.getenv('SCRIPTFORGE_JOB_WORKERS', '2')))
+        return _runner
@@ -0,0 +1,752 @@
+"""
+LLM Backend - 与提供方无关的 LLM 后端层
+统一生成 / 向量化调用，并提供可离线运行的本地模拟后端（用于压测和基准）
+
+v3.5.0 新增功能
+"""
+
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from llm_pool import get_client_pool, get_genai_client, get_chat_model
+from rate_limiter import get_rate_limiter, estimate_tokens
+from llm_cache import get_response_cache, cache_key
+from deadline import (Deadline, DeadlineExceeded, call_with_deadline, get_latency_tracker,
+                      HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+from circuit_breaker import get_circuit_breaker, CircuitBreaker, CircuitOpenError
+from cancellation import CancellationToken, RoundCancelled
+from tracing import record_llm_usage
+
+
+class LLMResponse:
+    """一次生成调用的结果"""
+
+    def __init__(self, text: str, model: str, provider: str,
+                 prompt_tokens: int = 0, completion_tokens: int = 0, latency: float = 0.0,
+                 cached: bool = False, degraded: bool = False):
+        self.text = text
+        self.model = model
+        self.provider = provider
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.latency = latency
+        self.cached = cached
+        self.degraded = degraded  # 熔断期间由降级路径生成
+
+    def to_dict(self) -> Dict:
+        return {
+            'text': self.text,
+            'model': self.model,
+            'provider': self.provider,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'latency': self.latency,
+            'degraded': self.degraded
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, cached: bool = False) -> 'LLMResponse':
+        return cls(
+            text=data['text'],
+            model=data.get('model', ''),
+            provider=data.get('provider', ''),
+            prompt_tokens=data.get('prompt_tokens', 0),
+            completion_tokens=data.get('completion_tokens', 0),
+            latency=data.get('latency', 0.0),
+            cached=cached,
+            degraded=data.get('degraded', False)
+        )
+
+
+class LLMBackendError(Exception):
+    """后端调用失败（status_code 与 HTTP 状态码一致，429 表示限流）"""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMBackend:
+    """
+    LLM 后端基类
+
+    子类需要实现：
+    - generate: 文本生成
+    - embed: 文本向量化
+    - as_crewai_llm: 提供给 CrewAI Agent 的 llm 对象
+    """
+
+    provider = 'base'
+
+    def generate(self, prompt: str, model: str, temperature: float = 0.7) -> LLMResponse:
+        raise NotImplementedError
+
+    def embed(self, text: str, model: str = "text-embedding-004",
+              task_type: str = "retrieval_document") -> List[float]:
+        raise NotImplementedError
+
+    def as_crewai_llm(self, model: str, temperature: float = 0.7):
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini 后端（使用进程级共享客户端）"""
+
+    provider = 'gemini'
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    def generate(self, prompt: str, model: str, temperature: float = 0.7) -> LLMResponse:
+        client = get_genai_client(self.api_key)
+        start = time.monotonic()
+        response = client.models.generate_content(
+            model=model,
+            contents=prompt,
+            config={'temperature': temperature}
+        )
+        latency = time.monotonic() - start
+
+        text = response.text
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', None) or estimate_tokens(prompt)
+        completion_tokens = getattr(usage, 'candidates_token_count', None) or estimate_tokens(text)
+
+        return LLMResponse(text, model, self.provider, prompt_tokens, completion_tokens, latency)
+
+    def embed(self, text: str, model: str = "text-embedding-004",
+              task_type: str = "retrieval_document") -> List[float]:
+        client = get_genai_client(self.api_key)
+        result = client.models.embed_content(
+            model=model,
+            contents=text,
+            config={'task_type': task_type.upper()}
+        )
+        return list(result.embeddings[0].values)
+
+    def as_crewai_llm(self, model: str, temperature: float = 0.7):
+        return get_chat_model(self.api_key, model, temperature=temperature)
+
+
+class FakeBackend(LLMBackend):
+    """
+    本地模拟后端（无需网络）
+
+    特性：
+    - 确定性：同一 (seed, model, prompt) 总是得到同样的回复
+    - 延迟分布：fixed / normal / lognormal / exponential，外加按 token 速率的输出耗时
+    - 错误注入：按概率抛出 429 / 500 / 超时错误
+    - 结构化回复：识别编剧 / 导演 / 审核的 JSON 提示词，返回可解析的 JSON
+    """
+
+    provider = 'fake'
+
+    _LINES = [
+        "我觉得我们应该先弄清楚这里到底发生了什么。",
+        "等一下，你们有没有注意到刚才那个细节？",
+        "我不同意，这样做风险太大了。",
+        "说得好，不过我还有一个想法。",
+        "别急，让我先想想下一步该怎么走。",
+        "这件事没有看上去那么简单。",
+        "我愿意试一试，但大家得配合我。",
+        "你这么说是有什么别的打算吗？",
+    ]
+
+    def __init__(self, latency_ms: float = 800.0, latency_distribution: str = 'lognormal',
+                 latency_sigma: float = 0.5, tokens_per_second: float = 0.0,
+                 error_rate: float = 0.0, error_kind: str = '429', seed: int = 0,
+                 embedding_dim: int = 768):
+        """
+        Args:
+            latency_ms: 首 token 延迟的中位数（毫秒）
+            latency_distribution: 延迟分布（fixed / normal / lognormal / exponential）
+            latency_sigma: 分布的离散程度（normal 为相对标准差，lognormal 为对数标准差）
+            tokens_per_second: 输出速率（0 表示不计输出耗时）
+            error_rate: 错误注入概率（0-1）
+            error_kind: 注入的错误类型（'429' / '500' / 'timeout'）
+            seed: 随机种子
+            embedding_dim: 向量维度
+        """
+        self.latency_ms = latency_ms
+        self.latency_distribution = latency_distribution
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.error_kind = error_kind
+        self.seed = seed
+        self.embedding_dim = embedding_dim
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'errors': 0, 'embeddings': 0,
+                       'prompt_tokens': 0, 'completion_tokens': 0}
+
+    # ---------- 延迟与错误 ----------
+
+    def _sample_latency(self) -> float:
+        """采样一次首 token 延迟（秒）"""
+        median = self.latency_ms / 1000.0
+        with self._lock:
+            if self.latency_distribution == 'fixed':
+                value = median
+            elif self.latency_distribution == 'normal':
+                value = self._rng.gauss(median, median * self.latency_sigma)
+            elif self.latency_distribution == 'exponential':
+                value = self._rng.expovariate(1.0 / median) if median > 0 else 0.0
+            else:
+                value = self._rng.lognormvariate(0.0, self.latency_sigma) * median
+        return max(0.0, value)
+
+    def _maybe_fail(self):
+        """按概率注入错误"""
+        with self._lock:
+            fail = self.error_rate > 0 and self._rng.random() < self.error_rate
+            if fail:
+                self._stats['errors'] += 1
+        if not fail:
+            return
+        if self.error_kind == 'timeout':
+            raise TimeoutError("fake backend: request timed out")
+        if self.error_kind == '500':
+            raise LLMBackendError("fake backend: internal error", status_code=500)
+        raise LLMBackendError("fake backend: 429 RESOURCE_EXHAUSTED", status_code=429)
+
+    # ---------- 确定性回复 ----------
+
+    def _digest(self, *parts: str) -> int:
+        data = "\x00".join([str(self.seed), *parts]).encode('utf-8')
+        return int(hashlib.sha256(data).hexdigest(), 16)
+
+    @staticmethod
+    def _character_names(prompt: str) -> List[str]:
+        """从提示词的角色列表（"- 名字: 性格"）中提取角色名"""
+        names = []
+        for match in re.finditer(r'^- ([^:：\n]+)[:：]', prompt, flags=re.MULTILINE):
+            name = match.group(1).strip()
+            if name and name not in names:
+                names.append(name)
+        return names
+
+    def _reply_for(self, prompt: str, model: str) -> str:
+        digest = self._digest(model, prompt)
+
+        # 先识别审核：审核提示词中嵌有导演计划（含 selected_characters），按输出格式中的 "pass" 判断
+        if '"pass"' in prompt:
+            score = 6 + digest % 5
+            passed = digest % 4 != 0
+            review = {
+                'pass': passed,
+                'feedback': "对话基本符合人设，可以再加强冲突",
+                'scores': {
+                    'character_consistency': score,
+                    'plot_advancement': score,
+                    'content_quality': score,
+                    'interaction_nature': score
+                }
+            }
+            if '"verdicts"' in prompt:
+                # 不通过时只标记一位角色
+                names = self._character_names(prompt)
+                flagged = names[digest % len(names)] if names and not passed else None
+                review['verdicts'] = {
+                    name: {'pass': name != flagged, 'feedback': "语气不符合人设" if name == flagged else ""}
+                    for name in names
+                }
+            return json.dumps(review, ensure_ascii=False)
+
+        if '"selected_characters"' in prompt:
+            names = self._character_names(prompt) or ["角色"]
+            count = 1 + digest % len(names)
+            selected = names[:count]
+            plan = {
+                'selected_characters': selected,
+                'instructions': {name: f"围绕剧情目标表达{name}的立场" for name in selected}
+            }
+            if '"plot_goal"' in prompt:
+                plan = {'plot_goal': "推进当前冲突，让角色暴露各自的动机", **plan}
+            return json.dumps(plan, ensure_ascii=False)
+
+        if '剧情目标:' in prompt:
+            return "剧情目标: 推进当前冲突，让角色暴露各自的动机"
+
+        return self._LINES[digest % len(self._LINES)]
+
+    # ---------- LLMBackend 接口 ----------
+
+    def generate(self, prompt: str, model: str, temperature: float = 0.7) -> LLMResponse:
+        start = time.monotonic()
+        latency = self._sample_latency()
+        self._maybe_fail()
+
+        text = self._reply_for(prompt, model)
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(text)
+        if self.tokens_per_second > 0:
+            latency += completion_tokens / self.tokens_per_second
+        time.sleep(latency)
+
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['prompt_tokens'] += prompt_tokens
+            self._stats['completion_tokens'] += completion_tokens
+
+        return LLMResponse(text, model, self.provider, prompt_tokens, completion_tokens,
+                           time.monotonic() - start)
+
+    def embed(self, text: str, model: str = "text-embedding-004",
+              task_type: str = "retrieval_document") -> List[float]:
+        self._maybe_fail()
+        rng = random.Random(self._digest(model, text))
+        with self._lock:
+            self._stats['embeddings'] += 1
+        return [rng.uniform(-1.0, 1.0) for _ in range(self.embedding_dim)]
+
+    def as_crewai_llm(self, model: str, temperature: float = 0.7):
+        return make_crewai_llm(self, model, temperature)
+
+    def stats(self) -> Dict:
+        """调用统计"""
+        with self._lock:
+            return dict(self._stats)
+
+
+def make_crewai_llm(backend: LLMBackend, model: str, temperature: float = 0.7,
+                    cacheable: bool = False):
+    """
+    把任意 LLMBackend 包装成 CrewAI 可用的 llm 对象
+
+    Args:
+        backend: 后端
+        model: 模型 ID
+        temperature: 采样温度
+        cacheable: 调用是否可缓存（见 llm_cache）
+
+    Returns:
+        crewai.BaseLLM 子类实例
+    """
+    from crewai import BaseLLM
+
+    class BackendCrewLLM(BaseLLM):
+        """把 CrewAI 的消息列表转发到 Scriptforge 后端"""
+
+        def call(self, messages, *args, **kwargs) -> str:
+            if isinstance(messages, str):
+                prompt = messages
+            else:
+                prompt = "\n\n".join(str(m.get('content', '')) for m in messages)
+            text = _cached_generate(backend, model, prompt, temperature, cacheable).text
+
+            # CrewAI 的执行器按 ReAct 格式解析输出，需要 Final Answer 标记
+            if 'Final Answer:' not in text:
+                text = f"Thought: I now can give a great answer\nFinal Answer: {text}"
+            return text
+
+        def supports_function_calling(self) -> bool:
+            return False
+
+    return BackendCrewLLM(model=model, temperature=temperature)
+
+
+# ==================== 后端选择 ====================
+
+_backend_config_lock = threading.Lock()
+_default_provider: Optional[str] = None
+_fake_config: Dict[str, Any] = {}
+
+
+def _fake_config_from_env() -> Dict[str, Any]:
+    """从环境变量读取模拟后端配置（SCRIPTFORGE_FAKE_*）"""
+    config = {}
+    for key, cast in (('latency_ms', float), ('latency_distribution', str),
+                      ('latency_sigma', float), ('tokens_per_second', float),
+                      ('error_rate', float), ('error_kind', str), ('seed', int)):
+        value = os.getenv(f"SCRIPTFORGE_FAKE_{key.upper()}")
+        if value:
+            config[key] = cast(value)
+    return config
+
+
+def configure_backend(provider: str, **fake_config):
+    """
+    设置进程默认后端
+
+    Args:
+        provider: 'gemini' 或 'fake'
+        **fake_config: 模拟后端的参数（见 FakeBackend）
+    """
+    global _default_provider, _fake_config
+    with _backend_config_lock:
+        _default_provider = provider
+        _fake_config = fake_config
+    # 丢弃按旧配置创建的后端
+    get_client_pool().clear()
+
+
+def default_provider() -> str:
+    """当前默认后端（configure_backend > SCRIPTFORGE_LLM_BACKEND > 'gemini'）"""
+    with _backend_config_lock:
+        if _default_provider:
+            return _default_provider
+    return os.getenv('SCRIPTFORGE_LLM_BACKEND', 'gemini')
+
+
+def get_backend(api_key: str, provider: Optional[str] = None) -> LLMBackend:
+    """
+    获取进程级共享的后端实例
+
+    Args:
+        api_key: API Key（模拟后端忽略）
+        provider: 'gemini' 或 'fake'（默认见 default_provider）
+
+    Returns:
+        LLMBackend
+    """
+    provider = provider or default_provider()
+
+    if provider == 'fake':
+        with _backend_config_lock:
+            config = {**_fake_config_from_env(), **_fake_config}
+        return get_client_pool().get(
+            'backend:fake', '', tuple(sorted(config.items())),
+            lambda: FakeBackend(**config)
+        )
+
+    if provider == 'gemini':
+        return get_client_pool().get(
+            'backend:gemini', api_key, None,
+            lambda: GeminiBackend(api_key)
+        )
+
+    raise ValueError(f"未知的 LLM 后端: {provider}")
+
+
+def _cached_generate(backend: LLMBackend, model: str, prompt: str, temperature: float,
+                     cacheable: bool, call=None) -> LLMResponse:
+    """
+    经过响应缓存的生成调用
+
+    Args:
+        backend: 后端
+        model: 模型 ID
+        prompt: 提示词
+        temperature: 采样温度
+        cacheable: 调用是否可缓存
+        call: 实际调用（默认直接调用 backend.generate）
+
+    Returns:
+        LLMResponse（命中缓存时 cached=True）
+
+    v3.5.0: 每次调用计入当前追踪阶段（见 tracing.stage）
+    """
+    call = call or (lambda: backend.generate(prompt, model, temperature=temperature))
+    record, hit = get_response_cache().get_or_call(
+        model, prompt, {'temperature': temperature},
+        lambda: call().to_dict(),
+        cacheable=cacheable
+    )
+    response = LLMResponse.from_dict(record, cached=hit)
+
+    # v3.5.0: 计入当前追踪阶段（命中缓存不消耗 token，也没有网络延迟）
+    if hit:
+        record_llm_usage(cached=True)
+    else:
+        record_llm_usage(response.prompt_tokens, response.completion_tokens, response.latency)
+    return response
+
+
+# ==================== 熔断降级 ====================
+
+def llm_circuit_breaker(model: str) -> CircuitBreaker:
+    """生成调用的熔断器（按模型区分，备用模型有自己的熔断器）"""
+    return get_circuit_breaker(f"llm:{model}")
+
+
+def fallback_mode() -> str:
+    """
+    熔断期间的降级路径（SCRIPTFORGE_LLM_FALLBACK）
+
+    - error: 直接抛出 CircuitOpenError，由调用方使用自己的降级（如 app 的 Mock 回复），默认
+    - mock: 本地模拟后端（零延迟）生成回复
+    - cache: 从响应缓存读取同一提示词的历史结果，未命中时抛出 CircuitOpenError
+    - model:<模型ID>: 改用备用模型
+    """
+    return os.getenv('SCRIPTFORGE_LLM_FALLBACK', 'error')
+
+
+def _fallback_call(api_key: str, model: str, prompt: str, temperature: float,
+                   deadline: Optional[Deadline], cancel_token: Optional[CancellationToken] = None):
+    """
+    构造熔断期间的降级调用
+
+    Returns:
+        返回 LLMResponse 的函数；降级路径为 error 时返回 None
+    """
+    mode = fallback_mode()
+
+    if mode == 'mock':
+        def _mock() -> LLMResponse:
+            backend = get_client_pool().get(
+                'backend:fallback-mock', '', None,
+                lambda: FakeBackend(latency_ms=0, latency_distribution='fixed')
+            )
+            response = backend.generate(prompt, model, temperature=temperature)
+            response.degraded = True
+            return response
+        return _mock
+
+    if mode == 'cache':
+        def _from_cache() -> LLMResponse:
+            record = get_response_cache().get(cache_key(model, prompt, {'temperature': temperature}))
+            if record is None:
+                raise CircuitOpenError(f"llm:{model}")
+            return LLMResponse.from_dict({**record, 'degraded': True}, cached=True)
+        return _from_cache
+
+    if mode.startswith('model:') and mode[len('model:'):] != model:
+        secondary = mode[len('model:'):]
+
+        def _secondary() -> LLMResponse:
+            response = generate(api_key, secondary, prompt, temperature=temperature,
+                                deadline=deadline, cancel_token=cancel_token)
+            response.degraded = True
+            return response
+        return _secondary
+
+    return None
+
+
+def generate(api_key: str, model: str, prompt: str, temperature: float = 0.7,
+             cacheable: bool = False, deadline: Optional[Deadline] = None,
+             cancel_token: Optional[CancellationToken] = None) -> LLMResponse:
+    """
+    经过响应缓存、熔断器和全局限流器的生成调用（429 时退避重试；命中缓存时不占用配额）
+
+    指定 deadline 时：超过该模型历史延迟的 HEDGE_PERCENTILE 分位仍未返回则发送一份对冲副本，
+    截止时间内都未返回则抛出 DeadlineExceeded。
+    熔断期间直接走降级路径（见 fallback_mode），不再为每次调用付出完整的错误延迟。
+    指定 cancel_token 时：取消后排队中的请求不再发出，等待中的调用立即抛出 RoundCancelled，
+    已发出请求的结果被丢弃（计入延迟统计的 discarded_tokens）。
+
+    Args:
+        api_key: API Key
+        model: 模型 ID
+        prompt: 提示词
+        temperature: 采样温度
+        cacheable: 调用是否可缓存（确定性的评审 / 检测类调用传 True，并使用 temperature=0.0）
+        deadline: 截止时间（通常由一轮对话向下传递）
+        cancel_token: 取消令牌（通常由一轮对话向下传递）
+
+    Returns:
+        LLMResponse
+
+    Raises:
+        RoundCancelled: 调用完成前已被取消
+    """
+    backend = get_backend(api_key)
+    limiter = get_rate_limiter('google-genai')
+    tracker = get_latency_tracker(model)
+
+    def _call_once(hedge: bool = False) -> LLMResponse:
+        response = limiter.call(
+            lambda: backend.generate(prompt, model, temperature=temperature),
+            estimated_tokens=estimate_tokens(prompt),
+            hedge=hedge,
+            cancel_token=cancel_token
+        )
+        # 补扣实际的输出 token
+        limiter.tokens.consume(response.completion_tokens)
+        tracker.record(response.latency)
+        if cancel_token is not None and cancel_token.cancelled:
+            tracker.count('discarded_tokens', response.prompt_tokens + response.completion_tokens)
+        return response
+
+    def _call() -> LLMResponse:
+        if deadline is None and cancel_token is None:
+            return _call_once()
+        try:
+            return call_with_deadline(
+                _call_once, deadline,
+                hedge_after=tracker.hedge_delay(HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES),
+                tracker=tracker,
+                hedge_fn=lambda: _call_once(hedge=True),
+                cancel_token=cancel_token
+            )
+        except RoundCancelled:
+            tracker.count('cancelled')
+            raise
+
+    def _guarded() -> LLMResponse:
+        return llm_circuit_breaker(model).call(
+            _call,
+            fallback=_fallback_call(api_key, model, prompt, temperature, deadline, cancel_token),
+            probe=lambda: limiter.call(
+                lambda: backend.generate("ping", model, temperature=0.0),
+                estimated_tokens=1
+            )
+        )
+
+    return _cached_generate(backend, model, prompt, temperature, cacheable, call=_guarded)
+
+
+def generate_text(api_key: str, model: str, prompt: str, cacheable: bool = False,
+                  deadline: Optional[Deadline] = None,
+                  cancel_token: Optional[CancellationToken] = None,
+                  temperature: float = 0.7) -> str:
+    """
+    生成文本
+
+    Args:
+        api_key: API Key
+        model: 模型 ID
+        prompt: 提示词
+        cacheable: 调用是否可缓存（可缓存的调用应同时传 temperature=0.0，缓存的结果才代表确定的答案）
+        deadline: 截止时间
+        cancel_token: 取消令牌
+        temperature: 采样温度
+
+    Returns:
+        生成的文本（未做 strip）
+    """
+    return generate(api_key, model, prompt, temperature=temperature, cacheable=cacheable,
+                    deadline=deadline, cancel_token=cancel_token).text
+
+
+class _KickoffStopped(BaseException):
+    """
+    让执行中的 Crew 停下来的信号（由 kickoff_crew 的回调抛出）
+
+    继承 BaseException：CrewAI 会把 Agent 执行中的普通异常当作失败重试（max_retry_limit），
+    停止信号需要穿过这些 except Exception 直接结束 kickoff
+    """
+
+
+def kickoff_crew(crew, model: str, deadline: Optional[Deadline] = None,
+                 cancel_token: Optional[CancellationToken] = None):
+    """
+    执行 Crew：经过熔断器和全局限流器（每个任务计一次请求），受截止时间和取消令牌约束
+
+    Crew 无法从外部强行中断。截止时间到期、被取消或调用方被中断时，
+    通过 Agent 的 step_callback 和 Crew 的 task_callback 让 kickoff 在当前这次 LLM 调用返回后停止，
+    并等待执行线程真正结束后才抛出异常：调用方随后读取 task.output、释放锁或开始下一轮时，
+    不会与仍在运行的 kickoff 共用 Agent。
+
+    Args:
+        crew: crewai.Crew（调用方需保证其中的 Agent 此时没有参与其他 Crew）
+        model: 模型 ID（用于熔断器）
+        deadline: 截止时间
+        cancel_token: 取消令牌
+
+    Returns:
+        crew.kickoff() 的返回值
+
+    Raises:
+        DeadlineExceeded: 截止时间内未完成（已完成任务的 task.output 可以安全读取）
+        RoundCancelled: 已被取消
+        CircuitOpenError: LLM 熔断中（不再等待 Crew 失败；Crew 自身的成败计入熔断器）
+    """
+    stop = cancel_token.child() if cancel_token is not None else CancellationToken()
+    state_lock = threading.Lock()
+    running = [False]
+    finished = threading.Event()
+
+    def _check_stop(*_args):
+        if stop.cancelled:
+            raise _KickoffStopped()
+
+    # CrewAI 只在 Agent 没有 step_callback 时才沿用 Crew 的设置，因此直接设置到 Agent 上
+    for agent in crew.agents:
+        agent.step_callback = _check_stop
+    crew.task_callback = _check_stop
+
+    def _kickoff():
+        with state_lock:
+            stop.raise_if_cancelled()
+            running[0] = True
+            finished.clear()
+        try:
+            return crew.kickoff()
+        except _KickoffStopped:
+            raise RoundCancelled(stop.reason or "已停止")
+        finally:
+            with state_lock:
+                running[0] = False
+                finished.set()
+
+    try:
+        # 整个 Crew 计为一次熔断器调用：后端错误计入失败，截止时间 / 取消 / 准入拒绝不计
+        return llm_circuit_breaker(model).call(
+            lambda: call_with_deadline(
+                lambda: get_rate_limiter('google-genai').call(
+                    _kickoff,
+                    estimated_tokens=sum(estimate_tokens(task.description) for task in crew.tasks),
+                    requests=len(crew.tasks),
+                    cancel_token=stop
+                ),
+                deadline,
+                cancel_token=stop
+            )
+        )
+    except BaseException as e:
+        # 尚未开始的 kickoff 不再开始；已开始的在当前 LLM 调用返回后停止，等它结束再交还 Agent
+        with state_lock:
+            stop.cancel("截止时间已到" if isinstance(e, DeadlineExceeded) else f"调用已中止: {type(e).__name__}")
+            wait_for_stop = running[0]
+        if wait_for_stop:
+            finished.wait()
+        raise
+
+
+def embed_text(api_key: str, text: str, model: str = "text-embedding-004",
+               task_type: str = "retrieval_document") -> List[float]:
+    """
+    经过熔断器和全局限流器的向量化调用
+
+    Args:
+        api_key: API Key
+        text: 输入文本
+        model: 向量模型
+        task_type: 任务类型
+
+    Returns:
+        向量
+
+    Raises:
+        CircuitOpenError: 熔断期间立即抛出（调用方按向量化失败处理）
+    """
+    backend = get_backend(api_key)
+    limiter = get_rate_limiter('google-embedding')
+    return get_circuit_breaker(f"embedding:{model}").call(
+        lambda: limiter.call(
+            lambda: backend.embed(text, model=model, task_type=task_type),
+            estimated_tokens=estimate_tokens(text)
+        ),
+        probe=lambda: limiter.call(
+            lambda: backend.embed("ping", model=model, task_type=task_type),
+            estimated_tokens=1
+        )
+    )
+
+
+def get_crewai_llm(api_key: str, model: str, temperature: float = 0.7, cacheable: bool = False):
+    """
+    获取当前后端对应的 CrewAI llm 对象
+
+    缓存模式覆盖这类调用时（如 record / replay），统一走后端适配器，
+    这样 Crew 内部的每次调用也会被录制 / 回放。
+
+    Args:
+        api_key: API Key
+        model: 模型 ID
+        temperature: 采样温度
+        cacheable: 调用是否可缓存（评审类 Agent 传 True，并使用 temperature=0.0）
+    """
+    backend = get_backend(api_key)
+    if get_response_cache().covers(cacheable):
+        return make_crewai_llm(backend, model, temperature, cacheable=cacheable)
+    return backend.as_crewai_llm(model, temperature)
@@ -0,0 +1,281 @@
+"""
+LLM Response Cache - 内容寻址的 LLM 响应缓存
+按 (模型, 归一化提示词, 采样参数哈希) 生成缓存键，结果落盘，支持 cache / record / replay 三种模式
+
+v3.5.0 新增功能
+"""
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+
+# 缓存模式
+#   off    : 不读不写
+#   cache  : 只对可缓存的调用（确定性的评审 / 检测类调用）读写缓存
+#   record : 所有调用都真实执行并写入缓存（录制一次会话）
+#   replay : 所有调用只从缓存读取，未命中直接报错（离线回放，不访问网络）
+CACHE_MODES = ('off', 'cache', 'record', 'replay')
+
+
+class CacheMissError(Exception):
+    """replay 模式下缓存未命中"""
+
+    def __init__(self, key: str, model: str):
+        super().__init__(f"回放缓存未命中: model={model}, key={key[:12]}")
+        self.key = key
+        self.model = model
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    归一化提示词（只消除不影响语义的空白差异）
+
+    - 统一换行符
+    - 去掉每行行尾空白
+    - 连续空行合并为一个
+    - 去掉首尾空白
+    """
+    text = prompt.replace('\r\n', '\n').replace('\r', '\n')
+    text = '\n'.join(line.rstrip() for line in text.split('\n'))
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+
+def params_hash(params: Optional[Dict[str, Any]]) -> str:
+    """采样参数的稳定哈希（与键的顺序无关）"""
+    payload = json.dumps(params or {}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def cache_key(model: str, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    计算缓存键
+
+    Args:
+        model: 模型 ID
+        prompt: 提示词（会先归一化）
+        params: 采样参数（temperature 等）
+
+    Returns:
+        sha256 十六进制字符串
+    """
+    payload = "\x00".join([model, params_hash(params), normalize_prompt(prompt)])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    LLM 响应缓存
+
+    特性：
+    - 内容寻址：相同 (模型, 归一化提示词, 采样参数) 命中同一条记录
+    - 落盘：每条记录一个 JSON 文件（按键前两位分目录），原子写入，跨进程共享
+    - 内存层：最近使用的记录保存在 LRU 中，回放时不需要反复读盘
+    """
+
+    def __init__(self, directory: str = "./llm_cache", mode: str = 'off',
+                 max_memory_entries: int = 1024):
+        """
+        Args:
+            directory: 缓存目录
+            mode: 'off' / 'cache' / 'record' / 'replay'
+            max_memory_entries: 内存 LRU 的最大条数
+        """
+        if mode not in CACHE_MODES:
+            raise ValueError(f"未知的缓存模式: {mode}（可选: {', '.join(CACHE_MODES)}）")
+
+        self.directory = directory
+        self.mode = mode
+        self.max_memory_entries = max_memory_entries
+
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'saved_seconds': 0.0}
+
+    # ---------- 模式判断 ----------
+
+    def reads(self, cacheable: bool = False) -> bool:
+        """本次调用是否先查缓存"""
+        return self.mode == 'replay' or (self.mode == 'cache' and cacheable)
+
+    def writes(self, cacheable: bool = False) -> bool:
+        """本次调用的结果是否写入缓存"""
+        return self.mode == 'record' or (self.mode == 'cache' and cacheable)
+
+    def covers(self, cacheable: bool = False) -> bool:
+        """本次调用是否受缓存影响（读或写）"""
+        return self.reads(cacheable) or self.writes(cacheable)
+
+    # ---------- 存取 ----------
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        读取记录（先查内存，再查磁盘）
+
+        Returns:
+            记录字典；不存在时返回 None
+        """
+        with self._lock:
+            record = self._memory.get(key)
+            if record is not None:
+                self._memory.move_to_end(key)
+                return record
+
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        self._remember(key, record)
+        return record
+
+    def put(self, key: str, record: Dict):
+        """写入记录（先写临时文件再替换，避免并发读到半个文件）"""
+        self._remember(key, record)
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ 写入 LLM 缓存失败: {e}")
+            return
+
+        with self._lock:
+            self._stats['writes'] += 1
+
+    def _remember(self, key: str, record: Dict):
+        with self._lock:
+            self._memory[key] = record
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get_or_call(self, model: str, prompt: str, params: Optional[Dict[str, Any]],
+                    fn: Callable[[], Dict], cacheable: bool = False) -> Tuple[Dict, bool]:
+        """
+        按当前模式查缓存 / 执行调用 / 写缓存
+
+        Args:
+            model: 模型 ID
+            prompt: 提示词
+            params: 采样参数
+            fn: 真实调用，返回可 JSON 序列化的记录（需包含 'latency' 字段以统计节省时间）
+            cacheable: 调用方是否声明本次调用可缓存（只影响 'cache' 模式）
+
+        Returns:
+            (记录, 是否命中缓存)
+        """
+        if not self.covers(cacheable):
+            return fn(), False
+
+        key = cache_key(model, prompt, params)
+
+        if self.reads(cacheable):
+            record = self.get(key)
+            if record is not None:
+                with self._lock:
+                    self._stats['hits'] += 1
+                    self._stats['saved_seconds'] += record.get('latency', 0.0)
+                return record, True
+
+            with self._lock:
+                self._stats['misses'] += 1
+            if self.mode == 'replay':
+                raise CacheMissError(key, model)
+
+        record = fn()
+        # 熔断降级得到的结果不写入缓存
+        if self.writes(cacheable) and not record.get('degraded'):
+            self.put(key, {**record, 'cached_at': time.time()})
+        return record, False
+
+    def clear_memory(self):
+        """清空内存层（磁盘记录保留）"""
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self) -> Dict:
+        """
+        缓存统计
+
+        Returns:
+            {
+                'mode': 当前模式,
+                'hits': 命中次数,
+                'misses': 未命中次数,
+                'writes': 写入次数,
+                'hit_rate': 命中率（0-1）,
+                'saved_seconds': 命中记录原本的调用耗时之和
+            }
+        """
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                'mode': self.mode,
+                'hits': self._stats['hits'],
+                'misses': self._stats['misses'],
+                'writes': self._stats['writes'],
+                'hit_rate': self._stats['hits'] / lookups if lookups else 0.0,
+                'saved_seconds': round(self._stats['saved_seconds'], 3)
+            }
+
+
+# ==================== 进程级缓存 ====================
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    获取进程级共享的响应缓存
+
+    默认配置来自环境变量：
+    - SCRIPTFORGE_LLM_CACHE_MODE: off / cache / record / replay（默认 off）
+    - SCRIPTFORGE_LLM_CACHE_DIR: 缓存目录（默认 ./llm_cache）
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                directory=os.getenv('SCRIPTFORGE_LLM_CACHE_DIR', './llm_cache'),
+                mode=os.getenv('SCRIPTFORGE_LLM_CACHE_MODE', 'off')
+            )
+        return _cache
+
+
+def configure_response_cache(mode: str, directory: Optional[str] = None,
+                             max_memory_entries: int = 1024) -> ResponseCache:
+    """
+    替换进程级响应缓存
+
+    Args:
+        mode: 'off' / 'cache' / 'record' / 'replay'
+        directory: 缓存目录（默认沿用环境变量或 ./llm_cache）
+        max_memory_entries: 内存 LRU 的最大条数
+
+    Returns:
+        新的 ResponseCache
+    """
+    global _cache
+    with _cache_lock:
+        _cache = ResponseCache(
+            directory=directory or os.getenv('SCRIPTFORGE_LLM_CACHE_DIR', './llm_cache'),
+            mode=mode,
+            max_memory_entries=max_memory_entries
+        )
+        return _cache
@@ -0,0 +1,115 @@
+"""
+LLM Client Pool - 进程级共享的 LLM 客户端
+按 (provider, api_key, model) 复用客户端，避免每次调用都重新创建客户端和 TLS 握手
+
+v3.5.0 新增功能
+"""
+
+from typing import Any, Callable, Dict, Hashable, Tuple
+import threading
+
+from deadline import DEFAULT_REQUEST_TIMEOUT
+
+
+class LLMClientPool:
+    """
+    LLM 客户端注册表
+
+    特性：
+    - 共享：同一 (provider, api_key, model) 在进程内只创建一个客户端，跨会话复用
+    - 线程安全：创建过程加锁，并发请求拿到的是同一个实例
+    - 长连接：复用客户端即复用其底层 HTTP 连接池（keep-alive），稳态下没有新的 TLS 握手
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str, Hashable], Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, api_key: str, model: Hashable,
+            factory: Callable[[], Any]) -> Any:
+        """
+        获取（必要时创建）客户端
+
+        Args:
+            provider: 提供方标识（如 'google-genai'）
+            api_key: API Key
+            model: 模型标识（客户端与模型无关时传 None）
+            factory: 客户端构造函数
+
+        Returns:
+            共享的客户端实例
+        """
+        key = (provider, api_key, model)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = factory()
+                self._clients[key] = client
+            return client
+
+    def clear(self):
+        """清空注册表（下次获取时重新创建客户端）"""
+        with self._lock:
+            self._clients.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
+
+
+# 进程级默认注册表
+_default_pool = LLMClientPool()
+
+
+def get_client_pool() -> LLMClientPool:
+    """获取进程级默认客户端注册表"""
+    return _default_pool
+
+
+def get_genai_client(api_key: str):
+    """
+    获取共享的 google-genai 客户端（模型在调用时指定，因此按 api_key 复用）
+    每个请求都带超时（DEFAULT_REQUEST_TIMEOUT），不会无限期挂起
+
+    Args:
+        api_key: Google API Key
+
+    Returns:
+        google.genai.Client
+    """
+    import google.genai as genai
+
+    return _default_pool.get(
+        'google-genai', api_key, None,
+        lambda: genai.Client(
+            api_key=api_key,
+            http_options={'timeout': int(DEFAULT_REQUEST_TIMEOUT * 1000)}  # 毫秒
+        )
+    )
+
+
+def get_chat_model(api_key: str, model_id: str, temperature: float = 0.7):
+    """
+    获取共享的 LangChain Gemini 聊天模型（供 CrewAI Agents 使用）
+
+    Args:
+        api_key: Google API Key
+        model_id: Gemini 模型 ID
+        temperature: 采样温度
+
+    Returns:
+        ChatGoogleGenerativeAI
+    """
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return _default_pool.get(
+        'langchain-google-genai', api_key, (model_id, temperature),
+        lambda: ChatGoogleGenerativeAI(
+            model=model_id,
+            google_api_key=api_key,
+            temperature=temperature,
+            timeout=DEFAULT_REQUEST_TIMEOUT,
+            convert_system_message_to_human=True  # 兼容性设置
+        )
+    )
+
@@ -8,9 +8,10 @@ v3.2.0 新增功能
 from typing import List, Dict, Optional
 import chromadb
 from chromadb.config import Settings
-import google.generativeai as genai
 from datetime import datetime
 
+from llm_backend import embed_text
+
 
 class RAGMemorySystem:
     """
@@ -33,9 +34,6 @@ class RAGMemorySystem:
         """
         self.api_key = api_key
 
-        # 配置 Google Embedding API
-        genai.configure(api_key=api_key)
-
         # 初始化 ChromaDB（本地持久化）
         self.client = chromadb.Client(Settings(
             persist_directory=persist_directory,
@@ -60,13 +58,13 @@ class RAGMemorySystem:
             向量（768维）
         """
         try:
-            # 使用 Google 的 text-embedding-004 模型
-            result = genai.embed_content(
-                model="models/text-embedding-004",
-                content=text,
+            # 使用 Google 的 text-embedding-004 模型（v3.5.0: 经过全局限流器，后端可切换）
+            return embed_text(
+                self.api_key,
+                text,
+                model="text-embedding-004",
                 task_type="retrieval_document"
             )
-            return result['embedding']
         except Exception as e:
             print(f"Embedding 生成失败: {str(e)}")
             # 降级：返回零向量
@@ -0,0 +1,278 @@
+"""
+Memory Store - 会话记忆的轻量数据结构
+为上下文构建提供增量索引，避免每轮扫描完整记忆
+
+v3.5.0 新增功能
+"""
+
+from collections import deque
+from typing import List, Dict, Optional, Iterator
+
+
+class GroupMessageLog:
+    """
+    群聊消息日志（只追加）
+
+    特性：
+    - 只追加：消息按发生顺序写入，不做修改
+    - O(1) 定位：最近 k 条通过尾部切片获得，与历史长度无关
+    - 版本号：每追加一条消息版本号 +1，可用于判断历史是否变化
+    """
+
+    def __init__(self, messages: Optional[List[Dict]] = None):
+        """
+        初始化群聊日志
+
+        Args:
+            messages: 初始消息列表（可选，例如从存档恢复）
+        """
+        self._messages: List[Dict] = []
+        if messages:
+            for msg in messages:
+                self.append(msg)
+
+    def append(self, message: Dict):
+        """
+        追加一条群聊消息
+
+        Args:
+            message: {'speaker': '...', 'content': '...', ...}
+        """
+        self._messages.append(message)
+
+    def recent(self, k: int = 10) -> List[Dict]:
+        """
+        获取最近 k 条群聊消息
+
+        Args:
+            k: 条数
+
+        Returns:
+            按时间顺序排列的最近 k 条消息
+        """
+        if k <= 0:
+            return []
+        return self._messages[-k:]
+
+    @property
+    def version(self) -> int:
+        """历史版本号（等于已追加的消息数）"""
+        return len(self._messages)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self._messages)
+
+    @classmethod
+    def from_character_memories(cls, character_memories: Optional[Dict[str, List]]) -> 'GroupMessageLog':
+        """
+        从角色记忆中重建群聊日志（兼容旧调用方式，需要一次完整扫描）
+
+        Args:
+            character_memories: {角色名: [记忆列表]}
+
+        Returns:
+            群聊日志
+        """
+        if not character_memories:
+            return cls()
+
+        # 所有角色的群聊记忆是相同的，取任意一个即可
+        first_char = next(iter(character_memories))
+        return cls([
+            msg for msg in character_memories[first_char]
+            if msg.get('type') == 'group'
+        ])
+
+
+class ConversationHistory:
+    """
+    有界对话历史（环形缓冲 + 滚动摘要）
+
+    特性：
+    - 环形缓冲：只保留最近 max_recent 条消息，内存占用恒定
+    - 滚动摘要：被挤出缓冲区的消息增量折叠进摘要（发言次数 + 每人最后一句）
+    - 预渲染：渲染后的文本会被缓存，直到下一次追加
+    """
+
+    def __init__(self, max_recent: int = 5, max_line_chars: int = 60,
+                 max_content_chars: int = 300):
+        """
+        初始化对话历史
+
+        Args:
+            max_recent: 环形缓冲区大小（保留原文的最近消息数）
+            max_line_chars: 摘要中每人最后一句的最大字数
+            max_content_chars: 缓冲区中单条消息的最大字数（保证 Prompt 长度可预期）
+        """
+        self.max_recent = max_recent
+        self.max_line_chars = max_line_chars
+        self.max_content_chars = max_content_chars
+
+        self._recent: deque = deque(maxlen=max_recent)
+        self._evicted_count = 0
+        self._speaker_counts: Dict[str, int] = {}
+        self._speaker_last: Dict[str, str] = {}
+        self._rendered: Optional[str] = None
+        self._rendered_summary: Optional[str] = None
+
+    def append(self, message: Dict):
+        """
+        追加一条消息
+
+        Args:
+            message: {'speaker': '...', 'content': '...'}
+        """
+        if len(self._recent) == self.max_recent:
+            # 最旧的一条即将被挤出，折叠进摘要
+            self._fold_into_summary(self._recent[0])
+        self._recent.append({
+            'speaker': message.get('speaker', '未知'),
+            'content': self._truncate(message.get('content', ''), self.max_content_chars)
+        })
+        self._rendered = None
+
+    @staticmethod
+    def _truncate(text: str, limit: int) -> str:
+        """截断过长文本"""
+        return text[:limit] + "…" if len(text) > limit else text
+
+    def _fold_into_summary(self, message: Dict):
+        """将一条被挤出的消息折叠进摘要"""
+        speaker = message['speaker']
+        content = self._truncate(message['content'], self.max_line_chars)
+
+        self._evicted_count += 1
+        self._speaker_counts[speaker] = self._speaker_counts.get(speaker, 0) + 1
+        self._speaker_last[speaker] = content
+        self._rendered_summary = None
+
+    def summary_text(self) -> str:
+        """
+        更早对话的摘要（没有被挤出的消息时返回空字符串）
+
+        Returns:
+            摘要文本
+        """
+        if self._evicted_count == 0:
+            return ""
+
+        if self._rendered_summary is None:
+            lines = [f"更早对话摘要（共 {self._evicted_count} 条）："]
+            for speaker, count in self._speaker_counts.items():
+                lines.append(f"- {speaker}（{count} 次）最后说：{self._speaker_last[speaker]}")
+            self._rendered_summary = "\n".join(lines)
+
+        return self._rendered_summary
+
+    def render(self) -> str:
+        """
+        渲染为紧凑的 Prompt 文本（摘要 + 最近消息原文）
+
+        Returns:
+            对话历史文本（没有任何消息时返回 '无'）
+        """
+        if self._rendered is None:
+            if not self._recent:
+                self._rendered = "无"
+            else:
+                parts = []
+                summary = self.summary_text()
+                if summary:
+                    parts.append(summary)
+                parts.append("\n".join(
+                    f"{msg['speaker']}: {msg['content']}" for msg in self._recent
+                ))
+                self._rendered = "\n".join(parts)
+
+        return self._rendered
+
+    def recent(self) -> List[Dict]:
+        """最近消息（原文）"""
+        return list(self._recent)
+
+    def __len__(self) -> int:
+        """累计消息数（含已折叠进摘要的）"""
+        return self._evicted_count + len(self._recent)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+
+class CharacterMemoryProvider:
+    """
+    角色记忆提供器（替代 CrewAI 内置的 Agent memory）
+
+    CrewAI 的 Agent 不再保存自己的记忆副本，而是在每个任务的描述中
+    注入 Scriptforge 记忆层（character_memories）的内容，每条记忆只存储一次。
+
+    私聊记忆与群聊记录分开读取：群聊消息再多，角色的私聊记忆也不会被挤出提示词。
+    """
+
+    def __init__(self, character_memories: Optional[Dict[str, List]] = None,
+                 private_memories: Optional[Dict[str, List]] = None):
+        """
+        初始化记忆提供器
+
+        Args:
+            character_memories: {角色名: [记忆列表]}
+            private_memories: {角色名: [私聊记忆列表]}（可选的私聊索引；
+                              未提供时从 character_memories 尾部向前查找私聊消息）
+        """
+        self.character_memories = character_memories or {}
+        self.private_memories = private_memories
+
+    def memories_for(self, character_name: str, limit: int = 10) -> List[Dict]:
+        """
+        获取角色的最近记忆
+
+        Args:
+            character_name: 角色名称
+            limit: 返回条数
+
+        Returns:
+            记忆列表（按时间顺序）
+        """
+        memories = self.character_memories.get(character_name, [])
+        return memories[-limit:] if limit > 0 else []
+
+    def private_memories_for(self, character_name: str, limit: int = 5) -> List[Dict]:
+        """
+        获取角色最近的私聊记忆
+
+        Args:
+            character_name: 角色名称
+            limit: 返回条数
+
+        Returns:
+            私聊记忆列表（按时间顺序）
+        """
+        if limit <= 0:
+            return []
+        if self.private_memories is not None:
+            return list(self.private_memories.get(character_name, [])[-limit:])
+
+        # 没有私聊索引：从尾部向前找，凑满 limit 条即停止
+        private = []
+        for msg in reversed(self.character_memories.get(character_name, [])):
+            if msg.get('type') == 'private':
+                private.append(msg)
+                if len(private) >= limit:
+                    break
+        return private[::-1]
+
+    def format_memory(self, character_name: str, limit: int = 10) -> str:
+        """格式化角色的最近记忆"""
+        memories = self.memories_for(character_name, limit)
+        if not memories:
+            return "（暂无记忆）"
+        return "\n".join(f"{msg['speaker']}: {msg['content']}" for msg in memories)
+
+    def format_private_memory(self, character_name: str, limit: int = 5) -> str:
+        """格式化角色最近的私聊记忆"""
+        memories = self.private_memories_for(character_name, limit)
+        if not memories:
+            return "（暂无私聊记忆）"
+        return "\n".join(f"{msg['speaker']}: {msg['content']}" for msg in memories)
@@ -0,0 +1,437 @@
+"""
+Rate Limiter - LLM / Embedding 调用的全局限流
+令牌桶控制每分钟请求数和 token 数，AIMD 自适应控制并发度
+
+v3.5.0 新增功能
+"""
+
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+import math
+import os
+import random
+import threading
+import time
+
+from cancellation import CancellationToken, RoundCancelled, POLL_INTERVAL
+from scheduler import PriorityScheduler, queue_limits_from_env
+
+
+class HedgeSkipped(Exception):
+    """对冲副本没有立即可用的配额，未发出（被对冲的请求照常等待）"""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 数（按 UTF-8 字节数 / 4，中文约 0.75 token/字）
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        估算的 token 数
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text.encode('utf-8')) / 4)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """判断异常是否是提供方的限流错误（HTTP 429 / RESOURCE_EXHAUSTED）"""
+    for attr in ('code', 'status_code', 'status'):
+        if getattr(error, attr, None) == 429:
+            return True
+
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in (
+        '429', 'resource_exhausted', 'resourceexhausted', 'rate limit', 'ratelimit', 'too many requests'
+    ))
+
+
+class TokenBucket:
+    """
+    令牌桶
+
+    按固定速率补充令牌，容量为一分钟的预算；允许事后补扣（余额可暂时为负）。
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        """
+        Args:
+            per_minute: 每分钟补充的令牌数
+            capacity: 桶容量（默认等于 per_minute）
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """按经过的时间补充令牌（调用方需持有 _lock）"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, amount: float = 1, timeout: Optional[float] = None) -> bool:
+        """
+        获取令牌（不足时等待）
+
+        Args:
+            amount: 需要的令牌数（超过容量时按容量计）
+            timeout: 最长等待秒数（None 表示一直等待）
+
+        Returns:
+            是否获取成功
+        """
+        amount = min(amount, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return True
+                wait = (amount - self._tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def consume(self, amount: float):
+        """事后补扣令牌（例如实际 token 用量超过预估），余额可以为负"""
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+
+    @property
+    def available(self) -> float:
+        """当前可用令牌数"""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD 自适应并发控制
+
+    - 成功且延迟正常：并发上限加性增长（每个窗口 +1）
+    - 延迟明显高于基线：并发上限小幅乘性下降
+    - 收到 429：并发上限减半
+    """
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 16,
+                 latency_tolerance: float = 2.0, backoff_ratio: float = 0.9,
+                 throttle_ratio: float = 0.5):
+        """
+        Args:
+            initial_limit: 初始并发上限
+            min_limit: 最小并发上限
+            max_limit: 最大并发上限
+            latency_tolerance: 延迟超过基线的多少倍视为拥塞
+            backoff_ratio: 拥塞时的乘性下降系数
+            throttle_ratio: 收到 429 时的乘性下降系数
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.throttle_ratio = throttle_ratio
+
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._baseline_latency: Optional[float] = None
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """当前并发上限"""
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        """当前在途请求数"""
+        return self._in_flight
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        获取一个并发槽位
+
+        Args:
+            timeout: 最长等待秒数（None 表示一直等待）
+
+        Returns:
+            是否获取成功
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._in_flight < self.limit, timeout=timeout):
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False):
+        """
+        释放槽位，并根据本次结果调整并发上限
+
+        Args:
+            latency: 本次请求耗时（秒，None 表示不参与调整）
+            throttled: 是否收到 429
+        """
+        with self._cond:
+            self._in_flight -= 1
+
+            if throttled:
+                self._limit = max(self.min_limit, self._limit * self.throttle_ratio)
+            elif latency is not None:
+                if self._baseline_latency is None or latency < self._baseline_latency:
+                    self._baseline_latency = latency
+                else:
+                    # 基线缓慢上漂，适应模型整体变慢
+                    self._baseline_latency += (latency - self._baseline_latency) * 0.01
+
+                if latency > self._baseline_latency * self.latency_tolerance:
+                    self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+                else:
+                    self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+
+            self._cond.notify_all()
+
+
+class RateLimiter:
+    """
+    LLM 调用限流器
+
+    组合三道闸门：每分钟请求数（RPM）令牌桶、每分钟 token 数（TPM）令牌桶、
+    AIMD 自适应并发；遇到 429 时指数退避重试，而不是直接降级到 Mock。
+    v3.5.0: 并发槽位经过优先级调度器分配（见 scheduler.request_context）。
+    """
+
+    def __init__(self, name: str, rpm: float = 60, tpm: float = 1_000_000,
+                 max_concurrency: int = 8, initial_concurrency: int = 4,
+                 max_retries: int = 3, base_backoff: float = 1.0, max_backoff: float = 30.0):
+        """
+        Args:
+            name: 限流器名称（通常是提供方，如 'google-genai'）
+            rpm: 每分钟请求数预算
+            tpm: 每分钟 token 数预算
+            max_concurrency: 并发上限的最大值
+            initial_concurrency: 初始并发上限
+            max_retries: 429 时的最大重试次数
+            base_backoff: 首次退避秒数
+            max_backoff: 最长退避秒数
+        """
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            initial_limit=initial_concurrency,
+            max_limit=max_concurrency
+        )
+        self.scheduler = PriorityScheduler(self.concurrency, queue_limits=queue_limits_from_env())
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._stats_lock = threading.Lock()
+        self._stats = {'calls': 0, 'throttled': 0, 'retries': 0, 'cancelled': 0, 'wait_seconds': 0.0,
+                       'hedges_skipped': 0}
+
+    def _record(self, key: str, value: float = 1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def _wait_for(self, acquire: Callable[[Optional[float]], bool],
+                  cancel_token: Optional[CancellationToken]):
+        """等待一道闸门；有取消令牌时分段等待，取消后立即放弃"""
+        if cancel_token is None:
+            acquire(None)
+            return
+        while not acquire(POLL_INTERVAL):
+            if cancel_token.cancelled:
+                self._record('cancelled')
+                cancel_token.raise_if_cancelled()
+
+    @contextmanager
+    def slot(self, estimated_tokens: int = 0, requests: int = 1, hedge: bool = False,
+             cancel_token: Optional[CancellationToken] = None):
+        """
+        获取一次调用的配额（请求数 + token + 并发槽位）
+
+        用法：
+            with limiter.slot(estimated_tokens=500) as slot:
+                result = call()
+                # 收到 429 时设置 slot['throttled'] = True
+
+        Args:
+            estimated_tokens: 预估 token 数（prompt + completion）
+            requests: 本次调用包含的请求数（例如一个 Crew 包含多个任务）
+            hedge: 是否是对冲副本（不排队：按调用方的请求类别经过调度器，各道闸门都能立即放行时才发出，
+                   否则抛出 HedgeSkipped；不会排在被对冲的慢请求后面，也不会越过排队中的更高优先级请求）
+            cancel_token: 取消令牌（排队期间被取消则抛出 RoundCancelled，不再占用配额）
+
+        Raises:
+            HedgeSkipped: 对冲副本没有立即可用的配额
+        """
+        wait_start = time.monotonic()
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        if hedge:
+            self._acquire_hedge(estimated_tokens, requests, cancel_token)
+        else:
+            self._wait_for(lambda timeout: self.requests.acquire(requests, timeout), cancel_token)
+            if estimated_tokens:
+                self._wait_for(lambda timeout: self.tokens.acquire(estimated_tokens, timeout), cancel_token)
+            # 按请求类别和会话排队（排队已满时抛出 AdmissionRejected）
+            try:
+                self.scheduler.acquire(cost=estimated_tokens, cancel_token=cancel_token)
+            except RoundCancelled:
+                self._record('cancelled')
+                raise
+        self._record('wait_seconds', time.monotonic() - wait_start)
+
+        state = {'throttled': False}
+        start = time.monotonic()
+        try:
+            yield state
+        finally:
+            latency = (time.monotonic() - start) / max(requests, 1)
+            self.scheduler.release(latency=latency, throttled=state['throttled'])
+
+    def _acquire_hedge(self, estimated_tokens: int, requests: int,
+                       cancel_token: Optional[CancellationToken]):
+        """对冲副本：不等待地依次获取各道闸门，任一道不能立即放行时退还已获取的令牌并放弃"""
+        taken_requests = taken_tokens = 0
+        try:
+            if not self.requests.acquire(requests, timeout=0):
+                raise HedgeSkipped("请求数预算不足")
+            taken_requests = requests
+            if estimated_tokens:
+                if not self.tokens.acquire(estimated_tokens, timeout=0):
+                    raise HedgeSkipped("token 预算不足")
+                taken_tokens = estimated_tokens
+            # timeout=0：有更高优先级的请求在排队或没有空闲槽位时立即返回 False
+            if not self.scheduler.acquire(cost=estimated_tokens, timeout=0, cancel_token=cancel_token):
+                raise HedgeSkipped("没有空闲的并发槽位")
+        except BaseException:
+            if taken_requests:
+                self.requests.consume(-taken_requests)
+            if taken_tokens:
+                self.tokens.consume(-taken_tokens)
+            self._record('hedges_skipped')
+            raise
+
+    def call(self, fn: Callable[[], Any], estimated_tokens: int = 0, requests: int = 1,
+             hedge: bool = False, cancel_token: Optional[CancellationToken] = None) -> Any:
+        """
+        在限流保护下执行调用；收到 429 时指数退避后重试
+
+        Args:
+            fn: 实际的调用
+            estimated_tokens: 预估 token 数
+            requests: 本次调用包含的请求数
+            hedge: 是否是对冲副本（见 slot）
+            cancel_token: 取消令牌（排队和退避期间检查）
+
+        Returns:
+            fn 的返回值（重试耗尽后抛出最后一次的异常）
+        """
+        attempt = 0
+        while True:
+            self._record('calls')
+            with self.slot(estimated_tokens, requests, hedge, cancel_token) as state:
+                try:
+                    return fn()
+                except Exception as e:
+                    if not is_rate_limit_error(e):
+                        raise
+                    state['throttled'] = True
+                    self._record('throttled')
+                    if attempt >= self.max_retries:
+                        raise
+
+            attempt += 1
+            self._record('retries')
+            backoff = min(self.max_backoff, self.base_backoff * (2 ** (attempt - 1)))
+            backoff *= random.uniform(0.5, 1.0)
+            if cancel_token is None:
+                time.sleep(backoff)
+            elif cancel_token.wait(backoff):
+                self._record('cancelled')
+                cancel_token.raise_if_cancelled()
+
+    def stats(self) -> Dict:
+        """限流统计"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            'name': self.name,
+            'concurrency_limit': self.concurrency.limit,
+            'in_flight': self.concurrency.in_flight,
+            'available_requests': round(self.requests.available, 1),
+            'available_tokens': round(self.tokens.available),
+            'scheduler': self.scheduler.stats()
+        })
+        return stats
+
+
+# ==================== 进程级注册表 ====================
+
+# 默认预算（可通过环境变量覆盖，见 .env.example）
+_DEFAULT_LIMITS = {
+    'google-genai': {'rpm': 60, 'tpm': 1_000_000, 'max_concurrency': 8},
+    'google-embedding': {'rpm': 1500, 'tpm': 1_000_000, 'max_concurrency': 8},
+}
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _limits_from_env(name: str) -> Dict:
+    """读取默认预算，并用环境变量覆盖（SCRIPTFORGE_<NAME>_RPM / _TPM / _MAX_CONCURRENCY）"""
+    limits = dict(_DEFAULT_LIMITS.get(name, _DEFAULT_LIMITS['google-genai']))
+    prefix = "SCRIPTFORGE_" + name.upper().replace('-', '_')
+    for key, cast in (('rpm', float), ('tpm', float), ('max_concurrency', int)):
+        value = os.getenv(f"{prefix}_{key.upper()}")
+        if value:
+            limits[key] = cast(value)
+    return limits
+
+
+def get_rate_limiter(name: str = 'google-genai') -> RateLimiter:
+    """
+    获取进程级共享的限流器
+
+    Args:
+        name: 限流器名称（'google-genai' 用于生成，'google-embedding' 用于向量化）
+
+    Returns:
+        RateLimiter
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(name, **_limits_from_env(name))
+            _limiters[name] = limiter
+        return limiter
+
+
+def configure_rate_limiter(name: str, **kwargs) -> RateLimiter:
+    """
+    用指定参数替换进程级限流器（例如按账号的实际配额设置 RPM / TPM）
+
+    Args:
+        name: 限流器名称
+        **kwargs: RateLimiter 的构造参数
+
+    Returns:
+        新的 RateLimiter
+    """
+    with _limiters_lock:
+        limiter = RateLimiter(name, **{**_limits_from_env(name), **kwargs})
+        _limiters[name] = limiter
+        return limiter
@@ -0,0 +1,329 @@
+"""
+批量剧本生成脚本
+无界面运行多个场景预设（preset_example_*.json 格式），每个场景生成 N 轮对话，逐轮写入 JSON Lines
+
+v3.5.0 新增功能
+"""
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Dict, List, Optional
+import glob
+import json
+import multiprocessing
+import os
+import queue
+import time
+
+from run_benchmark import load_preset, append_group_messages, add_backend_arguments, apply_backend_args
+
+
+ENGINES = ('crew', 'director', 'engine')
+
+
+# ==================== 工作进程 ====================
+
+def _init_worker(api_key: str):
+    """
+    工作进程初始化：预先建立本进程的共享客户端
+
+    每个工作进程有自己的 LLM 后端、客户端池、限流器和响应缓存（进程级单例），
+    之后该进程执行的所有场景复用同一套客户端。
+    """
+    from llm_backend import get_backend, default_provider
+
+    get_backend(api_key)
+    if default_provider() == 'gemini':
+        from llm_pool import get_genai_client
+        get_genai_client(api_key)
+
+
+def _round_record(job: Dict, round_index: int, dialogues: List[Dict], latency: float,
+                  extra: Optional[Dict] = None) -> Dict:
+    """一轮的转写记录"""
+    record = {
+        'type': 'round',
+        'run_id': job['run_id'],
+        'preset': job['preset_path'],
+        'preset_name': job['preset_name'],
+        'engine': job['engine'],
+        'round': round_index,
+        'timestamp': datetime.now().isoformat(),
+        'latency': round(latency, 3),
+        'dialogues': dialogues
+    }
+    if extra:
+        record.update(extra)
+    return record
+
+
+def _make_round_fn(job: Dict, preset: Dict, api_key: str, model_id: str, character_memories: Dict,
+                   group_log):
+    """按引擎构造"运行一轮"的函数，返回 (dialogues, 附加字段)"""
+    from deadline import Deadline
+
+    engine = job['engine']
+    round_timeout = job.get('round_timeout')
+
+    if engine == 'director':
+        from director_system import DirectorSystem
+
+        director = DirectorSystem(scene=preset['scene'], characters=preset['characters'],
+                                  api_key=api_key, model_id=model_id)
+
+        def _director_round():
+            result = director.run_conversation_round(
+                user_message=None,
+                character_memories=character_memories,
+                group_log=group_log,
+                deadline=Deadline.after(round_timeout)
+            )
+            return result['dialogues'], {
+                'plot_goal': result['plot_goal'],
+                'review': {k: result['review_result'].get(k) for k in ('pass', 'feedback', 'source', 'forced')},
+                'retry_count': result['retry_count'],
+                'trace_totals': result['trace']['totals']
+            }
+        return _director_round
+
+    if engine == 'crew':
+        from agent_crew import CharacterAgentCrew
+
+        crew = CharacterAgentCrew(scene=preset['scene'], characters=preset['characters'],
+                                  api_key=api_key, model_id=model_id)
+
+        def _crew_round():
+            responses, _ = crew.run_conversation_round(
+                user_message=None,
+                character_memories=character_memories,
+                group_log=group_log,
+                deadline=Deadline.after(round_timeout)
+            )
+            return responses, {}
+        return _crew_round
+
+    from generation_engine import GenerationEngine, run_sync
+
+    generation_engine = GenerationEngine(api_key, model_id)
+
+    def _render(char, _prepared, previous) -> str:
+        history = "\n".join(f"{m['speaker']}：{m['content']}" for m in group_log.recent(10)) or "（暂无）"
+        lines = "\n".join(f"{r['speaker']}：{r['content']}" for r in previous) or "（暂无）"
+        return (f"你是 {char['name']}，性格：{char['personality']}\n场景：{preset['scene']}\n"
+                f"最近对话：\n{history}\n本轮已有发言：\n{lines}\n"
+                f"请以你的性格说一句话（只输出你要说的话）：")
+
+    def _engine_round():
+        responses = run_sync(generation_engine.generate_round(
+            preset['characters'], prepare=lambda char: None, render=_render,
+            pipelined=True, deadline=Deadline.after(round_timeout)
+        ))
+        return responses, {}
+    return _engine_round
+
+
+def run_job(job: Dict, api_key: str, model_id: str, records) -> Dict:
+    """
+    在工作进程中运行一个场景的 N 轮对话，每轮结束后把转写记录放入 records 队列
+
+    Args:
+        job: {'run_id', 'preset_path', 'preset_name', 'engine', 'rounds', 'round_timeout'}
+        api_key: API Key
+        model_id: 模型 ID
+        records: 跨进程队列（主进程负责写文件）
+
+    Returns:
+        {'run_id', 'rounds', 'messages', 'elapsed', 'error'}
+    """
+    from memory_store import GroupMessageLog
+
+    start = time.perf_counter()
+    completed = 0
+    messages = 0
+    try:
+        preset = load_preset(job['preset_path'])
+        character_memories = {c['name']: [] for c in preset['characters']}
+        group_log = GroupMessageLog()
+        run_round = _make_round_fn(job, preset, api_key, model_id, character_memories, group_log)
+
+        for round_index in range(job['rounds']):
+            round_start = time.perf_counter()
+            dialogues, extra = run_round()
+            records.put(_round_record(job, round_index, dialogues, time.perf_counter() - round_start, extra))
+            append_group_messages(dialogues, group_log, character_memories)
+            completed += 1
+            messages += len(dialogues)
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        records.put({'type': 'error', 'run_id': job['run_id'], 'preset': job['preset_path'],
+                     'round': completed, 'error': error})
+
+    summary = {
+        'type': 'summary',
+        'run_id': job['run_id'],
+        'preset': job['preset_path'],
+        'engine': job['engine'],
+        'rounds': completed,
+        'messages': messages,
+        'elapsed': round(time.perf_counter() - start, 3),
+        'error': error
+    }
+    records.put(summary)
+    return summary
+
+
+# ==================== 主进程 ====================
+
+def expand_presets(patterns: List[str]) -> List[str]:
+    """展开预设文件的通配符（保持顺序、去重）"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def run_batch(preset_paths: List[str], api_key: str, model_id: str, engine: str = 'director',
+              rounds: int = 10, repeat: int = 1, workers: int = 2, output_path: Optional[str] = None,
+              round_timeout: Optional[float] = None) -> Dict:
+    """
+    批量生成
+
+    Args:
+        preset_paths: 预设文件列表
+        api_key: API Key
+        model_id: 模型 ID
+        engine: 生成方式（'crew' / 'director' / 'engine'）
+        rounds: 每个场景的轮数
+        repeat: 每个场景重复生成的次数
+        workers: 工作进程数
+        output_path: 转写输出文件（JSON Lines，默认按时间生成文件名）
+        round_timeout: 每轮截止时间（秒）
+
+    Returns:
+        {'output', 'runs', 'rounds', 'messages', 'failed', 'elapsed', 'rounds_per_minute'}
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"未知的生成方式: {engine}（可选: {', '.join(ENGINES)}）")
+
+    output_path = output_path or f"batch_transcripts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    jobs = []
+    for preset_path in preset_paths:
+        preset_name = load_preset(preset_path).get('preset_name', os.path.basename(preset_path))
+        for replica in range(repeat):
+            jobs.append({
+                'run_id': f"{os.path.splitext(os.path.basename(preset_path))[0]}-{replica}",
+                'preset_path': preset_path,
+                'preset_name': preset_name,
+                'engine': engine,
+                'rounds': rounds,
+                'round_timeout': round_timeout
+            })
+
+    print(f"🚀 批量生成: {len(jobs)} 个任务 × {rounds} 轮，引擎 {engine}，{workers} 个工作进程")
+    print(f"📝 输出: {output_path}")
+
+    start = time.perf_counter()
+    summaries = []
+    written = 0
+
+    manager = multiprocessing.Manager()
+    records = manager.Queue()
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(api_key,))
+    try:
+        with open(output_path, 'a', encoding='utf-8') as output:
+            def _drain(block: bool) -> int:
+                count = 0
+                while True:
+                    try:
+                        record = records.get(timeout=0.5) if block and count == 0 else records.get_nowait()
+                    except queue.Empty:
+                        return count
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    count += 1
+                    if record['type'] == 'round':
+                        print(f"  • {record['run_id']} 第 {record['round'] + 1} 轮: "
+                              f"{len(record['dialogues'])} 条发言，{record['latency']}s")
+                    elif record['type'] == 'error':
+                        print(f"  ❌ {record['run_id']} 在第 {record['round'] + 1} 轮失败: {record['error']}")
+
+            pending = {executor.submit(run_job, job, api_key, model_id, records) for job in jobs}
+            while pending:
+                written += _drain(block=True)
+                output.flush()
+                done, pending = wait(pending, timeout=0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    summaries.append(future.result())
+            written += _drain(block=False)
+    except KeyboardInterrupt:
+        print("\n⏹️ 已中断，已写入的转写保留")
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        manager.shutdown()
+
+    elapsed = time.perf_counter() - start
+    total_rounds = sum(s['rounds'] for s in summaries)
+    report = {
+        'output': output_path,
+        'runs': len(summaries),
+        'rounds': total_rounds,
+        'messages': sum(s['messages'] for s in summaries),
+        'failed': sum(1 for s in summaries if s['error']),
+        'records': written,
+        'elapsed': round(elapsed, 2),
+        'rounds_per_minute': round(total_rounds * 60.0 / elapsed, 2) if elapsed > 0 else 0.0
+    }
+
+    print("\n" + "="*60)
+    print("📦 批量生成完成")
+    print("="*60)
+    print(f"  • 任务: {report['runs']}（失败 {report['failed']}）")
+    print(f"  • 轮数: {report['rounds']}，发言数: {report['messages']}")
+    print(f"  • 耗时: {report['elapsed']}s，吞吐量: {report['rounds_per_minute']} 轮/分钟")
+    print(f"  • 转写: {report['output']}（{report['records']} 条记录）")
+    print("="*60)
+    return report
+
+
+def main():
+    """主函数 - 命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Scriptforge 批量剧本生成")
+    parser.add_argument('presets', nargs='*', default=['preset_example_*.json'],
+                        help='场景预设文件（支持通配符，默认 preset_example_*.json）')
+    parser.add_argument('--engine', choices=list(ENGINES), default='director',
+                        help='生成方式：crew（CharacterAgentCrew）/ director（DirectorSystem）/ engine（异步生成引擎）')
+    parser.add_argument('--rounds', type=int, default=10, help='每个场景的对话轮数')
+    parser.add_argument('--repeat', type=int, default=1, help='每个场景重复生成的次数')
+    parser.add_argument('--workers', type=int, default=max(1, min(4, os.cpu_count() or 1)), help='工作进程数')
+    parser.add_argument('--round-timeout', type=float, default=None, help='每轮截止时间（秒，默认不限时）')
+    parser.add_argument('--output', default=None, help='转写输出文件（JSON Lines，追加写入）')
+    add_backend_arguments(parser)
+
+    args = parser.parse_args()
+
+    api_key = apply_backend_args(args)
+    if not api_key:
+        print("❌ 需要 API Key：可通过 --api-key 参数或 GEMINI_API_KEY 环境变量提供（或使用 --backend fake）")
+        return
+
+    preset_paths = expand_presets(args.presets)
+    missing = [path for path in preset_paths if not os.path.exists(path)]
+    if missing:
+        print(f"❌ 预设文件不存在: {', '.join(missing)}")
+        return
+
+    run_batch(preset_paths, api_key, args.model, engine=args.engine, rounds=args.rounds,
+              repeat=args.repeat, workers=args.workers, output_path=args.output,
+              round_timeout=args.round_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,834 @@
+"""
+性能基准脚本
+测量多 Agent 对话系统的调用次数、内存占用和延迟
+"""
+
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+from typing import List, Dict, Optional
+
+
+# ==================== 工具函数 ====================
+
+def current_rss_mb() -> float:
+    """当前进程的常驻内存（MB）"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # 非 Linux：退化为峰值 RSS
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def directory_size_bytes(path: str) -> int:
+    """目录占用的字节数"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue
+    return total
+
+
+def load_preset(preset_path: str) -> Dict:
+    """加载预设文件（preset_example_*.json 格式）"""
+    with open(preset_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """计算百分位数（线性插值）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def summarize_latencies(latencies: List[float]) -> Dict:
+    """延迟统计（秒）"""
+    return {
+        'count': len(latencies),
+        'mean': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'p50': round(percentile(latencies, 50), 3),
+        'p95': round(percentile(latencies, 95), 3),
+        'p99': round(percentile(latencies, 99), 3),
+        'max': round(max(latencies), 3) if latencies else 0.0
+    }
+
+
+def append_group_messages(responses: List[Dict], group_log, character_memories: Dict[str, List]):
+    """把一轮发言写入群聊日志和所有角色的记忆（与 app.add_group_message 一致）"""
+    for resp in responses:
+        message = {
+            'timestamp': datetime.now().isoformat(),
+            'speaker': resp['speaker'],
+            'content': resp['content'],
+            'type': 'group',
+            'msg_type': 'character',
+            'visible_to': 'all'
+        }
+        group_log.append(message)
+        for memories in character_memories.values():
+            memories.append(message)
+
+
+def backend_stats(api_key: str) -> Dict:
+    """当前后端的调用统计（模拟后端才有）"""
+    from llm_backend import get_backend
+
+    backend = get_backend(api_key)
+    return backend.stats() if hasattr(backend, 'stats') else {}
+
+
+def breaker_stats() -> Dict:
+    """熔断器统计（只列出发生过熔断的）"""
+    from circuit_breaker import all_circuit_breakers
+
+    return {
+        name: breaker.stats()
+        for name, breaker in all_circuit_breakers().items()
+        if breaker.stats()['opened']
+    }
+
+
+def cache_stats() -> Dict:
+    """响应缓存统计（缓存关闭时为空）"""
+    from llm_cache import get_response_cache
+
+    cache = get_response_cache()
+    return cache.stats() if cache.mode != 'off' else {}
+
+
+class VectorStoreCallCounter:
+    """
+    统计向量库的写入 / 查询次数
+
+    CrewAI 内置记忆基于 ChromaDB，每次写入或查询都对应一次 embedding 请求，
+    因此这里的计数就是 CrewAI 记忆带来的额外 embedding 调用数。
+    """
+
+    def __init__(self):
+        self.counts = {'add': 0, 'upsert': 0, 'query': 0}
+        self._originals = {}
+
+    def __enter__(self):
+        try:
+            from chromadb.api.models.Collection import Collection
+        except ImportError:
+            return self
+
+        for method in self.counts:
+            original = getattr(Collection, method)
+            self._originals[method] = original
+            setattr(Collection, method, self._wrap(method, original))
+        return self
+
+    def _wrap(self, method: str, original):
+        counter = self
+
+        def wrapper(*args, **kwargs):
+            counter.counts[method] += 1
+            return original(*args, **kwargs)
+        return wrapper
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._originals:
+            from chromadb.api.models.Collection import Collection
+            for method, original in self._originals.items():
+                setattr(Collection, method, original)
+        return False
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+# ==================== 基准：CrewAI 内置记忆 ====================
+
+def _run_agent_memory_case(crewai_memory: bool, api_key: str, model_id: str,
+                           rounds: int, preset_path: str) -> Dict:
+    """
+    在独立进程中运行若干轮对话，记录 embedding 调用数、RSS 和存储占用
+
+    Args:
+        crewai_memory: 是否启用 CrewAI 内置记忆
+        api_key: API Key
+        model_id: 模型 ID
+        rounds: 对话轮数
+        preset_path: 预设文件路径
+
+    Returns:
+        单个配置的测量结果
+    """
+    # CrewAI 把记忆存储在以 CREWAI_STORAGE_DIR 命名的用户数据目录下，每个用例独立
+    os.environ['CREWAI_STORAGE_DIR'] = f"scriptforge_bench_{uuid.uuid4().hex[:8]}"
+
+    from agent_crew import CharacterAgentCrew
+    from memory_store import GroupMessageLog
+
+    preset = load_preset(preset_path)
+    character_memories = {c['name']: [] for c in preset['characters']}
+    group_log = GroupMessageLog()
+
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+
+    with VectorStoreCallCounter() as counter:
+        crew = CharacterAgentCrew(
+            scene=preset['scene'],
+            characters=preset['characters'],
+            api_key=api_key,
+            model_id=model_id,
+            crewai_memory=crewai_memory
+        )
+
+        for _ in range(rounds):
+            responses, _ = crew.run_conversation_round(
+                user_message=None,
+                character_memories=character_memories,
+                group_log=group_log
+            )
+            append_group_messages(responses, group_log, character_memories)
+
+    elapsed = time.perf_counter() - start
+    rss_after = current_rss_mb()
+
+    storage_bytes = 0
+    try:
+        from crewai.utilities.paths import db_storage_path
+        storage_dir = str(db_storage_path())
+        storage_bytes = directory_size_bytes(storage_dir)
+        shutil.rmtree(storage_dir, ignore_errors=True)
+    except ImportError:
+        pass
+
+    return {
+        'crewai_memory': crewai_memory,
+        'rounds': rounds,
+        'vector_store_calls': counter.total,
+        'vector_store_breakdown': dict(counter.counts),
+        'rss_before_mb': round(rss_before, 1),
+        'rss_after_mb': round(rss_after, 1),
+        'rss_growth_mb': round(rss_after - rss_before, 1),
+        'storage_bytes': storage_bytes,
+        'elapsed_seconds': round(elapsed, 2)
+    }
+
+
+def benchmark_agent_memory(api_key: str, model_id: str, rounds: int,
+                           preset_path: str) -> Dict:
+    """
+    对比启用 / 关闭 CrewAI 内置记忆时的额外调用与内存占用
+    每个配置在单独的进程中运行，避免互相影响 RSS
+
+    Returns:
+        {'with_crewai_memory': {...}, 'without_crewai_memory': {...}, 'saved': {...}}
+    """
+    import multiprocessing
+
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    for crewai_memory in (True, False):
+        with ctx.Pool(1) as pool:
+            results[crewai_memory] = pool.apply(
+                _run_agent_memory_case,
+                (crewai_memory, api_key, model_id, rounds, preset_path)
+            )
+
+    with_memory, without_memory = results[True], results[False]
+    return {
+        'with_crewai_memory': with_memory,
+        'without_crewai_memory': without_memory,
+        'saved': {
+            'vector_store_calls': with_memory['vector_store_calls'] - without_memory['vector_store_calls'],
+            'rss_growth_mb': round(with_memory['rss_growth_mb'] - without_memory['rss_growth_mb'], 1),
+            'storage_bytes': with_memory['storage_bytes'] - without_memory['storage_bytes'],
+            'elapsed_seconds': round(with_memory['elapsed_seconds'] - without_memory['elapsed_seconds'], 2)
+        }
+    }
+
+
+def print_agent_memory_report(report: Dict):
+    """打印 CrewAI 内置记忆对比报告"""
+    print("\n" + "="*60)
+    print("🧠 CrewAI 内置记忆开销")
+    print("="*60)
+
+    for label, key in (("启用 CrewAI 记忆", 'with_crewai_memory'),
+                       ("Scriptforge 记忆层", 'without_crewai_memory')):
+        data = report[key]
+        print(f"\n【{label}】")
+        print(f"  • 向量库调用: {data['vector_store_calls']} {data['vector_store_breakdown']}")
+        print(f"  • RSS 增长: {data['rss_growth_mb']} MB")
+        print(f"  • 存储占用: {data['storage_bytes']} bytes")
+        print(f"  • 耗时: {data['elapsed_seconds']}s")
+
+    saved = report['saved']
+    print(f"\n✅ 节省: {saved['vector_store_calls']} 次 embedding 调用, "
+          f"{saved['rss_growth_mb']} MB RSS, {saved['storage_bytes']} bytes 存储")
+    print("="*60)
+
+
+# ==================== 基准：对话生成路径 ====================
+
+def benchmark_crew(api_key: str, model_id: str, rounds: int, preset_path: str,
+                   single_speaker: bool = False, round_timeout: Optional[float] = None) -> Dict:
+    """
+    CharacterAgentCrew 主路径：每轮一次 Crew kickoff
+
+    Returns:
+        {'path': 'crew', 'round_latency': {...}, 'messages': 发言数, 'backend': {...}}
+    """
+    from agent_crew import CharacterAgentCrew
+    from memory_store import GroupMessageLog
+    from deadline import Deadline
+
+    preset = load_preset(preset_path)
+    character_memories = {c['name']: [] for c in preset['characters']}
+    group_log = GroupMessageLog()
+
+    crew = CharacterAgentCrew(
+        scene=preset['scene'],
+        characters=preset['characters'],
+        api_key=api_key,
+        model_id=model_id
+    )
+
+    latencies = []
+    next_index = 0
+    messages = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        responses, next_index = crew.run_conversation_round(
+            user_message=None,
+            character_memories=character_memories,
+            single_speaker=single_speaker,
+            next_speaker_index=next_index,
+            group_log=group_log,
+            deadline=Deadline.after(round_timeout)
+        )
+        latencies.append(time.perf_counter() - start)
+        messages += len(responses)
+        append_group_messages(responses, group_log, character_memories)
+
+    return {
+        'path': 'crew',
+        'round_latency': summarize_latencies(latencies),
+        'messages': messages,
+        'backend': backend_stats(api_key),
+        'cache': cache_stats(),
+        'breakers': breaker_stats()
+    }
+
+
+def benchmark_director(api_key: str, model_id: str, rounds: int, preset_path: str,
+                       round_timeout: Optional[float] = None, planning_mode: str = 'fused',
+                       pipelined: bool = False, perform_mode: str = 'concurrent') -> Dict:
+    """
+    DirectorSystem 路径：编剧 → 导演 → 角色 → 审核
+
+    Args:
+        planning_mode: 规划模式（'fused' 编导一次调用 / 'two_stage' 编剧、导演各一次）
+        pipelined: 使用跨轮流水线（审核第 N 轮时提前规划第 N+1 轮）
+        perform_mode: 角色表演模式（'concurrent' 同时生成 / 'sequential' 顺序执行）
+
+    Returns:
+        {'path': 'director', 'planning_mode': ..., 'perform_mode': ..., 'pipelined': ..., 'round_latency': {...},
+         'rounds_per_minute': 吞吐量, 'messages': 发言数, 'retries': 重试次数,
+         'calls_saved': 局部重做节省的角色调用, 'pipeline': {...}, 'stages': {阶段: 耗时分布},
+         'structured_output': {类别: 解析 / 修复 / 失败统计}, 'backend': {...}}
+    """
+    from director_system import DirectorSystem
+    from director_pipeline import PipelinedDirectorRunner
+    from memory_store import GroupMessageLog
+    from deadline import Deadline
+    from structured_output import structured_output_stats, reset_structured_output_stats
+
+    preset = load_preset(preset_path)
+    character_memories = {c['name']: [] for c in preset['characters']}
+    group_log = GroupMessageLog()
+    reset_structured_output_stats()
+
+    director = DirectorSystem(
+        scene=preset['scene'],
+        characters=preset['characters'],
+        api_key=api_key,
+        model_id=model_id,
+        planning_mode=planning_mode,
+        perform_mode=perform_mode
+    )
+
+    runner = PipelinedDirectorRunner(director, group_log, character_memories) if pipelined else None
+
+    latencies = []
+    messages = 0
+    retries = 0
+    calls_saved = 0
+    stage_times: Dict[str, List[float]] = {}
+    total_start = time.perf_counter()
+    for _ in range(rounds):
+        start = time.perf_counter()
+        if runner is not None:
+            result = runner.run_round(deadline=Deadline.after(round_timeout))
+        else:
+            result = director.run_conversation_round(
+                user_message=None,
+                character_memories=character_memories,
+                group_log=group_log,
+                deadline=Deadline.after(round_timeout)
+            )
+        latencies.append(time.perf_counter() - start)
+        messages += len(result['dialogues'])
+        retries += result['retry_count']
+        calls_saved += result.get('calls_saved', 0)
+        for data in result['trace']['stages']:
+            if data['parent'] is None and not data.get('speculative'):
+                stage_times.setdefault(data['stage'], []).append(data['wall_time'])
+        append_group_messages(result['dialogues'], group_log, character_memories)
+    total = time.perf_counter() - total_start
+
+    pipeline_stats = None
+    if runner is not None:
+        pipeline_stats = runner.stats()
+        runner.shutdown()
+
+    return {
+        'path': 'director',
+        'planning_mode': planning_mode,
+        'perform_mode': perform_mode,
+        'pipelined': pipelined,
+        'round_latency': summarize_latencies(latencies),
+        'rounds_per_minute': round(rounds * 60.0 / total, 2) if total > 0 else 0.0,
+        'pipeline': pipeline_stats,
+        'prescreen': director.prescreen.stats(),
+        'plot_plan': director.plot_plan_stats(),
+        'structured_output': structured_output_stats(),
+        'stages': {name: summarize_latencies(times) for name, times in stage_times.items()},
+        'messages': messages,
+        'retries': retries,
+        'calls_saved': calls_saved,
+        'backend': backend_stats(api_key),
+        'cache': cache_stats(),
+        'breakers': breaker_stats()
+    }
+
+
+def benchmark_fallback(api_key: str, model_id: str, rounds: int, preset_path: str,
+                       round_timeout: Optional[float] = None) -> Dict:
+    """
+    降级路径：每个角色一次直接生成调用（CharacterAgentCrew._fallback_simple_generation）
+
+    Returns:
+        {'path': 'fallback', 'round_latency': {...}, 'messages': 发言数, 'backend': {...}}
+    """
+    from agent_crew import CharacterAgentCrew
+    from deadline import Deadline
+
+    preset = load_preset(preset_path)
+    crew = CharacterAgentCrew(
+        scene=preset['scene'],
+        characters=preset['characters'],
+        api_key=api_key,
+        model_id=model_id
+    )
+
+    latencies = []
+    messages = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        responses = crew._fallback_simple_generation(None, Deadline.after(round_timeout))
+        latencies.append(time.perf_counter() - start)
+        messages += len(responses)
+        crew.commit_round(None, responses)
+
+    return {
+        'path': 'fallback',
+        'round_latency': summarize_latencies(latencies),
+        'messages': messages,
+        'backend': backend_stats(api_key),
+        'cache': cache_stats(),
+        'breakers': breaker_stats()
+    }
+
+
+def benchmark_hedging(api_key: str, model_id: str, calls: int, timeout: float) -> Dict:
+    """
+    单次调用的尾延迟：不设截止时间 vs 截止时间 + 对冲请求
+
+    前半段不设截止时间（同时为对冲阈值积累延迟样本），后半段每次调用都带截止时间，
+    超过历史延迟分位数仍未返回时发送对冲副本；超时的调用按截止时间计入延迟（视为降级）。
+
+    Returns:
+        {'before': {...}, 'after': {...}, 'degraded': 超时降级次数, 'tracker': {...}}
+    """
+    from llm_backend import generate
+    from deadline import Deadline, DeadlineExceeded, get_latency_tracker
+
+    def _prompt(i: int) -> str:
+        return f"你是一位侦探。第 {i} 次调用，请简短回应（一句话）："
+
+    before = []
+    for i in range(calls):
+        start = time.perf_counter()
+        generate(api_key, model_id, _prompt(i))
+        before.append(time.perf_counter() - start)
+
+    after = []
+    degraded = 0
+    for i in range(calls, calls * 2):
+        start = time.perf_counter()
+        try:
+            generate(api_key, model_id, _prompt(i), deadline=Deadline.after(timeout))
+        except DeadlineExceeded:
+            degraded += 1
+        after.append(time.perf_counter() - start)
+
+    return {
+        'path': 'hedging',
+        'before': summarize_latencies(before),
+        'after': summarize_latencies(after),
+        'degraded': degraded,
+        'tracker': get_latency_tracker(model_id).stats()
+    }
+
+
+def benchmark_engine(api_key: str, model_id: str, rounds: int, preset_path: str,
+                     round_timeout: Optional[float] = None) -> Dict:
+    """
+    异步生成引擎：逐个串行调用 vs 流水线 vs 并行
+
+    三种方式使用同样的提示词模板（串行与流水线中，后一位能看到前一位的发言）。
+
+    Returns:
+        {'serial': {...}, 'pipelined': {...}, 'parallel': {...}}（每轮耗时统计）
+    """
+    from llm_backend import generate_text
+    from generation_engine import GenerationEngine, run_sync
+    from deadline import Deadline
+
+    preset = load_preset(preset_path)
+    characters = preset['characters']
+    engine = GenerationEngine(api_key, model_id)
+
+    def _render(char, _prepared, previous) -> str:
+        lines = "\n".join(f"{r['speaker']}：{r['content']}" for r in previous) or "（暂无）"
+        return f"你是 {char['name']}（{char['personality']}）\n场景：{preset['scene']}\n本轮发言：\n{lines}\n请简短回应（一句话）："
+
+    report = {'path': 'engine'}
+
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        previous = []
+        for char in characters:
+            content = generate_text(api_key, model_id, _render(char, None, previous)).strip()
+            previous.append({'speaker': char['name'], 'content': content})
+        latencies.append(time.perf_counter() - start)
+    report['serial'] = summarize_latencies(latencies)
+
+    for mode in ('pipelined', 'parallel'):
+        latencies = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            run_sync(engine.generate_round(
+                characters, prepare=lambda char: None, render=_render,
+                pipelined=(mode == 'pipelined'), deadline=Deadline.after(round_timeout)
+            ))
+            latencies.append(time.perf_counter() - start)
+        report[mode] = summarize_latencies(latencies)
+
+    return report
+
+
+class _SimulatedRerun(BaseException):
+    """模拟 Streamlit 的 RerunException（同样继承 BaseException，不会被 except Exception 捕获）"""
+
+
+def benchmark_cancellation(api_key: str, model_id: str, rounds: int, preset_path: str,
+                           interrupt_after: float = 0.3) -> Dict:
+    """
+    等待 LLM 期间被 Streamlit 重新运行打断时，进行中的一轮是否真的停下
+
+    每轮用异步引擎并行生成，取消令牌注册一个轮询函数（与 app 的计时占位相同的位置），
+    interrupt_after 秒后抛出 _SimulatedRerun。检查：令牌是否被取消、打断后多久交还控制权、
+    打断之后是否还有新的请求取得并发槽位（应为 0；打断时已发出的请求结果丢弃）。
+
+    Returns:
+        {'rounds', 'interrupted', 'token_cancelled', 'returned_after': {...}, 'calls_after_interrupt', 'stopped'}
+    """
+    from generation_engine import GenerationEngine, run_sync
+    from cancellation import CancellationToken
+    from rate_limiter import get_rate_limiter
+
+    preset = load_preset(preset_path)
+    characters = preset['characters']
+    engine = GenerationEngine(api_key, model_id)
+    limiter = get_rate_limiter('google-genai')
+
+    def _admitted() -> int:
+        return sum(s['admitted'] for s in limiter.scheduler.stats().values())
+
+    def _render(char, _prepared, _previous) -> str:
+        return f"你是 {char['name']}（{char['personality']}）\n场景：{preset['scene']}\n请简短回应（一句话）："
+
+    returned_after = []
+    interrupted = 0
+    cancelled = 0
+    calls_after = 0
+    for _ in range(rounds):
+        token = CancellationToken()
+        started = time.monotonic()
+        interrupt = {}
+
+        def _poller():
+            if time.monotonic() - started >= interrupt_after:
+                interrupt.setdefault('at', time.monotonic())
+                interrupt.setdefault('admitted', _admitted())
+                raise _SimulatedRerun()
+
+        token.add_poller(_poller)
+        try:
+            run_sync(engine.generate_round(characters, prepare=lambda char: None, render=_render,
+                                           pipelined=False, cancel_token=token))
+        except _SimulatedRerun:
+            interrupted += 1
+            returned_after.append(time.monotonic() - interrupt['at'])
+        cancelled += int(token.cancelled)
+
+        # 等已发出的请求自然结束，再统计打断之后新取得槽位的请求
+        settle = time.monotonic() + 30
+        while limiter.concurrency.in_flight and time.monotonic() < settle:
+            time.sleep(0.05)
+        if 'admitted' in interrupt:
+            calls_after += _admitted() - interrupt['admitted']
+
+    return {
+        'path': 'cancellation',
+        'rounds': rounds,
+        'interrupted': interrupted,
+        'token_cancelled': cancelled,
+        'returned_after': summarize_latencies(returned_after),
+        'calls_after_interrupt': calls_after,
+        'stopped': interrupted == rounds and cancelled == rounds and calls_after == 0
+    }
+
+
+def print_engine_report(report: Dict):
+    """打印异步引擎三种方式的每轮耗时"""
+    print("\n" + "="*60)
+    print("⚡ 异步生成引擎：每轮耗时")
+    print("="*60)
+    for label, key in (("串行", 'serial'), ("流水线", 'pipelined'), ("并行", 'parallel')):
+        latency = report[key]
+        print(f"  • {label}: mean {latency['mean']}s | p50 {latency['p50']}s | p95 {latency['p95']}s")
+    print("="*60)
+
+
+def print_hedging_report(report: Dict):
+    """打印对冲前后的尾延迟对比"""
+    print("\n" + "="*60)
+    print("⏱️  截止时间 + 对冲请求：单次调用延迟")
+    print("="*60)
+    for label, key in (("无截止时间", 'before'), ("截止时间 + 对冲", 'after')):
+        latency = report[key]
+        print(f"  • {label}: p50 {latency['p50']}s | p95 {latency['p95']}s | "
+              f"p99 {latency['p99']}s | max {latency['max']}s")
+    tracker = report['tracker']
+    print(f"  • 对冲 {tracker['hedges']} 次，对冲胜出 {tracker['hedge_wins']} 次，"
+          f"超时降级 {report['degraded']} 次")
+    print("="*60)
+
+
+def print_cancellation_report(report: Dict):
+    """打印重新运行打断一轮后的停止情况"""
+    print("\n" + "="*60)
+    print("⏹️  重新运行打断进行中的一轮")
+    print("="*60)
+    latency = report['returned_after']
+    print(f"  • 打断 {report['interrupted']}/{report['rounds']} 轮，令牌已取消 {report['token_cancelled']} 轮")
+    print(f"  • 打断后交还控制权: mean {latency['mean']}s | max {latency['max']}s")
+    print(f"  • 打断后新发出的请求: {report['calls_after_interrupt']}")
+    print(f"  • 结论: {'✅ 进行中的一轮已停止' if report['stopped'] else '❌ 打断后仍有调用继续'}")
+    print("="*60)
+
+
+def print_path_report(report: Dict):
+    """打印对话生成路径的基准结果"""
+    print("\n" + "="*60)
+    print(f"⏱️  生成路径: {report['path']}")
+    print("="*60)
+
+    latency = report['round_latency']
+    print(f"  • 轮数: {latency['count']}，发言数: {report['messages']}")
+    print(f"  • 每轮耗时: mean {latency['mean']}s | p50 {latency['p50']}s | "
+          f"p95 {latency['p95']}s | p99 {latency['p99']}s | max {latency['max']}s")
+    if 'retries' in report:
+        print(f"  • 审核重试: {report['retries']} 次")
+    if 'calls_saved' in report:
+        print(f"  • 局部重做节省角色调用: {report['calls_saved']} 次")
+    if 'rounds_per_minute' in report:
+        print(f"  • 吞吐量: {report['rounds_per_minute']} 轮/分钟")
+    if report.get('pipeline'):
+        pipeline = report['pipeline']
+        speculation = pipeline['speculation']
+        print(f"  • 跨轮流水线: 预规划命中 {speculation['hits']} 次，重新规划 {pipeline['replans']} 次，"
+              f"丢弃 {speculation['discarded']} 次（浪费约 {speculation['wasted_tokens']} tokens）")
+    for name, stage_latency in report.get('stages', {}).items():
+        print(f"  • 阶段 {name}: {stage_latency['count']} 次，mean {stage_latency['mean']}s | "
+              f"p95 {stage_latency['p95']}s")
+    if report.get('plot_plan'):
+        plot = report['plot_plan']
+        print(f"  • 剧情目标: 规划 {plot['planned']} 次，沿用 {plot['reused']} 次（省去编剧调用），"
+              f"失效 {plot['invalidated']}")
+    if report.get('prescreen'):
+        prescreen = report['prescreen']
+        print(f"  • 审核预筛: 自动通过 {prescreen['auto_pass']} / 自动打回 {prescreen['auto_reject']} / "
+              f"升级 LLM {prescreen['escalated']}（升级率 {prescreen['escalation_rate']:.0%}）")
+    for kind, parsed in report.get('structured_output', {}).items():
+        print(f"  • 结构化输出 {kind}: 直接解析 {parsed['parsed']} / 宽容解析 {parsed['recovered']} / "
+              f"修复 {parsed['repaired']} / 失败 {parsed['failed']}（解析失败 {parsed['parse_failures']} 次）")
+    if report.get('backend'):
+        print(f"  • 后端统计: {report['backend']}")
+    for name, breaker in report.get('breakers', {}).items():
+        print(f"  • 熔断器 {name}: 熔断 {breaker['opened']} 次，直接降级 {breaker['short_circuited']} 次，"
+              f"当前 {breaker['state']}")
+    if report.get('cache'):
+        cache = report['cache']
+        print(f"  • 响应缓存（{cache['mode']}）: 命中 {cache['hits']} / 未命中 {cache['misses']}，"
+              f"写入 {cache['writes']}，节省 {cache['saved_seconds']}s")
+    print("="*60)
+
+
+def add_backend_arguments(parser):
+    """后端相关的命令行参数（基准脚本和批量生成脚本共用，配合 apply_backend_args 使用）"""
+    parser.add_argument('--backend', choices=['gemini', 'fake'], default='gemini',
+                        help='LLM 后端（fake 为本地模拟，无需网络）')
+    parser.add_argument('--latency-ms', type=float, default=800.0, help='模拟后端：延迟中位数（毫秒）')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='模拟后端：lognormal / normal 分布的离散程度')
+    parser.add_argument('--latency-distribution', default='lognormal',
+                        choices=['fixed', 'normal', 'lognormal', 'exponential'], help='模拟后端：延迟分布')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='模拟后端：输出速率')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟后端：错误注入概率')
+    parser.add_argument('--error-kind', default='429', choices=['429', '500', 'timeout'], help='模拟后端：错误类型')
+    parser.add_argument('--seed', type=int, default=0, help='模拟后端：随机种子')
+    parser.add_argument('--cache-mode', choices=['off', 'cache', 'record', 'replay'], default='off',
+                        help='响应缓存模式（record 录制一次会话，replay 离线回放）')
+    parser.add_argument('--hedge-percentile', type=float, default=95.0,
+                        help='对冲阈值：超过历史延迟该分位数仍未返回时发送副本（0 关闭）')
+    parser.add_argument('--fallback', default='error',
+                        help='熔断期间的降级路径：error / mock / cache / model:<模型ID>')
+    parser.add_argument('--trace-file', default=None, help='导演系统每轮的分阶段追踪追加写入该 JSONL 文件')
+    parser.add_argument('--cache-dir', default=None, help='响应缓存目录（默认 ./llm_cache）')
+    parser.add_argument('--api-key', default=None, help='Gemini API Key')
+    parser.add_argument('--model', default='gemini-2.0-flash-exp', help='模型 ID')
+
+
+def apply_backend_args(args) -> Optional[str]:
+    """
+    按命令行参数选择后端；模拟后端的配置写入环境变量，子进程同样生效
+
+    Returns:
+        API Key（模拟后端时为占位值，真实后端缺少 Key 时为 None）
+    """
+    os.environ['SCRIPTFORGE_LLM_CACHE_MODE'] = args.cache_mode
+    if args.trace_file:
+        os.environ['SCRIPTFORGE_TRACE_FILE'] = args.trace_file
+    os.environ['SCRIPTFORGE_HEDGE_PERCENTILE'] = str(args.hedge_percentile)
+    os.environ['SCRIPTFORGE_LLM_FALLBACK'] = args.fallback
+    if args.cache_dir:
+        os.environ['SCRIPTFORGE_LLM_CACHE_DIR'] = args.cache_dir
+
+    if args.backend == 'fake':
+        os.environ['SCRIPTFORGE_LLM_BACKEND'] = 'fake'
+        os.environ['SCRIPTFORGE_FAKE_LATENCY_MS'] = str(args.latency_ms)
+        os.environ['SCRIPTFORGE_FAKE_LATENCY_DISTRIBUTION'] = args.latency_distribution
+        os.environ['SCRIPTFORGE_FAKE_LATENCY_SIGMA'] = str(args.latency_sigma)
+        os.environ['SCRIPTFORGE_FAKE_TOKENS_PER_SECOND'] = str(args.tokens_per_second)
+        os.environ['SCRIPTFORGE_FAKE_ERROR_RATE'] = str(args.error_rate)
+        os.environ['SCRIPTFORGE_FAKE_ERROR_KIND'] = args.error_kind
+        os.environ['SCRIPTFORGE_FAKE_SEED'] = str(args.seed)
+        # 模拟后端没有提供方配额，放开 RPM 以免限流器掩盖延迟分布（可用环境变量覆盖）
+        os.environ.setdefault('SCRIPTFORGE_GOOGLE_GENAI_RPM', '100000')
+        return args.api_key or 'fake'
+
+    os.environ['SCRIPTFORGE_LLM_BACKEND'] = 'gemini'
+    return args.api_key or os.getenv('GEMINI_API_KEY')
+
+
+def main():
+    """主函数 - 命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Scriptforge 性能基准")
+    parser.add_argument('--suite', choices=['agent-memory', 'crew', 'director', 'fallback', 'hedging', 'engine',
+                                            'cancellation'],
+                        default='crew', help='基准项目')
+    add_backend_arguments(parser)
+    parser.add_argument('--single-speaker', action='store_true', help='crew 基准使用单次发言模式')
+    parser.add_argument('--planning-mode', choices=['fused', 'two_stage'], default='fused',
+                        help='director 基准的规划模式')
+    parser.add_argument('--perform-mode', choices=['concurrent', 'sequential'], default='concurrent',
+                        help='director 基准的角色表演模式')
+    parser.add_argument('--pipelined-director', action='store_true',
+                        help='director 基准使用跨轮流水线（审核时提前规划下一轮）')
+    parser.add_argument('--round-timeout', type=float, default=None,
+                        help='每轮截止时间（秒，默认不限时；hedging 基准中为单次调用截止时间，默认 30 秒）')
+    parser.add_argument('--rounds', type=int, default=5, help='对话轮数')
+    parser.add_argument('--preset', default='preset_example_castle.json', help='场景预设文件')
+    parser.add_argument('--output', default=None, help='将结果保存为 JSON 文件')
+
+    args = parser.parse_args()
+
+    api_key = apply_backend_args(args)
+    if not api_key:
+        print("❌ 需要 API Key：可通过 --api-key 参数或 GEMINI_API_KEY 环境变量提供（或使用 --backend fake）")
+        return
+
+    if args.suite == 'agent-memory':
+        report = benchmark_agent_memory(api_key, args.model, args.rounds, args.preset)
+        print_agent_memory_report(report)
+    elif args.suite == 'crew':
+        report = benchmark_crew(api_key, args.model, args.rounds, args.preset,
+                                args.single_speaker, args.round_timeout)
+        print_path_report(report)
+    elif args.suite == 'director':
+        report = benchmark_director(api_key, args.model, args.rounds, args.preset, args.round_timeout,
+                                    args.planning_mode, args.pipelined_director, args.perform_mode)
+        print_path_report(report)
+    elif args.suite == 'engine':
+        report = benchmark_engine(api_key, args.model, args.rounds, args.preset, args.round_timeout)
+        print_engine_report(report)
+    elif args.suite == 'cancellation':
+        report = benchmark_cancellation(api_key, args.model, args.rounds, args.preset)
+        print_cancellation_report(report)
+    elif args.suite == 'hedging':
+        report = benchmark_hedging(api_key, args.model, args.rounds, args.round_timeout or 30.0)
+        print_hedging_report(report)
+    else:
+        report = benchmark_fallback(api_key, args.model, args.rounds, args.preset, args.round_timeout)
+        print_path_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Request Scheduler - LLM 调用的优先级调度与准入控制
+并发槽位紧张时按请求类别排队：用户交互 > 私聊 > 自主对话 > 评估；同一类别内按会话做加权公平排队
+
+v3.5.0 新增功能
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+import itertools
+import os
+import threading
+import time
+
+from cancellation import CancellationToken, POLL_INTERVAL
+
+
+# 请求类别（按优先级从高到低）
+#   interactive : 用户在群聊中发言后等待的回复、开场对话
+#   private     : 私聊回复
+#   autonomous  : 自主对话（前台 / 后台任务）与预生成
+#   evaluation  : 评估 / 审核类调用
+PRIORITIES = ('interactive', 'private', 'autonomous', 'evaluation')
+
+# 没有声明类别的调用按自主对话处理
+DEFAULT_PRIORITY = 'autonomous'
+
+# 各类别的最大排队数（0 表示不限制；超过时直接拒绝，由调用方降级）
+_DEFAULT_QUEUE_LIMITS = {'interactive': 0, 'private': 64, 'autonomous': 32, 'evaluation': 16}
+
+# 排队每满该秒数，有效优先级提升一级（避免低优先级请求被无限饿死）
+AGING_SECONDS = float(os.getenv('SCRIPTFORGE_SCHED_AGING', '10'))
+
+# 每放行多少个请求清理一次已落后于虚拟时间的会话完成标签
+_PRUNE_EVERY = 64
+
+
+class AdmissionRejected(Exception):
+    """排队已满，请求未被接纳"""
+
+    def __init__(self, priority: str, queued: int):
+        super().__init__(f"{priority} 类请求排队已满（{queued}），请求被拒绝")
+        self.priority = priority
+        self.queued = queued
+
+
+# ==================== 请求上下文 ====================
+
+_request: ContextVar[Tuple[str, str]] = ContextVar('scriptforge_request', default=(DEFAULT_PRIORITY, 'default'))
+
+
+@contextmanager
+def request_context(priority: str, session_id: Optional[str] = None):
+    """
+    声明当前代码块内 LLM 调用的类别和所属会话
+
+    通过 contextvars 传递：asyncio 任务、asyncio.to_thread 以及 call_with_deadline 的工作线程
+    都会继承；嵌套使用时内层覆盖外层（session_id 省略时沿用外层）。
+
+    用法：
+        with request_context('interactive', session_id):
+            crew_manager.run_conversation_round(...)
+
+    Args:
+        priority: PRIORITIES 之一
+        session_id: 会话 ID（用于同类别内的公平排队）
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"未知的请求类别: {priority}（可选: {', '.join(PRIORITIES)}）")
+    token = _request.set((priority, session_id or _request.get()[1]))
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+
+def current_request() -> Tuple[str, str]:
+    """当前上下文的 (类别, 会话 ID)"""
+    return _request.get()
+
+
+# ==================== 调度器 ====================
+
+class _Ticket:
+    """一个排队中的请求"""
+
+    __slots__ = ('priority', 'session', 'rank', 'tag', 'previous_tag', 'seq', 'enqueued_at')
+
+    def __init__(self, priority: str, session: str, tag: float, seq: int,
+                 previous_tag: Optional[float] = None):
+        self.priority = priority
+        self.session = session
+        self.rank = PRIORITIES.index(priority)
+        self.tag = tag
+        self.previous_tag = previous_tag  # 入队前会话的完成标签（放弃排队时恢复）
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+
+
+class PriorityScheduler:
+    """
+    并发槽位的优先级调度器（包装 AdaptiveConcurrencyLimiter）
+
+    - 严格优先级：有空闲槽位时，先放行有效优先级最高的请求
+    - 老化：排队每满 aging_seconds 秒，有效优先级提升一级
+    - 加权公平排队（WFQ）：同一类别内，每个请求按 "max(类别虚拟时间, 会话上次完成标签) + 成本 / 会话权重"
+      打完成标签，标签小的先放行，一个会话的大批量请求不会挤占其他会话
+    - 准入控制：某类别排队数达到上限时直接拒绝（AdmissionRejected），让调用方立即降级而不是长时间等待
+    """
+
+    def __init__(self, limiter, queue_limits: Optional[Dict[str, int]] = None,
+                 aging_seconds: float = AGING_SECONDS):
+        """
+        Args:
+            limiter: AdaptiveConcurrencyLimiter（提供 acquire(timeout) / release(...)）
+            queue_limits: 各类别最大排队数（缺省使用 _DEFAULT_QUEUE_LIMITS）
+            aging_seconds: 老化间隔（<= 0 表示不老化）
+        """
+        self.limiter = limiter
+        self.queue_limits = {**_DEFAULT_QUEUE_LIMITS, **(queue_limits or {})}
+        self.aging_seconds = aging_seconds
+
+        self._cond = threading.Condition()
+        self._waiting: List[_Ticket] = []
+        self._seq = itertools.count()
+        self._virtual: Dict[str, float] = {p: 0.0 for p in PRIORITIES}
+        self._finish: Dict[Tuple[str, str], float] = {}
+        self._weights: Dict[str, float] = {}
+        self._admitted_since_prune = 0
+        self._stats = {
+            p: {'admitted': 0, 'rejected': 0, 'abandoned': 0, 'wait_seconds': 0.0, 'max_wait': 0.0}
+            for p in PRIORITIES
+        }
+
+    def set_weight(self, session: str, weight: float):
+        """设置会话权重（默认 1.0，权重越大同类别内分到的槽位越多）"""
+        with self._cond:
+            self._weights[session] = max(weight, 1e-6)
+
+    def _queued_locked(self, priority: str) -> int:
+        return sum(1 for t in self._waiting if t.priority == priority)
+
+    def _head_locked(self) -> Optional[_Ticket]:
+        """下一个应放行的请求（调用方需持有 _cond）"""
+        if not self._waiting:
+            return None
+        now = time.monotonic()
+
+        def _order(ticket: _Ticket):
+            rank = ticket.rank
+            if self.aging_seconds > 0:
+                rank -= int((now - ticket.enqueued_at) / self.aging_seconds)
+            return (rank, ticket.tag, ticket.seq)
+
+        return min(self._waiting, key=_order)
+
+    def acquire(self, cost: float = 1.0, timeout: Optional[float] = None,
+                priority: Optional[str] = None, session: Optional[str] = None,
+                cancel_token: Optional[CancellationToken] = None) -> bool:
+        """
+        排队获取一个并发槽位
+
+        Args:
+            cost: 请求成本（通常为预估 token 数，用于公平排队）
+            timeout: 最长等待秒数（None 表示一直等待）
+            priority: 请求类别（默认取当前 request_context）
+            session: 会话 ID（默认取当前 request_context）
+            cancel_token: 取消令牌（排队期间被取消则抛出 RoundCancelled）
+
+        Returns:
+            是否获取成功（超时返回 False）
+
+        Raises:
+            AdmissionRejected: 该类别排队已满
+            RoundCancelled: 排队期间被取消
+        """
+        context_priority, context_session = current_request()
+        priority = priority or context_priority
+        session = session or context_session
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            limit = self.queue_limits.get(priority, 0)
+            queued = self._queued_locked(priority)
+            if limit and queued >= limit:
+                self._stats[priority]['rejected'] += 1
+                raise AdmissionRejected(priority, queued)
+
+            key = (priority, session)
+            weight = self._weights.get(session, 1.0)
+            previous = self._finish.get(key)
+            tag = max(self._virtual[priority], previous or 0.0) + max(cost, 1.0) / weight
+            self._finish[key] = tag
+            ticket = _Ticket(priority, session, tag, next(self._seq), previous)
+            self._waiting.append(ticket)
+
+            try:
+                while True:
+                    if self._head_locked() is ticket and self.limiter.acquire(timeout=0):
+                        self._waiting.remove(ticket)
+                        self._virtual[priority] = max(self._virtual[priority], ticket.tag)
+                        waited = time.monotonic() - ticket.enqueued_at
+                        stats = self._stats[priority]
+                        stats['admitted'] += 1
+                        stats['wait_seconds'] += waited
+                        stats['max_wait'] = max(stats['max_wait'], waited)
+                        self._admitted_since_prune += 1
+                        if self._admitted_since_prune >= _PRUNE_EVERY:
+                            self._prune_locked()
+                        self._cond.notify_all()
+                        return True
+
+                    if cancel_token is not None:
+                        cancel_token.raise_if_cancelled()
+
+                    # 分段等待：老化和取消都需要定期重新检查
+                    wait = POLL_INTERVAL if cancel_token is not None else max(self.aging_seconds, POLL_INTERVAL)
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._abandon_locked(ticket)
+                            return False
+                        wait = min(wait, remaining)
+                    self._cond.wait(wait)
+            except BaseException:
+                self._abandon_locked(ticket)
+                raise
+
+    def _abandon_locked(self, ticket: _Ticket):
+        """放弃排队（超时 / 取消），撤销该请求对会话完成标签的推进"""
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+            self._stats[ticket.priority]['abandoned'] += 1
+            key = (ticket.priority, ticket.session)
+            # 之后同一会话又有请求入队时，标签已在此基础上推进，不再回退
+            if self._finish.get(key) == ticket.tag:
+                if ticket.previous_tag is None:
+                    del self._finish[key]
+                else:
+                    self._finish[key] = ticket.previous_tag
+            self._cond.notify_all()
+
+    def _prune_locked(self):
+        """
+        清理已落后于类别虚拟时间的完成标签（与没有记录等价），
+        避免每个会话（如每个 App 会话一个 uuid）的标签在进程生命周期内一直累积
+        """
+        self._admitted_since_prune = 0
+        stale = [key for key, tag in self._finish.items() if tag <= self._virtual[key[0]]]
+        for key in stale:
+            del self._finish[key]
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False):
+        """释放槽位，并唤醒排队中的请求"""
+        self.limiter.release(latency=latency, throttled=throttled)
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        """
+        调度统计
+
+        Returns:
+            {类别: {'queued', 'admitted', 'rejected', 'abandoned', 'avg_wait', 'max_wait'}}
+        """
+        with self._cond:
+            result = {}
+            for priority in PRIORITIES:
+                stats = self._stats[priority]
+                result[priority] = {
+                    'queued': self._queued_locked(priority),
+                    'admitted': stats['admitted'],
+                    'rejected': stats['rejected'],
+                    'abandoned': stats['abandoned'],
+                    'avg_wait': round(stats['wait_seconds'] / stats['admitted'], 3) if stats['admitted'] else 0.0,
+                    'max_wait': round(stats['max_wait'], 3)
+                }
+            return result
+
+
+def queue_limits_from_env() -> Dict[str, int]:
+    """读取各类别排队上限（SCRIPTFORGE_QUEUE_LIMIT_<类别>，0 表示不限制）"""
+    limits = {}
+    for priority in PRIORITIES:
+        value = os.getenv(f"SCRIPTFORGE_QUEUE_LIMIT_{priority.upper()}")
+        if value is not None:
+            limits[priority] = int(value)
+    return limits
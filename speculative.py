@@ -0,0 +1,168 @@
+"""
+Speculative Generation - 下一位发言者的后台预生成
+单次发言模式下，上一轮结束后立即在后台生成下一位角色的发言
+
+v3.5.0 新增功能
+"""
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, Hashable, Optional
+import threading
+
+from cancellation import CancellationToken
+
+
+class SpeculativeEngine:
+    """
+    预生成引擎
+
+    特性：
+    - 版本键：每次预生成绑定一个 key（历史版本号 + 发言者索引）
+    - 命中即用：点击时 key 一致则直接返回预生成结果
+    - 失效丢弃：key 不一致（例如用户插话）时丢弃结果，并统计浪费的 token；
+      提交时附带取消令牌的，丢弃时一并取消，进行中的请求尽早停止
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative")
+        self._lock = threading.RLock()
+        self._key: Optional[Hashable] = None
+        self._future: Optional[Future] = None
+        self._token_counter: Optional[Callable[[Any], int]] = None
+        self._cancel_token: Optional[CancellationToken] = None
+
+        # 统计
+        self.submitted = 0
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.wasted_tokens = 0
+
+    def submit(self, key: Hashable, fn: Callable[[], Any],
+               token_counter: Optional[Callable[[Any], int]] = None,
+               cancel_token: Optional[CancellationToken] = None) -> bool:
+        """
+        提交一次预生成（同一个 key 已在进行或已完成时不重复提交）
+
+        Args:
+            key: 预生成对应的历史版本键
+            fn: 生成函数（在后台线程执行，不得访问 UI 状态）
+            token_counter: 根据生成结果估算 token 数（用于统计浪费）
+            cancel_token: fn 使用的取消令牌（预生成被丢弃时取消）
+
+        Returns:
+            是否提交了新的预生成
+        """
+        with self._lock:
+            if self._future is not None and self._key == key:
+                return False
+
+            self._discard_locked()
+            self._key = key
+            self._token_counter = token_counter
+            self._cancel_token = cancel_token
+            self._future = self._executor.submit(fn)
+            self.submitted += 1
+            return True
+
+    def take(self, key: Hashable, timeout: Optional[float] = None) -> Optional[Any]:
+        """
+        取出预生成结果（key 一致才算命中；仍在生成时等待其完成）
+
+        Args:
+            key: 当前历史版本键
+            timeout: 等待预生成完成的最长秒数（None 表示一直等待）
+
+        Returns:
+            预生成结果；未命中或预生成失败时返回 None
+        """
+        with self._lock:
+            future = self._future
+            if future is None or self._key != key:
+                self.misses += 1
+                self._discard_locked()
+                return None
+            token_counter = self._token_counter
+            self._future = None
+            self._key = None
+            self._cancel_token = None
+
+        try:
+            result = future.result(timeout=timeout)
+        except Exception:
+            # 超时或生成失败：按未命中处理，结果（如果之后生成完成）计入浪费
+            with self._lock:
+                self.misses += 1
+                self.discarded += 1
+            future.add_done_callback(self._make_waste_callback(token_counter))
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def invalidate(self):
+        """丢弃当前的预生成（例如用户插话，历史已变化）"""
+        with self._lock:
+            self._discard_locked()
+
+    def _discard_locked(self):
+        """丢弃当前预生成（调用方需持有 _lock）"""
+        if self._future is None:
+            return
+
+        future = self._future
+        cancel_token = self._cancel_token
+        self._future = None
+        self._key = None
+        self._cancel_token = None
+        self.discarded += 1
+
+        # 尚未开始的直接取消；已在执行的通知其停止，等它结束后把已完成部分的 token 计入浪费
+        if not future.cancel():
+            if cancel_token is not None:
+                cancel_token.cancel("预生成已失效")
+            future.add_done_callback(self._make_waste_callback(self._token_counter))
+
+    def _make_waste_callback(self, token_counter: Optional[Callable[[Any], int]]) -> Callable[[Future], None]:
+        """生成统计浪费 token 的回调"""
+        def _on_done(future: Future):
+            if token_counter is None or future.cancelled() or future.exception() is not None:
+                return
+            try:
+                tokens = token_counter(future.result())
+            except Exception:
+                return
+            with self._lock:
+                self.wasted_tokens += tokens
+        return _on_done
+
+    def stats(self) -> Dict:
+        """
+        预生成统计
+
+        Returns:
+            {
+                'submitted': 提交次数,
+                'hits': 命中次数,
+                'misses': 未命中次数,
+                'discarded': 丢弃次数,
+                'hit_rate': 命中率（0-1）,
+                'wasted_tokens': 被丢弃结果的估算 token 数
+            }
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'submitted': self.submitted,
+                'hits': self.hits,
+                'misses': self.misses,
+                'discarded': self.discarded,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'wasted_tokens': self.wasted_tokens
+            }
+
+    def shutdown(self):
+        """关闭后台线程"""
+        self.invalidate()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,394 @@
+"""
+Structured Output - 导演系统结构化输出的解析、校验与修复
+为导演计划和审核结果定义 JSON Schema；宽容解析模型输出（代码块、前后说明、尾逗号、被截断的 JSON），
+不符合 Schema 时发起一次针对性的修复调用，并统计解析失败次数
+
+v3.5.0 新增功能
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
+import re
+import threading
+
+from cancellation import RoundCancelled
+from deadline import DeadlineExceeded
+
+
+# ==================== Schema ====================
+
+# 导演分配（两阶段模式）
+PLAN_SCHEMA = {
+    'type': 'object',
+    'required': ['selected_characters'],
+    'properties': {
+        'selected_characters': {'type': 'array', 'items': {'type': 'string'}},
+        'instructions': {'type': 'object', 'additionalProperties': {'type': 'string'}}
+    }
+}
+
+# 编导融合规划：剧情目标 + 导演分配
+FUSED_PLAN_SCHEMA = {
+    'type': 'object',
+    'required': ['plot_goal', 'selected_characters'],
+    'properties': {
+        'plot_goal': {'type': 'string'},
+        **PLAN_SCHEMA['properties']
+    }
+}
+
+# 审核结果（verdicts 中的单个判定也接受简写的 true / false）
+REVIEW_SCHEMA = {
+    'type': 'object',
+    'required': ['pass'],
+    'properties': {
+        'pass': {'type': 'boolean'},
+        'feedback': {'type': 'string'},
+        'verdicts': {
+            'type': 'object',
+            'additionalProperties': {
+                'type': ['object', 'boolean'],
+                'required': ['pass'],
+                'properties': {'pass': {'type': 'boolean'}, 'feedback': {'type': 'string'}}
+            }
+        },
+        'scores': {
+            'type': 'object',
+            'additionalProperties': {'type': 'number', 'minimum': 0, 'maximum': 10}
+        }
+    }
+}
+
+
+# ==================== 宽容解析 ====================
+
+class IncrementalJSONParser:
+    """
+    增量 JSON 解析器（只关心第一个顶层对象）
+
+    可以分块喂入模型输出（流式或一次性），跳过对象之前的说明文字和代码块标记，
+    跟踪字符串 / 括号状态；对象尚未闭合（输出被截断）时，回退到最后一个完整的成员并补齐括号。
+
+    用法：
+        parser = IncrementalJSONParser()
+        parser.feed(chunk1)
+        parser.feed(chunk2)
+        value = parser.value()   # 无法得到对象时为 None
+    """
+
+    def __init__(self):
+        self._chars: List[str] = []
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self.complete = False
+        # 最近一个可截断的位置：(文本长度, 当时未闭合的括号)
+        self._cut: Optional[Tuple[int, Tuple[str, ...]]] = None
+
+    def feed(self, chunk: str) -> bool:
+        """
+        喂入一段文本
+
+        Returns:
+            顶层对象是否已经闭合（闭合后的文本不再处理）
+        """
+        for ch in chunk:
+            if self.complete:
+                break
+            if not self._started:
+                if ch != '{':
+                    continue
+                self._started = True
+
+            self._chars.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._stack.append('}' if ch == '{' else ']')
+            elif ch in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if not self._stack:
+                    self.complete = True
+            elif ch == ',':
+                # 逗号之前的成员是完整的
+                self._cut = (len(self._chars) - 1, tuple(self._stack))
+        return self.complete
+
+    def text(self) -> str:
+        """目前收集到的对象文本"""
+        return "".join(self._chars)
+
+    def value(self) -> Optional[Any]:
+        """
+        解析出的对象
+
+        Returns:
+            dict / list；没有找到对象或无法补全时返回 None
+        """
+        if not self._started:
+            return None
+
+        text = self.text()
+        if self.complete:
+            return _loads_lenient(text)
+
+        # 被截断：先尝试直接补齐括号（截断点恰好在成员之后），再回退到最后一个完整成员
+        candidates = []
+        if not self._in_string:
+            candidates.append(text + "".join(reversed(self._stack)))
+        if self._cut is not None:
+            length, stack = self._cut
+            candidates.append(text[:length] + "".join(reversed(stack)))
+        candidates.append("{}")
+
+        for candidate in candidates:
+            value = _loads_lenient(candidate)
+            if value is not None:
+                return value
+        return None
+
+
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+
+def _loads_lenient(text: str) -> Optional[Any]:
+    """json.loads，失败时去掉尾逗号再试一次"""
+    for candidate in (text, _TRAILING_COMMA.sub(r'\1', text)):
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    return None
+
+
+def parse_json(text: str, max_candidates: int = 3) -> Optional[Dict]:
+    """
+    从模型输出中宽容地提取 JSON 对象
+
+    依次尝试文本中的前几个 '{'（前面的说明文字里可能也有花括号）
+
+    Args:
+        text: 模型输出
+        max_candidates: 最多尝试的起始位置数
+
+    Returns:
+        dict；找不到时返回 None
+    """
+    if not text:
+        return None
+    start = text.find('{')
+    for _ in range(max_candidates):
+        if start < 0:
+            break
+        parser = IncrementalJSONParser()
+        parser.feed(text[start:])
+        value = parser.value()
+        if isinstance(value, dict) and (value or parser.complete):
+            return value
+        start = text.find('{', start + 1)
+    return None
+
+
+# ==================== 校验 ====================
+
+_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'boolean': bool,
+    'number': (int, float),
+    'integer': int
+}
+
+_TRUE_WORDS = ('true', 'yes', '是', '通过')
+_FALSE_WORDS = ('false', 'no', '否', '不通过')
+
+
+def _matches(value: Any, type_name: str) -> bool:
+    if type_name in ('number', 'integer') and isinstance(value, bool):
+        return False
+    return isinstance(value, _TYPES[type_name])
+
+
+def _coerce(value: Any, schema: Dict) -> Any:
+    """按 Schema 修正常见的类型偏差（"true" → true、"8" → 8、单个字符串 → 列表）"""
+    types = schema.get('type')
+    types = [types] if isinstance(types, str) else (types or [])
+    if not types or any(_matches(value, t) for t in types):
+        if isinstance(value, dict):
+            properties = schema.get('properties', {})
+            extra = schema.get('additionalProperties')
+            return {
+                k: _coerce(v, properties.get(k) or (extra if isinstance(extra, dict) else {}))
+                for k, v in value.items()
+            }
+        if isinstance(value, list) and isinstance(schema.get('items'), dict):
+            return [_coerce(item, schema['items']) for item in value]
+        return value
+
+    if 'boolean' in types and isinstance(value, str):
+        word = value.strip().lower()
+        if word in _TRUE_WORDS:
+            return True
+        if word in _FALSE_WORDS:
+            return False
+    if ('number' in types or 'integer' in types) and isinstance(value, str):
+        try:
+            number = float(value.strip())
+            return int(number) if 'integer' in types and number.is_integer() else number
+        except ValueError:
+            return value
+    if 'array' in types and isinstance(value, str):
+        return [_coerce(value, schema.get('items', {}))]
+    if 'string' in types and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+
+def validate(value: Any, schema: Dict, path: str = '$') -> List[str]:
+    """
+    按 Schema 校验（支持 type / required / properties / additionalProperties / items / minimum / maximum）
+
+    Returns:
+        错误列表（空列表表示通过）
+    """
+    types = schema.get('type')
+    types = [types] if isinstance(types, str) else (types or [])
+    if types and not any(_matches(value, t) for t in types):
+        return [f"{path}: 应为 {' / '.join(types)}，实际为 {type(value).__name__}"]
+
+    errors = []
+    if isinstance(value, dict):
+        for key in schema.get('required', []):
+            if key not in value:
+                errors.append(f"{path}: 缺少字段 {key}")
+        properties = schema.get('properties', {})
+        extra = schema.get('additionalProperties')
+        for key, item in value.items():
+            if key in properties:
+                errors.extend(validate(item, properties[key], f"{path}.{key}"))
+            elif isinstance(extra, dict):
+                errors.extend(validate(item, extra, f"{path}.{key}"))
+    elif isinstance(value, list) and isinstance(schema.get('items'), dict):
+        for i, item in enumerate(value):
+            errors.extend(validate(item, schema['items'], f"{path}[{i}]"))
+    elif _matches(value, 'number'):
+        if 'minimum' in schema and value < schema['minimum']:
+            errors.append(f"{path}: 不能小于 {schema['minimum']}")
+        if 'maximum' in schema and value > schema['maximum']:
+            errors.append(f"{path}: 不能大于 {schema['maximum']}")
+    return errors
+
+
+def repair_prompt(text: str, schema: Dict, errors: List[str]) -> str:
+    """针对性修复的提示词：只要求按 Schema 改正格式，不重新创作内容"""
+    problems = "\n".join(f"- {e}" for e in errors[:10]) or "- 无法解析为 JSON"
+    return f"""下面的输出应当是符合 JSON Schema 的 JSON 对象，但存在以下问题：
+{problems}
+
+JSON Schema：
+{json.dumps(schema, ensure_ascii=False)}
+
+原输出：
+{text[:4000]}
+
+请在保留原意的前提下改正格式，只输出修正后的 JSON 对象，不要有其他说明。"""
+
+
+# ==================== 解析 + 修复 ====================
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _count(kind: str, key: str):
+    with _stats_lock:
+        stats = _stats.setdefault(kind, {'parsed': 0, 'recovered': 0, 'repaired': 0,
+                                         'failed': 0, 'parse_failures': 0})
+        stats[key] += 1
+
+
+def parse_structured(text: Optional[str], schema: Dict, kind: str,
+                     repair: Optional[Callable[[str], str]] = None) -> Optional[Dict]:
+    """
+    解析并校验结构化输出，不合格时调用一次 repair 修复
+
+    Args:
+        text: 模型输出
+        schema: JSON Schema
+        kind: 输出类别（统计用，如 'plan'、'review'）
+        repair: 修复调用（参数为修复提示词，返回新的模型输出）；None 表示不修复
+
+    Returns:
+        符合 Schema 的 dict；修复后仍不合格时返回 None
+
+    Raises:
+        RoundCancelled / DeadlineExceeded: 修复调用被取消或超时（其他异常按修复失败处理）
+    """
+    text = str(text or '').strip()
+    clean = _loads_lenient(text) if text.startswith('{') else None
+
+    value = parse_json(text)
+    errors = ["无法解析为 JSON 对象"] if value is None else []
+    if value is not None:
+        value = _coerce(value, schema)
+        errors = validate(value, schema)
+        if not errors:
+            _count(kind, 'parsed' if value == clean else 'recovered')
+            return value
+
+    _count(kind, 'parse_failures')
+    print(f"⚠️ {kind} 输出不符合格式: {'; '.join(errors[:3])}")
+
+    if repair is not None:
+        try:
+            repaired_text = repair(repair_prompt(text, schema, errors))
+        except (RoundCancelled, DeadlineExceeded):
+            _count(kind, 'failed')
+            raise
+        except Exception as e:
+            print(f"⚠️ {kind} 修复调用失败: {e}")
+        else:
+            value = parse_json(str(repaired_text or ''))
+            if value is not None:
+                value = _coerce(value, schema)
+                if not validate(value, schema):
+                    _count(kind, 'repaired')
+                    print(f"🔧 {kind} 输出已修复")
+                    return value
+
+    _count(kind, 'failed')
+    return None
+
+
+def structured_output_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    结构化输出统计（进程级）
+
+    Returns:
+        {类别: {'parsed': 直接解析, 'recovered': 宽容解析后合格, 'repaired': 修复后合格,
+                'failed': 修复后仍失败, 'parse_failures': 首次解析不合格次数, 'failure_rate': 最终失败率}}
+    """
+    with _stats_lock:
+        result = {kind: dict(stats) for kind, stats in _stats.items()}
+    for stats in result.values():
+        total = stats['parsed'] + stats['recovered'] + stats['repaired'] + stats['failed']
+        stats['failure_rate'] = round(stats['failed'] / total, 3) if total else 0.0
+    return result
+
+
+def reset_structured_output_stats():
+    """清空统计（基准测试在每个项目开始前调用）"""
+    with _stats_lock:
+        _stats.clear()
@@ -0,0 +1,237 @@
+"""
+Round Tracing - 导演系统每轮的分阶段耗时追踪
+记录每个阶段（编剧 / 导演 / 各角色 / 审核 / 每次重试）的墙钟耗时、LLM 延迟、token 和缓存命中，可导出为 JSON Lines
+
+v3.5.0 新增功能
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+import json
+import os
+import threading
+import time
+import uuid
+
+
+class StageSpan:
+    """一个阶段的统计（子阶段的 LLM 用量同时计入父阶段）"""
+
+    def __init__(self, name: str, parent: Optional['StageSpan'] = None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.offset = 0.0
+        self.wall_time: Optional[float] = None
+        self.status = 'ok'
+        self.llm_calls = 0
+        self.llm_latency = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hits = 0
+
+    def to_dict(self) -> Dict:
+        data = {
+            'stage': self.name,
+            'parent': self.parent.name if self.parent is not None else None,
+            'offset': round(self.offset, 4),
+            'wall_time': round(self.wall_time if self.wall_time is not None else time.perf_counter() - self.start, 4),
+            'status': self.status,
+            'llm_calls': self.llm_calls,
+            'llm_latency': round(self.llm_latency, 4),
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cache_hits': self.cache_hits
+        }
+        data.update(self.attrs)
+        return data
+
+
+class RoundTrace:
+    """
+    一轮对话的分阶段追踪
+
+    用法：
+        trace = RoundTrace()
+        with trace.activate():
+            with stage('writer'):
+                ...  # 期间经过 llm_backend 的调用自动记入 writer 阶段
+
+    - 通过 contextvars 传递：call_with_deadline 的工作线程、复制了上下文的并发任务都会继承当前阶段
+    - 嵌套的 stage() 形成父子关系（例如 perform → character:名字），子阶段的用量同时计入父阶段
+    """
+
+    def __init__(self, round_id: Optional[str] = None):
+        """
+        Args:
+            round_id: 轮次 ID（默认随机生成）
+        """
+        self.round_id = round_id or uuid.uuid4().hex[:12]
+        self.started_at = datetime.now().isoformat()
+        self.start = time.perf_counter()
+        self.wall_time: Optional[float] = None
+        self.spans: List[StageSpan] = []
+        self._extra: List[Dict] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        """在代码块内把本追踪设为当前追踪（结束时记录整轮耗时）"""
+        token = _current.set((self, None))
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+            self.wall_time = time.perf_counter() - self.start
+
+    def _open(self, name: str, parent: Optional[StageSpan], attrs: Dict) -> StageSpan:
+        span = StageSpan(name, parent, **attrs)
+        span.offset = span.start - self.start
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def _record(self, span: StageSpan, prompt_tokens: int, completion_tokens: int,
+                latency: float, cached: bool, calls: int):
+        with self._lock:
+            while span is not None:
+                span.llm_calls += calls
+                span.llm_latency += latency
+                span.prompt_tokens += prompt_tokens
+                span.completion_tokens += completion_tokens
+                span.cache_hits += 1 if cached else 0
+                span = span.parent
+
+    def merge(self, other: 'RoundTrace', **attrs):
+        """并入另一个追踪的阶段（例如流水线中提前完成的规划），attrs 附加到每个阶段上"""
+        for data in other.stages():
+            self._extra.append({**data, **attrs})
+
+    def stages(self) -> List[Dict]:
+        """所有阶段（按开始顺序）"""
+        with self._lock:
+            return list(self._extra) + [span.to_dict() for span in self.spans]
+
+    def total_tokens(self) -> int:
+        """本轮目前为止消耗的 token（prompt + completion）"""
+        return sum(data['prompt_tokens'] + data['completion_tokens']
+                   for data in self.stages() if data['parent'] is None)
+
+    def to_dict(self) -> Dict:
+        """
+        Returns:
+            {
+                'round_id': 轮次 ID,
+                'started_at': 开始时间,
+                'wall_time': 整轮墙钟耗时,
+                'totals': {'llm_calls', 'llm_latency', 'prompt_tokens', 'completion_tokens', 'cache_hits'},
+                'stages': [{'stage', 'parent', 'offset', 'wall_time', 'status', 'llm_calls', ...}, ...]
+            }
+        """
+        stages = self.stages()
+        totals = {'llm_calls': 0, 'llm_latency': 0.0, 'prompt_tokens': 0,
+                  'completion_tokens': 0, 'cache_hits': 0}
+        for data in stages:
+            if data['parent'] is None:  # 子阶段已计入父阶段
+                for key in totals:
+                    totals[key] += data[key]
+        totals['llm_latency'] = round(totals['llm_latency'], 4)
+
+        return {
+            'round_id': self.round_id,
+            'started_at': self.started_at,
+            'wall_time': round(self.wall_time if self.wall_time is not None else time.perf_counter() - self.start, 4),
+            'totals': totals,
+            'stages': stages
+        }
+
+    def to_jsonl(self) -> str:
+        """导出为 JSON Lines（每个阶段一行，带轮次 ID 和开始时间）"""
+        lines = [
+            json.dumps({'round_id': self.round_id, 'started_at': self.started_at, **data}, ensure_ascii=False)
+            for data in self.stages()
+        ]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def append_to(self, path: str):
+        """追加写入 JSON Lines 文件（多线程安全）"""
+        text = self.to_jsonl()
+        if not text:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with _file_lock:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(text)
+
+
+# ==================== 当前追踪 ====================
+
+_current: ContextVar[tuple] = ContextVar('scriptforge_trace', default=(None, None))
+_file_lock = threading.Lock()
+
+
+def current_trace() -> Optional[RoundTrace]:
+    """当前上下文的追踪（没有时返回 None）"""
+    return _current.get()[0]
+
+
+@contextmanager
+def stage(name: str, **attrs):
+    """
+    记录一个阶段（没有当前追踪时不做任何事）
+
+    代码块内抛出的异常会记到阶段状态上（timeout / cancelled / error）并继续向外抛出
+
+    Args:
+        name: 阶段名（如 'writer'、'character:勇士'、'review'）
+        **attrs: 附加字段（如 attempt=1）
+    """
+    trace, parent = _current.get()
+    if trace is None:
+        yield None
+        return
+
+    span = trace._open(name, parent, attrs)
+    token = _current.set((trace, span))
+    try:
+        yield span
+    except BaseException as e:
+        span.status = _status_for(e)
+        raise
+    finally:
+        _current.reset(token)
+        span.wall_time = time.perf_counter() - span.start
+
+
+def _status_for(error: BaseException) -> str:
+    name = type(error).__name__
+    if name == 'DeadlineExceeded':
+        return 'timeout'
+    if name == 'RoundCancelled':
+        return 'cancelled'
+    return 'error'
+
+
+def record_llm_usage(prompt_tokens: int = 0, completion_tokens: int = 0, latency: float = 0.0,
+                     cached: bool = False, calls: int = 1):
+    """把一次 LLM 调用记入当前阶段（没有当前阶段时忽略）"""
+    trace, span = _current.get()
+    if trace is None or span is None:
+        return
+    trace._record(span, prompt_tokens, completion_tokens, latency, cached, calls)
+
+
+def current_llm_calls() -> int:
+    """当前阶段已记录的 LLM 调用数（用于判断是否需要用其他来源补记用量）"""
+    span = _current.get()[1]
+    return span.llm_calls if span is not None else 0
+
+
+def trace_file() -> Optional[str]:
+    """自动导出追踪的文件路径（SCRIPTFORGE_TRACE_FILE，未设置时不导出）"""
+    return os.getenv('SCRIPTFORGE_TRACE_FILE') or None